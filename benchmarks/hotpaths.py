@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+
+"""Benchmarks the hot paths of the chat clients offline: ingestion, tokenisation,
+streaming, rendering and persistence.
+
+Directory stages run against synthetic repository trees, generated afresh from
+a fixed seed: nested source packages, markdown and JSON, binary assets, and
+deep trees that are ignored (node_modules, .git, build output and paths in a
+.gitignore). Streams are replayed through each provider's SDK from a local
+fake server (chatcore.fakeserver), so no API key or network is needed. The
+tokenize, ingest and save stages do need tiktoken's cl100k_base encoding,
+which tiktoken downloads on first use and caches (in $TIKTOKEN_CACHE_DIR,
+or data-gym-cache in the temporary directory), so the first run that includes
+them needs network access, or a cache copied from another machine.
+
+Each stage reports its throughput, from the median of --repeat timed runs, and
+its peak Python memory, from one more run under tracemalloc. Results can be
+saved with --save and compared against a saved baseline with --baseline.
+
+Usage: python3 benchmarks/hotpaths.py [STAGE ...] [--files N ...] [--repeat N]
+                                      [--save [PATH]] [--baseline PATH]
+
+Exits with status 1 if a stage fails, or is more than --threshold percent
+slower or larger than the baseline.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from chatcore.backends import BACKENDS, Usage
+from chatcore.fakeserver import FakeProvider, Transcript
+from chatcore.history import ChatWriter, load_chat, open_chat_catalogue
+from chatcore.ingest import (DEFAULT_IGNORE_PATTERNS, DirectoryTree, IgnoreMatcher, generate_markdown_from_directory,
+                             read_text_file, walk_directory)
+from chatcore.render import StreamingMarkdown
+from chatcore.tokens import Tokenizer
+
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+TREE_SIZES = (1000, 10000)
+TREE_SEED = 1
+# Share of the generated files that are ignored, and that are binary. The rest are text.
+IGNORED_SHARE = 0.2
+BINARY_SHARE = 0.1
+STREAM_REQUESTS = 3
+# Deltas received between refreshes while rendering: a 10 Hz refresh of a reply streaming at 80 tokens a second.
+RENDER_DELTAS_PER_REFRESH = 8
+# Stages that count tokens, and so need the tokenizer's encoding.
+TOKENIZER_STAGES = {"tokenize", "ingest", "save"}
+SAVE_TURNS = 500
+REGRESSION_THRESHOLD_PERCENT = 15
+# Ingestion is benchmarked without a token limit, so every file is read and counted.
+UNLIMITED_TOKENS = 10 ** 12
+
+SOURCE_LINES = [
+    "import os", "from collections import defaultdict", "", "class Handler:",
+    "    \"\"\"Handles one request.\"\"\"", "    def __init__(self, config):", "        self.config = config",
+    "    def run(self, items: list[str]) -> dict:", "        counts = defaultdict(int)",
+    "        for item in items:", "            counts[item.strip().lower()] += 1", "        return dict(counts)",
+    "# TODO: cache the results between calls", "def main():", "    print(Handler({}).run(os.listdir('.')))",
+    "    return 0", "if __name__ == '__main__':", "    raise SystemExit(main())",
+]
+MARKDOWN_LINES = [
+    "# Overview", "", "This module parses the configuration and **validates** it.", "- first item", "- second item",
+    "", "```python", "value = parse(text)", "```", "", "| key | value |", "| --- | --- |", "| a | 1 |",
+]
+
+def text_file_contents(rng: random.Random, lines: list[str]) -> str:
+    # Around 2 KB on average, with the long tail of sizes a real repository has.
+    line_count = min(int(rng.lognormvariate(3.5, 0.9)) + 1, 800)
+    return "\n".join(rng.choices(lines, k=line_count)) + "\n"
+
+def generate_tree(root: str, file_count: int, seed: int = TREE_SEED) -> dict:
+    """Writes a synthetic repository of file_count files under root and returns how many of each kind it has."""
+    rng = random.Random(seed)
+    with open(os.path.join(root, ".gitignore"), "w") as f:
+        f.write("*.log\ngenerated/\n")
+    counts = {"text": 0, "binary": 0, "ignored": 0}
+    for index in range(file_count):
+        kind = rng.random()
+        if kind < IGNORED_SHARE:
+            counts["ignored"] += 1
+            choice = rng.randrange(5)
+            if choice == 0:
+                # A deep dependency tree, which the walk should never enter.
+                depth = rng.randint(4, 12)
+                directory = os.path.join("node_modules", *(f"pkg{rng.randrange(40)}" for _ in range(depth)))
+                name = f"index{index}.js"
+            elif choice == 1:
+                directory = os.path.join(".git", "objects", f"{rng.randrange(256):02x}")
+                name = f"{index:038x}"
+            elif choice == 2:
+                directory = os.path.join("src", f"pkg{rng.randrange(20)}", "__pycache__")
+                name = f"mod{index}.cpython-311.pyc"
+            elif choice == 3:
+                directory = os.path.join("generated", f"part{rng.randrange(10)}")
+                name = f"out{index}.py"
+            else:
+                directory = "logs"
+                name = f"run{index}.log"
+            contents = text_file_contents(rng, SOURCE_LINES)
+        elif kind < IGNORED_SHARE + BINARY_SHARE:
+            counts["binary"] += 1
+            directory = os.path.join("assets", f"set{rng.randrange(20)}")
+            # Not an extension the default ignore rules skip, so these are read and sniffed as binary.
+            name = f"blob{index}.dat"
+            contents = b"DAT\x00" + rng.randbytes(rng.randint(1024, 65536))
+        else:
+            counts["text"] += 1
+            package = os.path.join("src", f"pkg{rng.randrange(20)}", f"sub{rng.randrange(10)}")
+            extension = rng.choice((".py", ".py", ".py", ".md", ".json", ".js"))
+            directory = "docs" if extension == ".md" and rng.random() < 0.5 else package
+            name = f"file{index}{extension}"
+            contents = text_file_contents(rng, MARKDOWN_LINES if extension == ".md" else SOURCE_LINES)
+        os.makedirs(os.path.join(root, directory), exist_ok=True)
+        mode = "wb" if isinstance(contents, bytes) else "w"
+        with open(os.path.join(root, directory, name), mode) as f:
+            f.write(contents)
+    return counts
+
+def synthetic_reply(paragraphs: int = 60, seed: int = TREE_SEED) -> str:
+    """Returns a long markdown reply, mixing prose, lists and code blocks, to stream and render."""
+    rng = random.Random(seed)
+    blocks = []
+    for index in range(paragraphs):
+        kind = index % 4
+        if kind == 0:
+            blocks.append(f"## Section {index}\n\n" + " ".join(rng.choices(
+                "the handler parses each item and counts it before returning the totals".split(), k=60)))
+        elif kind == 1:
+            blocks.append("\n".join(f"- {line.strip() or 'blank'}" for line in rng.choices(SOURCE_LINES, k=6)))
+        elif kind == 2:
+            blocks.append("```python\n" + "\n".join(rng.choices(SOURCE_LINES, k=12)) + "\n```")
+        else:
+            blocks.append(" ".join(rng.choices("**bold** `code` plain words *emphasis* and more".split(), k=80)))
+    return "\n\n".join(blocks) + "\n"
+
+class Stage:
+    """A benchmark: run() does the measured work and returns (items, bytes) processed."""
+
+    def __init__(self, name: str, unit: str, run, setup=None):
+        self.name = name
+        self.unit = unit
+        self.run = run
+        self.setup = setup
+
+def measure(stage: Stage, repeat: int) -> dict:
+    """Returns the stage's median time and throughput over repeat runs, and its peak traced memory."""
+    timings = []
+    for _ in range(repeat):
+        if stage.setup is not None:
+            stage.setup()
+        started = time.perf_counter()
+        items, size = stage.run()
+        timings.append(time.perf_counter() - started)
+    if stage.setup is not None:
+        stage.setup()
+    tracemalloc.start()
+    try:
+        stage.run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    seconds = statistics.median(timings)
+    return {"unit": stage.unit, "items": items, "bytes": size, "seconds": seconds,
+            "items_per_second": items / seconds if seconds else None,
+            "mb_per_second": size / seconds / 1e6 if seconds and size else None,
+            "peak_mib": peak / 2 ** 20}
+
+def tree_stages(root: str, file_count: int, tokenizer: Tokenizer, scratch: str) -> list[Stage]:
+    """Returns the stages that run against a generated tree of file_count files."""
+    all_paths = []
+    text_contents = []
+    for directory, subdirs, files in os.walk(root):
+        all_paths += [(os.path.join(directory, name), True) for name in subdirs]
+        all_paths += [(os.path.join(directory, name), False) for name in files]
+    for entry in walk_directory(root, IgnoreMatcher(root)):
+        contents = read_text_file(entry.path)
+        if contents is not None:
+            text_contents.append(contents)
+    text_bytes = sum(len(contents) for contents in text_contents)
+    cache_path = os.path.join(scratch, f"upload-cache-{file_count}.sqlite3")
+
+    def ignore():
+        matcher = IgnoreMatcher(root, DEFAULT_IGNORE_PATTERNS)
+        for path, is_dir in all_paths:
+            matcher.should_ignore(path, is_dir=is_dir)
+        return len(all_paths), 0
+
+    def walk():
+        return sum(1 for _ in walk_directory(root, IgnoreMatcher(root), DirectoryTree(root))), 0
+
+    def ingest(cache_path=None):
+        markdown, tokens = generate_markdown_from_directory(root, UNLIMITED_TOKENS, tokenizer, cache_path)
+        return len(text_contents), len(markdown)
+
+    def clear_cache():
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+
+    def warm_cache():
+        if not os.path.exists(cache_path):
+            ingest(cache_path)
+
+    def tokenize():
+        tokenizer.count_batch(text_contents)
+        return len(text_contents), text_bytes
+
+    return [
+        Stage(f"ignore[{file_count}]", "paths", ignore),
+        Stage(f"walk[{file_count}]", "files", walk),
+        Stage(f"tokenize[{file_count}]", "files", tokenize),
+        Stage(f"ingest[{file_count}]", "files", ingest),
+        Stage(f"ingest-cold-cache[{file_count}]", "files", lambda: ingest(cache_path), setup=clear_cache),
+        Stage(f"ingest-warm-cache[{file_count}]", "files", lambda: ingest(cache_path), setup=warm_cache),
+    ]
+
+def render_stage(transcript: Transcript) -> Stage:
+    from rich.console import Console
+    from rich.live import Live
+
+    reply_bytes = sum(len(delta) for delta in transcript.deltas)
+
+    def render():
+        console = Console(file=io.StringIO(), force_terminal=True, width=100)
+        # Refreshed every few deltas rather than on a timer, so that the work done doesn't depend on
+        # how fast the machine is.
+        with Live("", console=console, auto_refresh=False) as live:
+            renderer = StreamingMarkdown(live, refresh_per_second=1e-9)
+            for index, delta in enumerate(transcript.deltas, 1):
+                renderer.feed(delta)
+                if index % RENDER_DELTAS_PER_REFRESH == 0:
+                    renderer.refresh()
+            renderer.finish()
+        return len(transcript.deltas), reply_bytes
+
+    return Stage("render", "deltas", render)
+
+def stream_stages(transcript: Transcript) -> list[Stage]:
+    """Returns a stage per backend that streams STREAM_REQUESTS replies from the fake provider."""
+    stages = []
+    for name, backend_class in BACKENDS.items():
+        def stream(backend_class=backend_class):
+            async def replay():
+                backend = backend_class()
+                request = backend.build_request([{"role": "user", "content": "Benchmark"}], "You are a benchmark.")
+                deltas = 0
+                for _ in range(STREAM_REQUESTS):
+                    async for _ in backend.stream_reply(request, Usage()):
+                        deltas += 1
+                await backend.client.close()
+                return deltas
+            return asyncio.run(replay()), STREAM_REQUESTS * sum(len(delta) for delta in transcript.deltas)
+        stages.append(Stage(f"stream[{name}]", "deltas", stream))
+    return stages
+
+def save_stages(scratch: str, tokenizer: Tokenizer, transcript: Transcript) -> list[Stage]:
+    reply = "".join(transcript.deltas)
+    chat_dir = os.path.join(scratch, "chat-history")
+    state = {}
+
+    def new_chat():
+        os.makedirs(chat_dir, exist_ok=True)
+        for name in os.listdir(chat_dir):
+            os.remove(os.path.join(chat_dir, name))
+        with contextlib.redirect_stdout(io.StringIO()):  # the catalogue reports that it is indexing
+            state["writer"] = ChatWriter(chat_dir, open_chat_catalogue(chat_dir, tokenizer))
+
+    def save():
+        # One save per turn, each appending the prompt and the reply, as a chat does.
+        writer = state["writer"]
+        messages = []
+        for turn in range(SAVE_TURNS):
+            messages.append({"role": "user", "content": f"Question {turn}"})
+            messages.append({"role": "assistant", "content": reply})
+            writer.save(messages)
+        state["path"] = writer.path
+        return SAVE_TURNS, os.path.getsize(writer.path)
+
+    def load():
+        messages = load_chat(state["path"])
+        return len(messages), os.path.getsize(state["path"])
+
+    return [Stage("save", "turns", save, setup=new_chat), Stage("load", "messages", load)]
+
+def format_rate(value: float | None) -> str:
+    return f"{value:,.0f}" if value is not None else "-"
+
+def compare(result: dict, baseline: dict | None, threshold: float) -> tuple[str, bool]:
+    """Returns how a stage's result differs from the baseline's, and whether it has regressed."""
+    if not baseline or not baseline.get("items_per_second") or not result.get("items_per_second"):
+        return "", False
+    speed = (result["items_per_second"] / baseline["items_per_second"] - 1) * 100
+    memory = (result["peak_mib"] / baseline["peak_mib"] - 1) * 100 if baseline.get("peak_mib") else 0
+    regressed = speed < -threshold or memory > threshold
+    return f"{speed:+.0f}% speed, {memory:+.0f}% memory{' REGRESSED' if regressed else ''}", regressed
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    stage_kinds = ("ignore", "walk", "tokenize", "ingest", "render", "stream", "save")
+    parser = argparse.ArgumentParser(description="Benchmark ingestion, tokenisation, streaming, rendering "
+                                                 "and persistence offline.")
+    parser.add_argument("stages", nargs="*", metavar="stage",
+                        help=f"stages to run, from {', '.join(stage_kinds)} (default: all of them)")
+    parser.add_argument("--files", type=int, nargs="+", default=list(TREE_SIZES),
+                        help=f"sizes of the synthetic trees, in files (default: {' '.join(map(str, TREE_SIZES))})")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage (default: 3)")
+    parser.add_argument("--save", nargs="?", const="", metavar="PATH",
+                        help=f"save the results, by default to {os.path.relpath(RESULTS_DIR, REPO_ROOT)}/<time>.json")
+    parser.add_argument("--baseline", metavar="PATH", help="compare with results saved by an earlier run")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD_PERCENT,
+                        help=f"percent slower or larger than the baseline that counts as a regression "
+                             f"(default: {REGRESSION_THRESHOLD_PERCENT})")
+    args = parser.parse_args()
+    for name in args.stages:
+        if name not in stage_kinds:
+            parser.error(f"unknown stage '{name}'")
+    selected = set(args.stages or stage_kinds)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+
+    tokenizer = Tokenizer("cl100k_base")
+    if selected & TOKENIZER_STAGES:
+        # Loaded up front, so that a missing encoding is reported once rather than as failures of every stage.
+        try:
+            tokenizer.get_encoding()
+        except Exception as e:
+            sys.exit(f"Couldn't load tiktoken's {tokenizer.encoding_name} encoding ({type(e).__name__}: {e}).\n"
+                     "The tokenize, ingest and save stages need it. tiktoken downloads it on first use, so "
+                     "run them once with network access, or leave them out.")
+    transcript = Transcript.from_text(synthetic_reply())
+    results = {}
+    failed = regressed = False
+    with tempfile.TemporaryDirectory() as scratch, FakeProvider(transcript) as provider:
+        os.environ.update(provider.environment())
+        stages = []
+        for file_count in args.files:
+            if selected & {"ignore", "walk", "tokenize", "ingest"}:
+                root = os.path.join(scratch, f"tree-{file_count}")
+                os.makedirs(root)
+                started = time.perf_counter()
+                counts = generate_tree(root, file_count)
+                print(f"Generated {file_count:,} files ({counts['text']:,} text, {counts['binary']:,} binary, "
+                      f"{counts['ignored']:,} ignored) in {time.perf_counter() - started:.1f}s")
+                stages += [stage for stage in tree_stages(root, file_count, tokenizer, scratch)
+                           if stage.name.split("[")[0].split("-")[0] in selected]
+        if "render" in selected:
+            stages.append(render_stage(transcript))
+        if "stream" in selected:
+            stages += stream_stages(transcript)
+        if "save" in selected:
+            stages += save_stages(scratch, tokenizer, transcript)
+
+        print(f"\n{'stage':28} {'items/s':>12} {'MB/s':>8} {'seconds':>9} {'peak MiB':>9}")
+        for stage in stages:
+            try:
+                result = measure(stage, args.repeat)
+            except Exception as e:
+                failed = True
+                print(f"{stage.name:28} failed: {type(e).__name__}: {e}")
+                continue
+            results[stage.name] = result
+            change, stage_regressed = compare(result, baseline.get(stage.name), args.threshold)
+            regressed = regressed or stage_regressed
+            mb_per_second = f"{result['mb_per_second']:.2f}" if result["mb_per_second"] else "-"
+            print(f"{stage.name:28} {format_rate(result['items_per_second']):>12} {mb_per_second:>8} "
+                  f"{result['seconds']:9.3f} {result['peak_mib']:9.1f}  {result['unit']}  {change}")
+
+    if args.save is not None:
+        path = args.save or os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"created": datetime.now().isoformat(timespec="seconds"), "commit": git_commit(),
+                       "python": platform.python_version(), "platform": platform.platform(),
+                       "cpus": os.cpu_count(), "repeat": args.repeat, "results": results}, f, indent=2)
+        print(f"\nSaved to {path}")
+    sys.exit(1 if failed or regressed else 0)
+
+if __name__ == "__main__":
+    main()
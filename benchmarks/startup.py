@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+"""Measures how long the chat clients take to show their main menu.
+
+Each client is started with a fresh, empty home directory, and timed from
+launch until "Choose (1-3):" is written to stdout. A further run under
+`python -X importtime` lists the imports that cost the most before the menu,
+so a regression can be traced to the module that caused it.
+
+Usage: python3 benchmarks/startup.py [claude|chatbot|groqbot ...] [--runs N]
+
+Exits with status 1 if the median time of any client is over the target.
+"""
+
+import argparse
+import os
+import re
+import select
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+CLIENTS = {
+    "claude": os.path.join(REPO_ROOT, "claude", "claude.py"),
+    "chatbot": os.path.join(REPO_ROOT, "chatbot", "chatbot.py"),
+    "groqbot": os.path.join(REPO_ROOT, "groqbot", "groqbot.py"),
+}
+MENU_PROMPT = b"Choose (1-3):"
+STARTUP_TARGET_MS = 150
+STARTUP_TIMEOUT_SECONDS = 30
+SLOWEST_IMPORTS = 10
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def time_to_menu(script: str, home: str, extra_args: list[str] = []) -> tuple[float, bytes]:
+    """Starts a client and returns the seconds until its menu appeared, and what it wrote to stderr."""
+    env = {**os.environ, "HOME": home, "PYTHONUNBUFFERED": "1"}
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, *extra_args, script], env=env, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output = b""
+    try:
+        while MENU_PROMPT not in output:
+            remaining = STARTUP_TIMEOUT_SECONDS - (time.perf_counter() - started)
+            ready, _, _ = select.select([process.stdout], [], [], max(remaining, 0))
+            if not ready:
+                raise TimeoutError(f"{script} didn't show its menu within {STARTUP_TIMEOUT_SECONDS}s")
+            chunk = os.read(process.stdout.fileno(), 65536)
+            if not chunk:
+                raise RuntimeError(f"{script} exited before showing its menu:\n{process.stderr.read().decode()}")
+            output += chunk
+        elapsed = time.perf_counter() - started
+    finally:
+        process.kill()
+    _, stderr = process.communicate()
+    return elapsed, stderr
+
+def interpreter_startup(runs: int) -> float:
+    """Returns the median milliseconds the interpreter takes to start and exit with nothing to do."""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+def slowest_imports(importtime_output: bytes) -> list[tuple[int, str]]:
+    """Returns the (cumulative microseconds, module) of the slowest imports made by the client's
+    own modules, or by the interpreter itself."""
+    imports = []
+    for line in importtime_output.decode(errors="replace").splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        # Nested imports are indented by two spaces a level. Only the first two levels are kept, so a
+        # module isn't counted again under everything that imported it.
+        if match and len(match.group(3)) <= 3:
+            imports.append((int(match.group(2)), match.group(4)))
+    return sorted(imports, reverse=True)[:SLOWEST_IMPORTS]
+
+def main():
+    parser = argparse.ArgumentParser(description="Time how long the chat clients take to show their menu.")
+    parser.add_argument("clients", nargs="*", metavar="client",
+                        help=f"clients to time, from {', '.join(CLIENTS)} (default: all of them)")
+    parser.add_argument("--runs", type=int, default=10, help="timed runs per client (default: 10)")
+    args = parser.parse_args()
+    for name in args.clients:
+        if name not in CLIENTS:
+            parser.error(f"unknown client '{name}'")
+
+    # Reported alongside the clients, as it sets a floor that no change to them can go below.
+    print(f"python -c pass: median {interpreter_startup(args.runs):.0f} ms over {args.runs} runs")
+    over_target = False
+    for name in args.clients or CLIENTS:
+        with tempfile.TemporaryDirectory() as home:
+            # The first run creates the history directory and catalogue, and compiles any stale .pyc files.
+            time_to_menu(CLIENTS[name], home)
+            timings = [time_to_menu(CLIENTS[name], home)[0] * 1000 for _ in range(args.runs)]
+            _, importtime_output = time_to_menu(CLIENTS[name], home, ["-X", "importtime"])
+
+        median = statistics.median(timings)
+        status = "OK" if median <= STARTUP_TARGET_MS else "OVER TARGET"
+        over_target = over_target or median > STARTUP_TARGET_MS
+        print(f"{name}: median {median:.0f} ms, min {min(timings):.0f} ms, max {max(timings):.0f} ms "
+              f"over {args.runs} runs (target {STARTUP_TARGET_MS} ms) {status}")
+        print("  Slowest imports before the menu (cumulative, as reported by -X importtime):")
+        for microseconds, module in slowest_imports(importtime_output):
+            print(f"  {microseconds / 1000:8.1f} ms  {module}")
+    sys.exit(1 if over_target else 0)
+
+if __name__ == "__main__":
+    main()
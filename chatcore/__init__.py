@@ -0,0 +1,6 @@
+"""Shared engine behind the claude, chatbot and groqbot chat clients.
+
+Directory ingestion, token estimation, chat history, context management and
+streaming output all live here once. Each client script only chooses which
+backend it starts with and where its history is kept.
+"""
@@ -0,0 +1,216 @@
+import importlib
+import os
+import sys
+import threading
+
+from rich import print
+from rich.markup import escape
+
+from chatcore.backends import BACKENDS, Backend, base_url_environment
+from chatcore.history import (ChatWriter, ensure_chat_history_dir, get_todays_chat_dir, load_chat,
+                              open_chat_catalogue, summarise_message)
+from chatcore.render import console
+
+CHATS_PER_PAGE = 20
+# Modules that take a while to import but aren't needed until after the menu, loaded by warm_backend.
+DEFERRED_MODULES = ("prompt_toolkit", "rich.markdown", "chatcore.session")
+
+def select_chat_file(catalogue):
+    """Provides a UI to select an old chat from the chat history catalogue."""
+    page = 0
+    search = ""
+    while True:
+        chats = catalogue.recent(CHATS_PER_PAGE, page * CHATS_PER_PAGE, search)
+        if not chats:
+            if search:
+                print(f"No chats match '{search}'.")
+                search = ""
+                continue
+            print("No previous chats available.")
+            return None
+
+        heading = f"matching '{search}' " if search else ""
+        console.print(f"[bold cyan]\nHere are the most recent chats {heading}(page {page + 1}) sorted by most recent first:[/]")
+        for idx, chat in enumerate(chats):
+            console.print(f"{idx + 1}) {chat['name']}  ({chat['message_count']} messages, {chat['token_total']:,} tokens)  "
+                          f"{summarise_message(chat['title'], 60)}", markup=False)
+
+        print("\nSelect a chat to resume (number), or press Enter for the most recent chat.\n"
+              "n/p: next/previous page, /text: filter chats, ?number: preview a chat")
+        user_input = input().strip()
+        if user_input == "":
+            # Default to the first chat if user just presses enter
+            return chats[0]["path"]
+        if user_input == "n":
+            if len(chats) == CHATS_PER_PAGE:
+                page += 1
+            continue
+        if user_input == "p":
+            page = max(page - 1, 0)
+            continue
+        if user_input.startswith("/"):
+            search = user_input[1:].strip()
+            page = 0
+            continue
+
+        preview = user_input.startswith("?")
+        try:
+            choice = int(user_input.lstrip("?")) - 1
+        except ValueError:
+            print("Invalid input. Please enter a number.")
+            continue
+
+        if not 0 <= choice < len(chats):
+            print("Invalid choice. Please select a valid chat number.")
+            continue
+        if preview:
+            chat = chats[choice]
+            console.print(f"[bold cyan]\n{chat['name']}[/] ({chat['message_count']} messages, "
+                          f"{chat['token_total']:,} tokens, {chat['byte_size']:,} bytes)")
+            console.print(f"First prompt: {chat['title']}\nLatest message: {chat['preview']}", markup=False)
+            continue
+        return chats[choice]["path"]
+
+def search_chat_history(catalogue):
+    """Provides a UI to search all saved chats and select one to resume."""
+    if not catalogue.searchable:
+        print("Search is unavailable because this SQLite build doesn't support FTS5.")
+        return None
+    while True:
+        query = input("\nSearch chat history (or press Enter to cancel): ").strip()
+        if not query:
+            return None
+        results = catalogue.search(query)
+        if not results:
+            print(f"No chats match '{query}'.")
+            continue
+
+        console.print(f"[bold cyan]\nBest matching chats for '{escape(query)}':[/]")
+        for idx, result in enumerate(results):
+            snippet = escape(" ".join(result["snippet"].split()))
+            snippet = snippet.replace("\x02", "[bold yellow]").replace("\x03", "[/]")
+            console.print(f"{idx + 1}) [bold]{result['name']}[/]  {escape(summarise_message(result['title'], 60))}\n"
+                          f"   {result['role']}: {snippet}")
+
+        user_input = input("\nSelect a chat to resume (number), or press Enter to search again: ").strip()
+        if user_input == "":
+            continue
+        try:
+            choice = int(user_input) - 1
+        except ValueError:
+            print("Invalid input. Please enter a number.")
+            continue
+        if 0 <= choice < len(results):
+            return results[choice]["path"]
+        print("Invalid choice. Please select a valid chat number.")
+
+def main_menu(while_choosing=None):
+    """Show the main menu to the user and handle the choice.
+
+    while_choosing, if given, is called once the menu is on screen, so that it
+    doesn't hold up the menu appearing.
+    """
+    first_menu = ("\n1) Start New Chat\n2) Resume Recent Chat\n3) Search Chat History")
+    console.print(f"[bold blue]{first_menu}[/]")
+    console.print(f"\nChoose (1-3): ", end="")
+    if while_choosing is not None:
+        while_choosing()
+    choice = input()
+    return choice.strip()
+
+def warm_backend(backend: Backend) -> threading.Thread:
+    """Gets the first prompt and reply ready on a background thread, e.g. while the menu is showing:
+    imports the deferred modules, loads the tokenizer and creates the backend's SDK client."""
+    steps = [lambda name=name: importlib.import_module(name) for name in DEFERRED_MODULES]
+    steps += [backend.tokenizer.get_encoding, lambda: backend.client]
+
+    def load():
+        for step in steps:
+            try:
+                step()
+            except Exception:
+                pass  # Any failure is raised again, in the foreground, on first use.
+
+    thread = threading.Thread(target=load, daemon=True)
+    thread.start()
+    return thread
+
+def apply_base_url(argv: list[str]) -> list[str]:
+    """Points every backend at the server given by a --base-url option, such as a chatcore.fakeserver,
+    and returns the other arguments."""
+    remaining = []
+    args = iter(argv)
+    for arg in args:
+        if arg == "--base-url":
+            url = next(args, None)
+            if not url:
+                sys.exit("--base-url needs the URL of a server")
+        elif arg.startswith("--base-url="):
+            url = arg.split("=", 1)[1]
+        else:
+            remaining.append(arg)
+            continue
+        os.environ.update(base_url_environment(url))
+    return remaining
+
+def main(backend_name: str, app_dir_name: str):
+    """Runs the interactive chat client, starting with the named backend.
+
+    History, the chat catalogue and the upload cache are kept in ~/app_dir_name.
+    Run with --batch to send prompts from files or stdin instead (see chatcore.batch), or with
+    --metrics to summarise the timings recorded for past replies. --base-url <url> sends requests
+    to another server, such as chatcore.fakeserver, instead of the providers.
+    """
+    argv = apply_base_url(sys.argv[1:])
+    if "--batch" in argv:
+        from chatcore.batch import main as batch_main
+        sys.exit(batch_main(backend_name, app_dir_name, [arg for arg in argv if arg != "--batch"]))
+    if "--metrics" in argv:
+        from chatcore.telemetry import main as metrics_main
+        sys.exit(metrics_main(app_dir_name, [arg for arg in argv if arg != "--metrics"]))
+    try:
+        app_dir = os.path.join(os.path.expanduser("~"), app_dir_name)
+        backend = BACKENDS[backend_name]()
+
+        # Initialize and ensure chat history directories
+        base_dir = ensure_chat_history_dir(app_dir)
+
+        # Nothing slow is loaded before the menu is shown; it is loaded in the background while it is.
+        choice = main_menu(while_choosing=lambda: warm_backend(backend))
+        # Opened after the menu, as the first time it is opened it indexes every saved chat, which
+        # loads the tokenizer.
+        catalogue = open_chat_catalogue(base_dir, backend.tokenizer)
+        messages = []
+        while choice in ("2", "3"):
+            if catalogue is None:
+                chat_file = None
+            elif choice == "2":
+                chat_file = select_chat_file(catalogue)
+            else:
+                chat_file = search_chat_history(catalogue)
+            if not chat_file:
+                print("No chat selected or file not found.")
+                return
+            try:
+                # Chats saved before the system prompt was kept out of the history start with it.
+                messages = [message for message in load_chat(chat_file) if message["role"] != "system"]
+                break
+            except FileNotFoundError:
+                # Deleted or moved since the list was shown; it is dropped from the catalogue and the list shown again.
+                print(f"{chat_file} no longer exists.")
+                catalogue.forget(chat_file)
+
+        # Imported here so the menu isn't kept waiting for them. warm_backend has usually imported them by now.
+        import asyncio
+        from chatcore.session import ChatSession, run_chat, welcome_text
+
+        session = ChatSession(backend, app_dir, messages, ChatWriter(get_todays_chat_dir(base_dir), catalogue))
+        console.print(f"[bold blue]{welcome_text(session.backend)}[/]")
+        asyncio.run(run_chat(session))
+
+    except KeyboardInterrupt:
+        print("\nInterrupted by user")
+        try:
+            sys.exit(0)
+        except SystemExit:
+            os._exit(0)
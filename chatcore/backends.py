@@ -0,0 +1,298 @@
+import os
+import sys
+import threading
+
+from collections.abc import AsyncIterator
+
+from chatcore.history import to_request_messages
+from chatcore.ingest import is_upload_prompt
+from chatcore.tokens import Tokenizer
+
+# Prompt-cache breakpoints go on the system prompt, the newest message and up to this many of the
+# most recent uploads. Anthropic allows four breakpoints per request.
+CACHED_UPLOADS = 2
+# httpx closes idle connections after 5 seconds by default, which would lose a connection pre-opened
+# while the user is typing long before they send. Providers close idle connections after a minute or two.
+CONNECTION_KEEPALIVE_SECONDS = 90
+
+def async_http_client(client_class):
+    """Returns the HTTP client an SDK client sends its requests through, with connections kept alive
+    for longer. client_class is the SDK's DefaultAsyncHttpxClient, which keeps the SDK's own defaults."""
+    # Recent anthropic and openai releases are built on httpx2 rather than httpx, while groq and the
+    # releases in .tool-versions are built on httpx. Each SDK only accepts a client from the package it
+    # is built on, so the limits come from whichever package the SDK's client class is from.
+    async_client = next(cls for cls in client_class.__mro__ if cls.__name__ == "AsyncClient")
+    httpx = sys.modules[async_client.__module__]
+    return client_class(limits=httpx.Limits(max_connections=100, max_keepalive_connections=20,
+                                            keepalive_expiry=CONNECTION_KEEPALIVE_SECONDS))
+
+class Usage:
+    """Token usage of one reply, filled in by Backend.stream_reply as the provider reports it.
+
+    Counts a provider doesn't report are left as None. input_tokens includes any
+    tokens read from or written to the prompt cache.
+    """
+
+    def __init__(self):
+        self.input_tokens = None
+        self.output_tokens = None
+        self.cache_read_tokens = None
+        self.cache_write_tokens = None
+
+class Backend:
+    """A model provider that a chat can be sent to.
+
+    Chat histories are provider-neutral: user and assistant messages only, with
+    the system prompt kept apart. Each backend translates them into its own
+    streaming API, through the SDK's asyncio client. SDK clients are only
+    created when first used, so a backend that is never sent a message costs
+    nothing, not even its SDK import.
+    """
+
+    name = ""            # used to switch to the backend with "Model: <name>"
+    label = ""           # shown above each reply
+    welcome_name = ""
+    short_name = ""
+    colour = "magenta"
+    model = ""
+    # The SDK reads the URL to send requests to from this environment variable: the server's URL
+    # followed by base_url_path.
+    base_url_variable = ""
+    base_url_path = ""
+    max_tokens = 4096
+    temperature = 1.0
+    # Token budgets for a request's history and for a single directory or file upload.
+    context_budget = 100000
+    directory_token_limit = 100000
+    file_token_limit = 64000
+    tokenizer: Tokenizer
+
+    def __init__(self):
+        self._client = None
+        self.http_client = None  # the SDK client's HTTP client, set by create_client
+        self._client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Locked, as the client may be created on a background thread by app.warm_backend.
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self.create_client()
+        return self._client
+
+    def create_client(self):
+        raise NotImplementedError
+
+    def system_prompt(self, local_date: str, local_time: str) -> str:
+        raise NotImplementedError
+
+    async def prewarm(self):
+        """Opens a connection to the provider ahead of the next request, leaving it in the client's pool.
+
+        A HEAD request to the API's base URL is sent through the SDK client's own HTTP client rather
+        than through the SDK, as not every SDK release has an endpoint to call that costs nothing.
+        Whatever the response, the connection is left open for the next request.
+        """
+        try:
+            # Inside the try, as the client itself may fail to be created, e.g. with no API key set.
+            base_url = str(self.client.base_url)
+            await self.http_client.head(base_url)
+        except Exception:
+            pass  # The next request opens its own connection, and reports any error, if this one failed.
+
+    def build_request(self, messages: list, system_prompt: str) -> dict:
+        """Returns the body of a request for the reply to the messages, reading any content left on disk."""
+        raise NotImplementedError
+
+    async def stream_reply(self, request: dict, usage: Usage) -> AsyncIterator[str]:
+        """Sends a request built by build_request and yields the reply's text as it arrives, filling in usage."""
+        raise NotImplementedError
+
+class AnthropicBackend(Backend):
+    """Anthropic's Claude 3.5 Sonnet, with the system prompt and uploads kept in the prompt cache."""
+
+    name = "claude"
+    label = "Claude 3.5 Sonnet"
+    welcome_name = "Anthropic's Claude 3.5 Sonnet"
+    short_name = "Claude"
+    colour = "yellow"
+    model = "claude-3-5-sonnet-20240620"
+    base_url_variable = "ANTHROPIC_BASE_URL"
+    max_tokens = 8192
+    temperature = 0.5
+    # Claude 3.5 Sonnet has a 200k token context window; this leaves room for the reply and the system prompt.
+    context_budget = 150000
+    # Anthropic doesn't publish a local tokenizer for its Claude 3 models, so token counts are
+    # estimated with cl100k_base and scaled up, as Claude's tokenizer produces rather more tokens.
+    tokenizer = Tokenizer("cl100k_base", ratio=1.15)
+
+    def create_client(self):
+        from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient
+        self.http_client = async_http_client(DefaultAsyncHttpxClient)
+        return AsyncAnthropic(http_client=self.http_client)
+
+    def system_prompt(self, local_date: str, local_time: str) -> str:
+        return (f"Specifically, your model is \"Claude 3.5 Sonnet\". Your knowledge base was last updated "
+                f"in April 2024. Today is {local_date}. Local time is {local_time}. You write in British "
+                f"English and you are not too quick to apologise.")
+
+    @staticmethod
+    def build_request_messages(messages: list) -> list:
+        """Returns the messages as a request body with prompt-cache breakpoints on the most recent
+        uploads and on the newest message, so that later turns read the conversation so far from
+        Anthropic's prompt cache rather than having it processed again."""
+        request = to_request_messages(messages)
+        upload_indices = [index for index, message in enumerate(request)
+                          if message["role"] == "user" and is_upload_prompt(message["content"])]
+        breakpoints = set(upload_indices[-CACHED_UPLOADS:])
+        if request:
+            breakpoints.add(len(request) - 1)
+        for index in breakpoints:
+            message = request[index]
+            request[index] = {"role": message["role"],
+                              "content": [{"type": "text", "text": message["content"],
+                                           "cache_control": {"type": "ephemeral"}}]}
+        return request
+
+    def build_request(self, messages: list, system_prompt: str) -> dict:
+        return dict(
+            model=self.model,
+            messages=self.build_request_messages(messages),
+            system=[{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}],
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+        )
+
+    async def stream_reply(self, request: dict, usage: Usage) -> AsyncIterator[str]:
+        stream = await self.client.messages.create(**request, stream=True)
+        async for chunk in stream:
+            if chunk.type == "message_start":
+                message_usage = chunk.message.usage
+                usage.cache_read_tokens = getattr(message_usage, "cache_read_input_tokens", None) or 0
+                usage.cache_write_tokens = getattr(message_usage, "cache_creation_input_tokens", None) or 0
+                usage.input_tokens = message_usage.input_tokens + usage.cache_read_tokens + usage.cache_write_tokens
+            elif chunk.type == "message_delta":
+                usage.output_tokens = chunk.usage.output_tokens
+            elif chunk.type == "content_block_delta":
+                text = getattr(chunk.delta, "text", None)
+                if text:
+                    yield text
+            elif chunk.type == "message_stop":
+                break
+
+class OpenAIBackend(Backend):
+    """OpenAI's GPT-4o, through the Chat Completions API."""
+
+    name = "gpt-4o"
+    label = "GPT-4o"
+    welcome_name = "GPT-4o"
+    short_name = "GPT-4o"
+    model = "gpt-4o-2024-08-06"
+    base_url_variable = "OPENAI_BASE_URL"
+    base_url_path = "/v1"
+    max_tokens = 16384
+    temperature = 1.05
+    # GPT-4o has a 128k token context window; this leaves room for a 16k token reply.
+    context_budget = 100000
+    # o200k_base is used if the installed tiktoken doesn't recognise the model.
+    tokenizer = Tokenizer("o200k_base", model=model)
+
+    def create_client(self):
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+        self.http_client = async_http_client(DefaultAsyncHttpxClient)
+        return AsyncOpenAI(http_client=self.http_client)
+
+    def system_prompt(self, local_date: str, local_time: str) -> str:
+        return (f"You are a helpful AI assistant. Today is {local_date}. Local time is {local_time}. "
+                f"You answer queries succinctly, avoiding preamble and summaries whenever possible. "
+                f"You answer queries at a high language level and with expert level knowledge. "
+                f"Avoid responses that comment on the limitations of your model. You provide full, "
+                f"detailed answers. You behave like a passionate expert who always takes a clear "
+                f"stance on any topic discussed. You are excellent at reasoning. When reasoning, take "
+                f"a deep breath and think step by step before you answer the question. You do not finish "
+                f"your answers with a question unless specifically prompted to do so.")
+
+    def build_request(self, messages: list, system_prompt: str) -> dict:
+        return dict(
+            model=self.model,
+            messages=[{"role": "system", "content": system_prompt}] + to_request_messages(messages),
+            max_tokens=self.max_tokens,
+            temperature=self.temperature,
+        )
+
+    async def create_stream(self, request: dict):
+        return await self.client.chat.completions.create(**request, stream=True,
+                                                         stream_options={"include_usage": True})
+
+    def record_usage(self, chunk, usage: Usage):
+        # With include_usage, the final chunk has no choices and carries the usage of the whole reply.
+        chunk_usage = getattr(chunk, "usage", None)
+        if chunk_usage is None:
+            return
+        usage.input_tokens = chunk_usage.prompt_tokens
+        usage.output_tokens = chunk_usage.completion_tokens
+        details = getattr(chunk_usage, "prompt_tokens_details", None)
+        if details is not None and details.cached_tokens is not None:
+            usage.cache_read_tokens = details.cached_tokens
+
+    async def stream_reply(self, request: dict, usage: Usage) -> AsyncIterator[str]:
+        async for chunk in await self.create_stream(request):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            self.record_usage(chunk, usage)
+
+class GroqBackend(OpenAIBackend):
+    """Mixtral-8x7b on Groq, whose API is compatible with OpenAI's Chat Completions."""
+
+    name = "groq"
+    label = "Groq (Mixtral-8x7b)"
+    welcome_name = "Groq (Mixtral-8x7b)"
+    short_name = "Groq"
+    model = "mixtral-8x7b-32768"
+    base_url_variable = "GROQ_BASE_URL"
+    base_url_path = ""
+    max_tokens = 4096
+    temperature = 1.05
+    # Mixtral-8x7b on Groq has a 32k token context window; this leaves room for a 4k token reply.
+    context_budget = 28000
+    directory_token_limit = 26000
+    file_token_limit = 26000
+    # Mixtral's SentencePiece tokenizer isn't available through tiktoken; cl100k_base is a
+    # close enough estimate for deciding whether an upload fits in the context window.
+    tokenizer = Tokenizer("cl100k_base")
+
+    def create_client(self):
+        from groq import AsyncGroq, DefaultAsyncHttpxClient
+        self.http_client = async_http_client(DefaultAsyncHttpxClient)
+        return AsyncGroq(api_key=os.environ.get("GROQ_API_KEY"), http_client=self.http_client)
+
+    def system_prompt(self, local_date: str, local_time: str) -> str:
+        return (f"You are a helpful AI assistant. Today is {local_date}. Local time is {local_time}. "
+                f"You answer queries succinctly, avoiding preamble and summaries whenever possible. "
+                f"You answer queries at a high language level and with expert level knowledge. "
+                f"Avoid responses that comment on the limitations of your model. You provide full, "
+                f"detailed answers. You behave like a passionate expert who always takes a clear "
+                f"stance on any topic discussed. - Be excellent at reasoning - When reasoning, take "
+                f"a deep breath and think step by step before you answer the question. You do not make "
+                f"your answers artificially shorter to fit within a response word limit. If your full, "
+                f"considered response would be constrained by the output token limit of your model (4096), "
+                f"you will continue your answer in the next response, prompting the user with "
+                f"\"Shall I continue?\".")
+
+    async def create_stream(self, request: dict):
+        return await self.client.chat.completions.create(**request, stream=True)
+
+    def record_usage(self, chunk, usage: Usage):
+        # Groq reports usage in an x_groq extension on the final chunk.
+        x_groq = getattr(chunk, "x_groq", None)
+        if x_groq is not None and getattr(x_groq, "usage", None) is not None:
+            usage.input_tokens = x_groq.usage.prompt_tokens
+            usage.output_tokens = x_groq.usage.completion_tokens
+
+BACKENDS = {backend.name: backend for backend in (AnthropicBackend, OpenAIBackend, GroqBackend)}
+
+def base_url_environment(url: str) -> dict:
+    """Returns the environment variables that send every backend's requests to the server at url,
+    such as a proxy or a chatcore.fakeserver, instead of to the provider."""
+    return {backend.base_url_variable: url.rstrip("/") + backend.base_url_path for backend in BACKENDS.values()}
@@ -0,0 +1,314 @@
+"""Sends prompts without the interactive prompt, so the chat clients can be scripted.
+
+    claude.py --batch [--jobs JOBS.jsonl] [--format text|json] [--concurrency N] [FILE ...]
+
+Each FILE, or stdin if there are none, is one job. Its "Upload: <path>" lines
+name files or directories to send before it, read through the same ingestion
+path, upload cache and token limits as the interactive client, and the rest
+of the text is the prompt. With --jobs, each line of a JSON Lines file (or of
+stdin, for "-") is a job instead, e.g.
+
+    {"id": "review-42", "prompt": "Review the error handling.", "uploads": ["~/src/app"], "model": "groq"}
+
+Every job is independent, a single prompt and reply, and jobs run
+concurrently up to --concurrency. Requests that are rate limited or fail
+transiently are retried with exponential backoff, honouring any retry-after
+the provider sends, and a rate limit holds back every job for that provider
+rather than just the one that hit it. An upload named by several jobs is only
+read once, and a directory over its token limit is packed with the files most
+relevant to each job's prompt.
+
+With --format text, a single job's reply is streamed to stdout as it arrives,
+and the replies of several jobs are written whole, in job order. With
+--format json, a JSON object per job is written as each finishes, with its
+reply or error, latency and token usage. Errors and progress go to stderr.
+The exit status is 1 if any job failed.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+from datetime import datetime
+
+from chatcore.backends import BACKENDS, Backend
+from chatcore.ingest import UploadError, read_upload
+from chatcore.session import ReplyStats
+from chatcore.telemetry import StageTimes, TelemetryLog
+
+BATCH_CONCURRENCY = 4
+BATCH_MAX_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 60.0
+# Request timeouts, conflicts, rate limits, server errors and Anthropic's "overloaded".
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+# Errors raised by the SDKs and httpx when a connection fails or drops, which have no status code.
+RETRYABLE_ERRORS = ("APIConnectionError", "TransportError")
+
+class Job:
+    """A prompt to send, after any uploads it names."""
+
+    def __init__(self, job_id: str, prompt: str, uploads: list[str], model: str | None = None,
+                 error: str | None = None):
+        self.id = job_id
+        self.prompt = prompt
+        self.uploads = uploads
+        self.model = model
+        self.error = error  # why the job can't be run, reported as its result, e.g. a malformed job list entry
+
+def parse_job_text(job_id: str, text: str, uploads: list[str] | None = None, model: str | None = None) -> Job:
+    """Returns the job for a prompt, taking any "Upload:" lines out of it as uploads."""
+    uploads = list(uploads or [])
+    lines = []
+    for line in text.splitlines():
+        if line.startswith("Upload:"):
+            uploads.append(line[len("Upload:"):].strip())
+        else:
+            lines.append(line)
+    return Job(job_id, "\n".join(lines).strip(), uploads, model)
+
+def load_jobs(files: list[str], jobs_path: str | None) -> list[Job]:
+    """Returns the jobs in a JSON Lines job list, in prompt files, or on stdin. Raises ValueError for a
+    malformed job."""
+    if jobs_path is not None:
+        jobs = []
+        source = sys.stdin if jobs_path == "-" else open(jobs_path, encoding="utf-8")
+        with source:
+            for line_number, line in enumerate(source, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"line {line_number} of {jobs_path} isn't valid JSON: {e}")
+                if not isinstance(entry, dict) or not isinstance(entry.get("prompt", ""), str):
+                    raise ValueError(f"line {line_number} of {jobs_path} isn't a job object with a \"prompt\"")
+                uploads = entry.get("uploads")
+                model = entry.get("model")
+                # A malformed job fails on its own rather than stopping the others. A string of uploads in
+                # particular must not be taken one character at a time, which would upload "/" and "~".
+                error = None
+                if uploads is not None and not (isinstance(uploads, list)
+                                                and all(isinstance(path, str) for path in uploads)):
+                    error = '"uploads" must be a list of paths'
+                    uploads = None
+                if model is not None and not isinstance(model, str):
+                    error = '"model" must be a string'
+                    model = None
+                job = parse_job_text(str(entry.get("id", line_number)), entry.get("prompt", ""), uploads, model)
+                job.error = error
+                jobs.append(job)
+        return jobs
+    if files:
+        jobs = []
+        for path in files:
+            with open(path, encoding="utf-8") as f:
+                jobs.append(parse_job_text(path, f.read()))
+        return jobs
+    return [parse_job_text("stdin", sys.stdin.read())]
+
+def retry_delay(error: Exception, attempt: int) -> float | None:
+    """Returns the seconds to wait before retrying a request that failed with error, or None if it
+    shouldn't be retried."""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        if not any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__):
+            return None
+    elif status_code not in RETRYABLE_STATUS_CODES:
+        return None
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return min(float(headers.get("retry-after")), RETRY_MAX_SECONDS)
+    except (TypeError, ValueError):
+        # Full jitter, so that jobs that failed together don't all retry together.
+        return random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+
+class BatchRunner:
+    """Runs jobs concurrently, sharing backends, uploads and rate limits between them."""
+
+    def __init__(self, backend_name: str, app_dir: str, concurrency: int = BATCH_CONCURRENCY,
+                 max_attempts: int = BATCH_MAX_ATTEMPTS):
+        self.backend_name = backend_name
+        self.upload_cache_path = os.path.join(app_dir, 'upload-cache.sqlite3')
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backends = {}
+        self.uploads = {}  # (backend name, path): task reading the upload
+        self.resume_at = {}  # backend name: when a rate limit on it is expected to have lifted
+        self.telemetry = TelemetryLog(app_dir)
+        now = datetime.now()
+        self.local_date = now.strftime("%a %d %b %Y")
+        self.local_time = now.strftime("%H:%M:%S %Z")
+        self.session_id = now.strftime("batch-%Y%m%d-%H%M%S")
+
+    def get_backend(self, name: str) -> Backend:
+        if name not in BACKENDS:
+            raise ValueError(f"unknown model '{name}', choose one of: {', '.join(BACKENDS)}")
+        if name not in self.backends:
+            self.backends[name] = BACKENDS[name]()
+        return self.backends[name]
+
+    def read_upload(self, backend: Backend, path: str, timings: StageTimes) -> asyncio.Task:
+        """Returns the task reading an upload within the backend's limits, starting it if no job has yet.
+        Only the job that starts it has the reading added to its timings."""
+        path = os.path.expanduser(path)
+        key = (backend.name, path)
+        if key not in self.uploads:
+            self.uploads[key] = asyncio.ensure_future(asyncio.to_thread(
+                read_upload, path, os.path.isdir(path), backend.directory_token_limit,
+                backend.file_token_limit, backend.tokenizer, self.upload_cache_path, timings))
+        return self.uploads[key]
+
+    async def send(self, job: Job, backend: Backend, messages: list, times: StageTimes,
+                   on_delta=None) -> tuple[str, ReplyStats, int]:
+        """Streams the backend's reply, retrying transient failures. Returns the reply, its stats and the
+        number of attempts made."""
+        with times.stage("build"):
+            request = backend.build_request(messages, backend.system_prompt(self.local_date, self.local_time))
+        for attempt in range(1, self.max_attempts + 1):
+            wait = self.resume_at.get(backend.name, 0) - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            stats = ReplyStats(backend, times)
+            chunks = []
+            try:
+                async for delta in backend.stream_reply(request, stats.usage):
+                    stats.token_arrived()
+                    chunks.append(delta)
+                    if on_delta is not None:
+                        on_delta(delta)
+            except Exception as e:
+                delay = retry_delay(e, attempt)
+                # A reply already partly written to stdout can't be taken back, so it isn't retried.
+                if delay is None or attempt == self.max_attempts or (on_delta is not None and chunks):
+                    raise
+                if getattr(e, "status_code", None) == 429:
+                    self.resume_at[backend.name] = max(self.resume_at.get(backend.name, 0), time.monotonic() + delay)
+                print(f"{job.id}: {e} (attempt {attempt} of {self.max_attempts}, retrying in {delay:.1f}s)",
+                      file=sys.stderr)
+                await asyncio.sleep(delay)
+                continue
+            reply = "".join(chunks)
+            stats.finish(reply)
+            return reply, stats, attempt
+
+    async def run_job(self, job: Job, semaphore: asyncio.Semaphore, on_delta=None) -> dict:
+        """Runs a job and returns its result, with the error in it rather than raised if it failed."""
+        async with semaphore:
+            started = time.monotonic()
+            result = {"id": job.id, "model": job.model or self.backend_name}
+            upload_times = StageTimes()
+            times = StageTimes()
+            record = {"session": self.session_id, "turn": job.id, "mode": "batch", "model": result["model"]}
+            try:
+                if job.error is not None:
+                    raise ValueError(job.error)
+                backend = self.get_backend(result["model"])
+                uploads = await asyncio.gather(*(self.read_upload(backend, path, upload_times)
+                                                 for path in job.uploads),
+                                               return_exceptions=True)
+                for upload in uploads:
+                    if isinstance(upload, Exception):
+                        raise upload
+                prompts = await asyncio.gather(*(asyncio.to_thread(upload.build_prompt, job.prompt)
+                                                 for upload in uploads))
+                messages = [{"role": "user", "content": prompt} for prompt, token_count in prompts]
+                if job.prompt:
+                    messages.append({"role": "user", "content": job.prompt})
+                if not messages:
+                    raise ValueError("the job has no prompt or uploads")
+                times.merge(upload_times, prefix="ingest_")
+                reply, stats, attempts = await self.send(job, backend, messages, times, on_delta)
+            except Exception as e:
+                # The job's own errors read well as they are; an SDK's is clearer with its type, e.g. RateLimitError.
+                expected = isinstance(e, (UploadError, ValueError, OSError))
+                result["error"] = str(e) if expected else f"{type(e).__name__}: {e}"
+                times.add("total", time.monotonic() - started)
+                self.telemetry.record({**record, "seconds": times.seconds, "error": result["error"]})
+                return result
+            times.add("total", time.monotonic() - started)
+            self.telemetry.record({**record, **stats.record()})
+            usage = stats.usage
+            result.update(reply=reply, attempts=attempts,
+                          time_to_first_token=(round(stats.time_to_first_token, 3)
+                                               if stats.time_to_first_token is not None else None),
+                          latency=round(stats.latency, 3),
+                          input_tokens=usage.input_tokens, output_tokens=stats.output_tokens,
+                          cache_read_tokens=usage.cache_read_tokens, cache_write_tokens=usage.cache_write_tokens)
+            return result
+
+    async def run(self, jobs: list[Job], output_format: str) -> int:
+        """Runs the jobs, writing their results to stdout. Returns the number that failed."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        stream = output_format == "text" and len(jobs) == 1
+        on_delta = (lambda delta: (sys.stdout.write(delta), sys.stdout.flush())) if stream else None
+
+        async def run_numbered(index, job):
+            return index, await self.run_job(job, semaphore, on_delta)
+
+        finished = {}
+        next_index = 0
+        failed = 0
+        for next_result in asyncio.as_completed([run_numbered(index, job) for index, job in enumerate(jobs)]):
+            index, result = await next_result
+            if "error" in result:
+                failed += 1
+                print(f"{result['id']}: failed: {result['error']}", file=sys.stderr)
+            if output_format == "json":
+                print(json.dumps(result, ensure_ascii=False), flush=True)
+                continue
+            if stream:
+                if "reply" in result:
+                    print(flush=True)
+                continue
+            # Text replies are written in job order, as soon as every job before them has finished.
+            finished[index] = result
+            while next_index in finished:
+                reply = finished.pop(next_index).get("reply")
+                if reply is not None:
+                    print(reply, end="\n\n", flush=True)
+                next_index += 1
+        return failed
+
+def main(backend_name: str, app_dir_name: str, argv: list[str]) -> int:
+    """Runs the jobs described by the command line arguments and returns the exit status."""
+    parser = argparse.ArgumentParser(prog=f"{os.path.basename(sys.argv[0])} --batch",
+                                     description="Send prompts without the interactive prompt.")
+    parser.add_argument("files", nargs="*", metavar="FILE",
+                        help="prompt files, one job each, with any \"Upload: <path>\" lines (default: stdin)")
+    parser.add_argument("--jobs", metavar="JOBS.jsonl",
+                        help="a JSON Lines job list, or - for stdin, instead of prompt files")
+    parser.add_argument("--model", default=backend_name,
+                        help=f"model for jobs that don't name one, from {', '.join(BACKENDS)} "
+                             f"(default: {backend_name})")
+    parser.add_argument("--format", choices=("text", "json"), default="text",
+                        help="write raw replies, or a JSON object per job (default: text)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY,
+                        help=f"jobs to run at once (default: {BATCH_CONCURRENCY})")
+    parser.add_argument("--attempts", type=int, default=BATCH_MAX_ATTEMPTS,
+                        help=f"attempts per request before a job fails (default: {BATCH_MAX_ATTEMPTS})")
+    args = parser.parse_args(argv)
+    if args.files and args.jobs:
+        parser.error("give either prompt files or --jobs, not both")
+    if args.model not in BACKENDS:
+        parser.error(f"unknown model '{args.model}'")
+    if args.concurrency < 1 or args.attempts < 1:
+        parser.error("--concurrency and --attempts must be at least 1")
+    try:
+        jobs = load_jobs(args.files, args.jobs)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+    app_dir = os.path.join(os.path.expanduser("~"), app_dir_name)
+    os.makedirs(app_dir, exist_ok=True)
+    runner = BatchRunner(args.model, app_dir, args.concurrency, args.attempts)
+    try:
+        failed = asyncio.run(runner.run(jobs, args.format))
+    except KeyboardInterrupt:
+        print("\nInterrupted by user", file=sys.stderr)
+        return 130
+    return 1 if failed else 0
@@ -0,0 +1,59 @@
+from chatcore.history import message_content
+from chatcore.ingest import is_upload_prompt
+from chatcore.tokens import Tokenizer
+
+class ContextWindow:
+    """Chooses which messages of a chat to send, so that each request stays within a token budget.
+
+    Every message is tokenised once, the first time it is seen. When the history is
+    over budget the oldest whole turns (a user message and the replies to it) are
+    left out of the request, so each turn costs what the recent conversation costs
+    rather than growing with the session. System messages and the turn holding the
+    most recent upload are always sent. The chat history itself is never trimmed.
+    """
+
+    def __init__(self, budget: int, tokenizer: Tokenizer):
+        self.budget = budget
+        self.tokenizer = tokenizer
+        self.token_counts = []
+        self.upload_indices = []
+
+    def count_new_messages(self, messages: list):
+        for index in range(len(self.token_counts), len(messages)):
+            content = message_content(messages[index])
+            self.token_counts.append(self.tokenizer.count(content))
+            if messages[index]["role"] == "user" and is_upload_prompt(content):
+                self.upload_indices.append(index)
+
+    def truncate(self, length: int):
+        """Forgets the counts of any messages from index length on, once they've been removed from the chat."""
+        del self.token_counts[length:]
+        self.upload_indices = [index for index in self.upload_indices if index < length]
+
+    def select(self, messages: list) -> tuple[list, int, int]:
+        """Returns the messages to send, their token total and how many messages were left out."""
+        self.count_new_messages(messages)
+        pinned = set()
+        turns = []
+        for index, message in enumerate(messages):
+            if message["role"] == "system":
+                pinned.add(index)
+            elif message["role"] == "user" or not turns:
+                turns.append([index])
+            else:
+                turns[-1].append(index)
+        if self.upload_indices:
+            pinned.update(next((turn for turn in turns if turn[0] == self.upload_indices[-1]), []))
+
+        kept = set(pinned)
+        total = sum(self.token_counts[index] for index in pinned)
+        for position, turn in enumerate(reversed(turns)):
+            if turn[0] in pinned:
+                continue
+            turn_tokens = sum(self.token_counts[index] for index in turn)
+            # The newest turn is the one being asked, so it is always sent.
+            if position > 0 and total + turn_tokens > self.budget:
+                break
+            kept.update(turn)
+            total += turn_tokens
+        return [messages[index] for index in sorted(kept)], total, len(messages) - len(kept)
@@ -0,0 +1,333 @@
+"""A local stand-in for the providers' streaming APIs, for testing and benchmarking offline.
+
+It speaks enough of Anthropic's Messages API and of OpenAI's and Groq's Chat
+Completions APIs for the SDKs' streaming clients, and replays transcripts (the
+text deltas of a reply, and the usage to report) in turn as the responses to
+requests. Replies can be paced to a time to first token and a token rate, and
+a share of requests can be failed with server errors or rate limited, chosen
+by a seeded random number generator so that runs are repeatable.
+
+The chat clients are pointed at it with --base-url <url>, and the SDKs in
+general through their base URL environment variables (see
+chatcore.backends.base_url_environment).
+
+Run it with `python3 -m chatcore.fakeserver serve`, and record a real reply
+to replay with `python3 -m chatcore.fakeserver capture`; --help lists the options.
+"""
+
+import json
+import random
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 8765
+# Rate limited requests are told to retry after this many seconds, unless configured otherwise.
+RETRY_AFTER_SECONDS = 1.0
+
+class Transcript:
+    """A reply to replay: its text deltas, in order, and the token usage to report for it.
+
+    times, if known, holds the seconds after the request at which each delta
+    arrived when the reply was captured, and is used to replay it at the same pace.
+    """
+
+    def __init__(self, deltas: list[str], input_tokens: int | None = None, output_tokens: int | None = None,
+                 times: list[float] | None = None):
+        self.deltas = deltas
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens if output_tokens is not None else len(deltas)
+        self.times = times
+
+    @classmethod
+    def from_text(cls, text: str, delta_chars: int = 4) -> "Transcript":
+        """Returns a transcript that streams text in deltas of about delta_chars characters, roughly a token each."""
+        return cls([text[start:start + delta_chars] for start in range(0, len(text), delta_chars)])
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"deltas": self.deltas, "input_tokens": self.input_tokens,
+                       "output_tokens": self.output_tokens, "times": self.times}, f, ensure_ascii=False, indent=1)
+
+def load_transcripts(path: str) -> list[Transcript]:
+    """Loads the transcripts to replay from a file: a transcript saved by capture, a saved chat (whose
+    replies are replayed in order) or any other file, whose text is replayed as a single reply."""
+    from chatcore.history import load_chat, message_content
+
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            return [Transcript(data["deltas"], data.get("input_tokens"), data.get("output_tokens"), data.get("times"))]
+    if path.endswith((".json", ".jsonl")):
+        return [Transcript.from_text(message_content(message)) for message in load_chat(path)
+                if message["role"] == "assistant"]
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return [Transcript.from_text(f.read())]
+
+def sse_event(data, event: str | None = None) -> bytes:
+    lines = f"event: {event}\n" if event else ""
+    payload = data if isinstance(data, str) else json.dumps(data, separators=(",", ":"))
+    return f"{lines}data: {payload}\n\n".encode()
+
+def anthropic_events(deltas, output_tokens: int, model: str, input_tokens: int):
+    yield sse_event({"type": "message_start", "message": {
+        "id": "msg_fake", "type": "message", "role": "assistant", "content": [], "model": model,
+        "stop_reason": None, "stop_sequence": None,
+        "usage": {"input_tokens": input_tokens, "output_tokens": 1,
+                  "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0}}}, "message_start")
+    yield sse_event({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+                    "content_block_start")
+    for delta in deltas:
+        yield sse_event({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": delta}},
+                        "content_block_delta")
+    yield sse_event({"type": "content_block_stop", "index": 0}, "content_block_stop")
+    yield sse_event({"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                     "usage": {"output_tokens": output_tokens}}, "message_delta")
+    yield sse_event({"type": "message_stop"}, "message_stop")
+
+def chat_completion_events(deltas, output_tokens: int, model: str, input_tokens: int, include_usage: bool,
+                           x_groq: bool):
+    def chunk(delta: dict, finish_reason=None, **extra) -> dict:
+        return {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": 0, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}], **extra}
+
+    usage = {"prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+             "total_tokens": input_tokens + output_tokens}
+    yield sse_event(chunk({"role": "assistant", "content": ""}))
+    for delta in deltas:
+        yield sse_event(chunk({"content": delta}))
+    # Groq reports usage on the final chunk, in its x_groq extension; OpenAI in a chunk of its own.
+    yield sse_event(chunk({}, "stop", **({"x_groq": {"id": "req_fake", "usage": usage}} if x_groq else {})))
+    if include_usage:
+        yield sse_event({"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": 0, "model": model,
+                         "choices": [], "usage": {**usage, "prompt_tokens_details": {"cached_tokens": 0}}})
+    yield sse_event("[DONE]")
+
+def error_body(anthropic: bool, status: int, message: str) -> dict:
+    # In the shape each provider's SDK parses into the message of the exception it raises.
+    if anthropic:
+        error_type = "rate_limit_error" if status == 429 else "api_error"
+        return {"type": "error", "error": {"type": error_type, "message": message}}
+    error_type = "rate_limit_exceeded" if status == 429 else "server_error"
+    return {"error": {"message": message, "type": error_type, "param": None, "code": error_type}}
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keeps connections alive, as the providers do
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, body: dict, headers: dict | None = None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json(200, {"object": "list", "data": [], "has_more": False, "first_id": None, "last_id": None})
+        else:
+            self.send_json(404, {"error": {"type": "not_found_error", "message": f"No route for {self.path}"}})
+
+    def do_POST(self):
+        provider = self.server.provider
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        anthropic = self.path.endswith("/messages")
+        if not anthropic and not self.path.endswith("/chat/completions"):
+            self.send_json(404, {"error": {"type": "not_found_error", "message": f"No route for {self.path}"}})
+            return
+        transcript, outcome = provider.next_response()
+        if outcome == 429:
+            self.send_json(429, error_body(anthropic, 429, "Rate limited by the fake provider."),
+                           {"retry-after": f"{provider.retry_after:g}"})
+            return
+        if outcome == 500:
+            self.send_json(500, error_body(anthropic, 500, "Internal error injected by the fake provider."))
+            return
+
+        started = time.monotonic()
+        try:
+            request = json.loads(body or b"{}")
+        except json.JSONDecodeError:
+            request = {}
+        # About four bytes of request a token, unless the transcript says otherwise.
+        input_tokens = transcript.input_tokens if transcript.input_tokens is not None else len(body) // 4
+        model = request.get("model", "fake-model")
+        deltas = provider.paced(transcript, started)
+        if anthropic:
+            events = anthropic_events(deltas, transcript.output_tokens, model, input_tokens)
+        else:
+            include_usage = bool((request.get("stream_options") or {}).get("include_usage"))
+            events = chat_completion_events(deltas, transcript.output_tokens, model, input_tokens, include_usage,
+                                            x_groq=self.path.startswith("/openai/"))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for event in events:
+                self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True  # the client stopped reading, e.g. a cancelled reply
+
+class FakeProvider:
+    """Serves the fake provider APIs on a background thread, on 127.0.0.1 and a free port by default.
+
+    transcripts are replayed in turn, one per request. Replies start after
+    first_token_seconds and then stream at tokens_per_second, counting a delta
+    as a token; otherwise captured transcripts replay at the pace they were
+    captured at, and others as fast as possible. error_rate and rate_limit_rate
+    are the shares of requests answered with a 500 or a 429 instead.
+    """
+
+    def __init__(self, transcripts: Transcript | list[Transcript], host: str = "127.0.0.1", port: int = 0,
+                 tokens_per_second: float | None = None, first_token_seconds: float | None = None,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, retry_after: float = RETRY_AFTER_SECONDS,
+                 seed: int = 0):
+        self.transcripts = transcripts if isinstance(transcripts, list) else [transcripts]
+        if not self.transcripts:
+            raise ValueError("there are no transcripts to replay")
+        self.tokens_per_second = tokens_per_second
+        self.first_token_seconds = first_token_seconds
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0  # requests received, including failed ones
+        self.server = ThreadingHTTPServer((host, port), FakeProviderHandler)
+        self.server.daemon_threads = True
+        self.server.provider = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def environment(self) -> dict:
+        """Returns the environment variables that point all three SDKs at this server, with placeholder keys."""
+        from chatcore.backends import base_url_environment
+        return {**base_url_environment(self.url),
+                "ANTHROPIC_API_KEY": "fake", "OPENAI_API_KEY": "fake", "GROQ_API_KEY": "fake"}
+
+    def next_response(self) -> tuple[Transcript, int]:
+        """Returns the transcript for the next request and its status: 200, or an injected 429 or 500."""
+        with self.lock:
+            transcript = self.transcripts[self.requests % len(self.transcripts)]
+            self.requests += 1
+            draw = self.random.random()
+        if draw < self.rate_limit_rate:
+            return transcript, 429
+        if draw < self.rate_limit_rate + self.error_rate:
+            return transcript, 500
+        return transcript, 200
+
+    def paced(self, transcript: Transcript, started: float):
+        """Yields the transcript's deltas, each at the time it is due after started."""
+        if self.tokens_per_second is not None or self.first_token_seconds is not None:
+            first_token = self.first_token_seconds or 0.0
+            interval = 1 / self.tokens_per_second if self.tokens_per_second else 0.0
+            times = [first_token + index * interval for index in range(len(transcript.deltas))]
+        else:
+            times = transcript.times
+        for index, delta in enumerate(transcript.deltas):
+            if times is not None and index < len(times):
+                wait = started + times[index] - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+            yield delta
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+async def capture(backend, prompt: str) -> Transcript:
+    """Sends prompt to a real provider and returns the reply as a transcript, with when each delta arrived."""
+    from datetime import datetime
+
+    from chatcore.backends import Usage
+
+    now = datetime.now().astimezone()
+    request = backend.build_request([{"role": "user", "content": prompt}],
+                                    backend.system_prompt(now.strftime("%a %d %b %Y"), now.strftime("%H:%M:%S %Z")))
+    usage = Usage()
+    deltas = []
+    times = []
+    started = time.monotonic()
+    async for delta in backend.stream_reply(request, usage):
+        deltas.append(delta)
+        times.append(round(time.monotonic() - started, 4))
+    return Transcript(deltas, usage.input_tokens, usage.output_tokens, times)
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+    import asyncio
+
+    from chatcore.backends import BACKENDS
+
+    parser = argparse.ArgumentParser(prog="python3 -m chatcore.fakeserver",
+                                     description="Serve a fake provider API, or capture a real reply to replay.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve = commands.add_parser("serve", help="serve the fake provider API until interrupted")
+    serve.add_argument("transcripts", nargs="*", metavar="FILE",
+                       help="transcripts to replay in turn: captured transcripts, saved chats or text files "
+                            "(default: a short placeholder reply)")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"(default: {DEFAULT_PORT})")
+    serve.add_argument("--tokens-per-second", type=float, help="stream replies at this rate")
+    serve.add_argument("--first-token-seconds", type=float, help="wait this long before streaming a reply")
+    serve.add_argument("--error-rate", type=float, default=0.0, help="share of requests that fail with a 500")
+    serve.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests that get a 429")
+    serve.add_argument("--retry-after", type=float, default=RETRY_AFTER_SECONDS,
+                       help=f"seconds rate limited requests are told to wait (default: {RETRY_AFTER_SECONDS:g})")
+    serve.add_argument("--seed", type=int, default=0, help="seeds the choice of failed requests (default: 0)")
+    record = commands.add_parser("capture", help="send a prompt to a real provider and save the reply to replay")
+    record.add_argument("prompt")
+    record.add_argument("--model", choices=sorted(BACKENDS), default="claude", help="(default: claude)")
+    record.add_argument("--output", "-o", required=True, metavar="FILE", help="where to save the transcript")
+    args = parser.parse_args(argv)
+
+    if args.command == "capture":
+        transcript = asyncio.run(capture(BACKENDS[args.model](), args.prompt))
+        transcript.save(args.output)
+        print(f"Saved {len(transcript.deltas):,} deltas to {args.output}")
+        return 0
+
+    if args.transcripts:
+        transcripts = [transcript for path in args.transcripts for transcript in load_transcripts(path)]
+    else:
+        transcripts = [Transcript.from_text("This is a reply from the **fake provider**.\n\n"
+                                            "```python\nprint(\"Hello, world!\")\n```\n")]
+    try:
+        provider = FakeProvider(transcripts, args.host, args.port, args.tokens_per_second, args.first_token_seconds,
+                                args.error_rate, args.rate_limit_rate, args.retry_after, args.seed)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    with provider:
+        plural = "s" if len(transcripts) != 1 else ""
+        print(f"Serving {len(transcripts):,} transcript{plural} on {provider.url}. Point a chat client at it with:\n"
+              f"  python3 claude.py --base-url {provider.url}\n"
+              f"or set these environment variables:")
+        for name, value in provider.environment().items():
+            print(f"  export {name}={value}", flush=True)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            print(f"\nServed {provider.requests:,} requests")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,305 @@
+import json
+import os
+import re
+import sqlite3
+
+from datetime import datetime
+
+from chatcore.tokens import Tokenizer
+
+# fsync the chat history after every save, so a crash can lose at most the turn in progress.
+CHAT_FSYNC = True
+# Resumed messages longer than this, such as directory uploads, stay on disk until a request needs them.
+LAZY_CONTENT_BYTES = 64 * 1024
+LAZY_MESSAGE_PREFIX = re.compile(rb'\{"role": "(\w+)", "content": "')
+# Replies are tagged with the backend that wrote them, in a key saved after their content.
+LAZY_MESSAGE_MODEL = re.compile(rb', "model": "([^"\\]+)"\}\s*$')
+SEARCH_RESULTS = 20
+
+def ensure_chat_history_dir(app_dir: str) -> str:
+    """Ensures that the chat history directory exists, e.g. ~/.claude/chat-history."""
+    chat_history_base_dir = os.path.join(app_dir, 'chat-history')
+    os.makedirs(chat_history_base_dir, exist_ok=True)
+    return chat_history_base_dir
+
+def get_todays_chat_dir(base_dir):
+    """Returns today's chat directory, creating it if necessary."""
+    today = datetime.now().strftime("%Y-%m-%d")
+    todays_chat_dir = os.path.join(base_dir, today)
+    os.makedirs(todays_chat_dir, exist_ok=True)
+    return todays_chat_dir
+
+class ChatWriter:
+    """Saves one chat session to a file of its own.
+
+    Chats are stored as JSON Lines, one message per line, so each turn writes only
+    its new messages instead of re-serialising the whole history. The file is
+    created on the first save, in the directory given.
+    """
+
+    def __init__(self, chat_dir: str, catalogue=None):
+        self.chat_dir = chat_dir
+        self.catalogue = catalogue
+        self.path = None
+        self.saved_message_count = 0
+        self.executor = None
+
+    def save_in_background(self, chat_data: list):
+        """Saves the chat as it is now on the writer's own thread, so the caller doesn't wait for
+        the disk. Saves run one at a time, in the order they were made. Returns the save's Future."""
+        if self.executor is None:
+            from concurrent.futures import ThreadPoolExecutor  # imports logging, so it's left until needed
+
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-writer")
+        return self.executor.submit(self.save, list(chat_data))
+
+    def flush(self):
+        """Waits for any saves still running in the background."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def save(self, chat_data: list):
+        """Appends any messages not yet saved to the session file.
+
+        If the history has been rewritten rather than appended to, the file is
+        compacted instead. The chat's catalogue entry, if there is a catalogue, is
+        updated to match.
+        """
+        if not self.path:
+            time_stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+            self.path = os.path.join(self.chat_dir, f"{time_stamp}.jsonl")
+            self.saved_message_count = 0
+
+        rewritten = len(chat_data) < self.saved_message_count
+        new_messages = chat_data if rewritten else chat_data[self.saved_message_count:]
+        if rewritten:
+            compact_chat(chat_data, self.path)
+        else:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for message in new_messages:
+                    f.write(json.dumps(materialise_message(message), ensure_ascii=False) + "\n")
+                f.flush()
+                if CHAT_FSYNC:
+                    os.fsync(f.fileno())
+        self.saved_message_count = len(chat_data)
+        if self.catalogue is not None:
+            self.catalogue.record(self.path, new_messages, len(chat_data), rewritten)
+
+def compact_chat(chat_data, file_path):
+    """Rewrites a whole chat file, atomically replacing the old one so a crash can't truncate it."""
+    temp_path = f"{file_path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        for message in chat_data:
+            f.write(json.dumps(materialise_message(message), ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, file_path)
+
+class LazyContent:
+    """A message's content that is left in its chat file until it is needed.
+
+    Resumed chats can hold several directory uploads, so rather than keeping
+    each one in memory as a string for the whole session, the message keeps
+    the location of its line in the .jsonl file and reads it back on demand.
+    """
+
+    __slots__ = ("path", "offset", "length")
+
+    def __init__(self, path: str, offset: int, length: int):
+        self.path = path
+        self.offset = offset
+        self.length = length
+
+    def load(self) -> str:
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            return json.loads(f.read(self.length))["content"]
+
+def message_content(message) -> str:
+    """Returns a message's content, reading it from disk if it was left there."""
+    content = message["content"]
+    return content.load() if isinstance(content, LazyContent) else content
+
+def materialise_message(message):
+    if isinstance(message["content"], LazyContent):
+        return {**message, "content": message["content"].load()}
+    return message
+
+def to_request_messages(messages):
+    """Returns the messages as a request body: their roles and content, with all of the content in
+    memory, leaving out anything only the history keeps, such as which model wrote a reply."""
+    return [{"role": message["role"], "content": message_content(message)} for message in messages]
+
+def iter_chat_messages(file_path, lazy_threshold=None):
+    """Streams the messages of a .jsonl chat file, one line at a time. Messages longer
+    than lazy_threshold bytes are given LazyContent rather than being decoded."""
+    with open(file_path, 'rb') as f:
+        offset = 0
+        for line in f:
+            line_offset = offset
+            offset += len(line)
+            if not line.strip():
+                continue
+            if lazy_threshold is not None and len(line) > lazy_threshold:
+                match = LAZY_MESSAGE_PREFIX.match(line)
+                if match and line.rstrip().endswith(b'}'):
+                    message = {"role": match.group(1).decode(), "content": LazyContent(file_path, line_offset, len(line))}
+                    model = LAZY_MESSAGE_MODEL.search(line, max(len(line) - 256, 0))
+                    if model:
+                        message["model"] = model.group(1).decode()
+                    yield message
+                    continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # Only the last line can be torn, by a crash part way through an append.
+                break
+
+def load_chat(file_path):
+    """Loads chat data from a file, in either the .jsonl format or the older .json one.
+    Large messages in .jsonl files are left on disk as LazyContent."""
+    if file_path.endswith('.jsonl'):
+        return list(iter_chat_messages(file_path, LAZY_CONTENT_BYTES))
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+class ChatCatalogue:
+    """SQLite index of saved chats, kept up to date by ChatWriter.
+
+    Holds each chat's start time, first prompt, latest message, message count,
+    token total and file size, so the resume menu can list, page, filter and
+    preview chats without walking the history directory or opening chat files.
+    Every message is also added to an FTS5 full-text index, if SQLite supports
+    it, for ranked search across all chats. Chats saved before the catalogue (or
+    the current VERSION of it) existed are indexed once, when it is opened.
+    """
+
+    VERSION = 2
+
+    def __init__(self, chat_dir: str, tokenizer: Tokenizer):
+        self.chat_dir = chat_dir
+        self.tokenizer = tokenizer
+        # Opened on the main thread, but updated from ChatWriter's background thread once the
+        # menus are done with it. The two never use it at the same time.
+        self.db = sqlite3.connect(os.path.join(chat_dir, 'index.sqlite3'), timeout=5, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS chats ("
+                        "path TEXT PRIMARY KEY, name TEXT, title TEXT, preview TEXT, "
+                        "message_count INTEGER, token_total INTEGER, byte_size INTEGER)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS chats_name ON chats (name)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        try:
+            self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+                            "content, role UNINDEXED, path UNINDEXED, position UNINDEXED)")
+            self.searchable = True
+        except sqlite3.OperationalError:
+            self.searchable = False
+        version = self.db.execute("SELECT value FROM meta WHERE key = 'backfilled'").fetchone()
+        if version is None or int(version[0]) < self.VERSION:
+            self.backfill()
+
+    def backfill(self):
+        """Indexes every chat file already in the history directory."""
+        print("Indexing previous chats...")
+        if self.searchable:
+            self.db.execute("DELETE FROM messages_fts")
+        for subdir, dirs, files_in_dir in os.walk(self.chat_dir):
+            for file in files_in_dir:
+                if file.endswith(('.json', '.jsonl')):
+                    path = os.path.join(subdir, file)
+                    try:
+                        messages = load_chat(path)
+                    except (OSError, ValueError):
+                        continue
+                    self.record(path, messages, len(messages), rewritten=True, commit=False,
+                                replace_messages=False)
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('backfilled', ?)", (str(self.VERSION),))
+        self.db.commit()
+
+    def record(self, path: str, new_messages: list, message_count: int, rewritten: bool = False, commit: bool = True,
+               replace_messages: bool | None = None):
+        """Adds a chat's newly saved messages to its entry and the search index. Only the new
+        messages are tokenised and indexed, unless the chat was rewritten."""
+        # Messages are materialised one at a time so that lazily loaded uploads never all
+        # have to be in memory at once.
+        new_tokens = sum(self.tokenizer.count(message_content(message)) for message in new_messages)
+        title = next((message_content(message) for message in new_messages if message["role"] == "user"), "")
+        preview = message_content(new_messages[-1]) if new_messages else ""
+        name = os.path.splitext(os.path.basename(path))[0]
+        self.db.execute("INSERT INTO chats VALUES (?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT (path) DO UPDATE SET "
+                        "title = CASE WHEN ? OR title = '' THEN excluded.title ELSE title END, "
+                        "preview = excluded.preview, message_count = excluded.message_count, "
+                        "token_total = CASE WHEN ? THEN excluded.token_total ELSE token_total + excluded.token_total END, "
+                        "byte_size = excluded.byte_size",
+                        (path, name, summarise_message(title, 100), summarise_message(preview, 300), message_count,
+                         new_tokens, os.path.getsize(path), rewritten, rewritten))
+        if self.searchable:
+            if replace_messages if replace_messages is not None else rewritten:
+                self.db.execute("DELETE FROM messages_fts WHERE path = ?", (path,))
+            first_position = message_count - len(new_messages)
+            self.db.executemany("INSERT INTO messages_fts (content, role, path, position) VALUES (?, ?, ?, ?)",
+                                ((message_content(message), message["role"], path, first_position + offset)
+                                 for offset, message in enumerate(new_messages)))
+        if commit:
+            self.db.commit()
+
+    def forget(self, path: str):
+        """Removes a chat from the catalogue, e.g. once its file has been deleted or moved."""
+        self.db.execute("DELETE FROM chats WHERE path = ?", (path,))
+        if self.searchable:
+            self.db.execute("DELETE FROM messages_fts WHERE path = ?", (path,))
+        self.db.commit()
+
+    def forget_missing(self, rows: list) -> bool:
+        """Forgets the chats among rows whose files no longer exist, and returns whether there were any."""
+        missing = {row["path"] for row in rows if not os.path.exists(row["path"])}
+        for path in missing:
+            self.forget(path)
+        return bool(missing)
+
+    def recent(self, limit: int, offset: int = 0, search: str = "") -> list:
+        """Returns a page of chats, most recent first, optionally filtered by their text."""
+        pattern = f"%{search}%"
+        while True:
+            rows = self.db.execute("SELECT * FROM chats WHERE ? = '' OR title LIKE ? OR preview LIKE ? "
+                                   "ORDER BY name DESC LIMIT ? OFFSET ?",
+                                   (search, pattern, pattern, limit, offset)).fetchall()
+            # Chats deleted or moved since they were saved are dropped, and the page read again without them.
+            if not self.forget_missing(rows):
+                return rows
+
+    def search(self, query: str, limit: int = SEARCH_RESULTS) -> list:
+        """Returns the best matching message from each of the most relevant chats, ranked by
+        BM25, with a snippet around the match delimited by \\x02 and \\x03."""
+        # Quote every term so that user input is never parsed as FTS5 query syntax.
+        terms = " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+        if not self.searchable or not terms:
+            return []
+        while True:
+            rows = self.db.execute("SELECT m.path, m.role, m.position, c.name, c.title, "
+                                   "snippet(messages_fts, 0, char(2), char(3), '...', 16) AS snippet "
+                                   "FROM messages_fts AS m JOIN chats AS c ON c.path = m.path "
+                                   "WHERE messages_fts MATCH ? ORDER BY bm25(messages_fts) LIMIT ?",
+                                   (terms, limit * 5)).fetchall()
+            if not self.forget_missing(rows):
+                break
+        results = {}
+        for row in rows:
+            results.setdefault(row["path"], row)
+        return list(results.values())[:limit]
+
+def open_chat_catalogue(chat_dir: str, tokenizer: Tokenizer) -> ChatCatalogue | None:
+    """Opens the chat catalogue, or returns None if it can't be, so chats are still saved."""
+    try:
+        return ChatCatalogue(chat_dir, tokenizer)
+    except (OSError, sqlite3.Error) as e:
+        print(f"Chat history index unavailable: {e}")
+        return None
+
+def summarise_message(content: str, length: int) -> str:
+    """Returns the start of a message on a single line, for menus and previews."""
+    summary = " ".join(content.split())
+    return summary if len(summary) <= length else summary[:length - 3] + "..."
@@ -0,0 +1,595 @@
+import fnmatch
+import os
+import re
+import sqlite3
+import sys
+import time
+
+from collections import deque
+
+from chatcore.packing import UploadFile, pack_files
+from chatcore.telemetry import StageTimes
+from chatcore.tokens import TOKENIZER_BATCH_SIZE, Tokenizer
+
+INGEST_WORKERS = 16
+INGEST_QUEUE_SIZE = 256
+TREE_MAX_DEPTH = 8
+TREE_MAX_ENTRIES = 500
+UPLOAD_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# A directory upload stops reading once it has read this many times its token limit.
+UPLOAD_READ_LIMIT_FACTOR = 20
+# The openings of the prompts built for "Upload:" requests, used to recognise uploads in a chat.
+UPLOAD_PROMPT_PREFIXES = ("The following describes a directory stucture", "Please analyse the contents of the following file:")
+
+def detect_file_analysis_request(content: str) -> tuple[bool, str, bool]:
+    if content.startswith("Upload:"):
+        path = content[len("Upload: "):].strip()
+        path = os.path.expanduser(path)
+        if os.path.isdir(path):
+            return True, path, True  # Indicates a directory
+        return True, path, False  # Indicates a file
+    return False, "", False
+
+DEFAULT_IGNORE_PATTERNS = [
+    '*/.terraform/*', '.terraform',
+    '*/.terragrunt-cache/*', '.terragrunt-cache',
+    '*.tfstate', '*.tfstate*',
+    '*/.tfsec/*', '.tfsec',
+    '.vmc-makefile', '*/.centralized-makefile',
+    'Pipfile', '*/Pipfile', 'Pipfile.lock', '*/Pipfile.lock',
+    '.test-plans', '*/.test-plans', '.cache', '*/.cache',
+    '*.pyc', '*/*.pyc', '*.pyo', '*/*.pyo', '*.zip', '*/*.zip',
+    '__pycache__', '*/__pycache__', '.tox', '*/.tox',
+    '*.egg-info', '*/*.egg-info', '.coverage', '*/.coverage',
+    '.pytest_cache', '*/.pytest_cache', 'nosetests.xml', '*/nosetests.xml',
+    'coverage.xml', '*/coverage.xml', 'htmlcov/', '*/htmlcov/',
+    'report.xml', '*/report.xml', 'build/*', '*/build/*', 'dist/*',
+    '*/dist/*', 'test-generated*.yml', '*/test-generated*.yml',
+    '.DS_Store', '._.DS_Store', '.librarian', '.idea', '.vscode',
+    '.history', '*swp', '.envrc', '.direnv', '.editorconfig',
+    '.external_modules', 'modules/*', '.terraform.lock.hcl', '*.png',
+    '*.jpg', '*.jpeg', '*.bmp', '.test-data', '*.plan', '*plan.out',
+    '*plan.summary', '*/.git', '*/node_modules', '*/.gitignore', '*/.git-credentials',
+    '*/manifest.json', '.checkov.yaml', '*/saml/*'
+]
+
+def gitignore_pattern_to_regex(pattern: str) -> str:
+    """Translates a single .gitignore glob into a regular expression.
+
+    `*` and `?` never match a `/`, while `**` matches across directories as
+    described in the gitignore documentation.
+    """
+    i, n = 0, len(pattern)
+    regex = ""
+    while i < n:
+        char = pattern[i]
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == n:
+            regex += "/.*"
+            i += 3
+        elif pattern.startswith("**", i):
+            regex += ".*"
+            i += 2
+        elif char == "*":
+            regex += "[^/]*"
+            i += 1
+        elif char == "?":
+            regex += "[^/]"
+            i += 1
+        elif char == "[":
+            end = pattern.find("]", i + 2)
+            if end == -1:
+                regex += re.escape(char)
+                i += 1
+            else:
+                char_class = pattern[i + 1:end].replace("\\", "\\\\")
+                if char_class.startswith("!"):
+                    char_class = "^" + char_class[1:]
+                regex += f"[{char_class}]"
+                i = end + 1
+        elif char == "\\" and i + 1 < n:
+            regex += re.escape(pattern[i + 1])
+            i += 2
+        else:
+            regex += re.escape(char)
+            i += 1
+    return regex
+
+class IgnoreMatcher:
+    """Decides which paths a directory upload skips.
+
+    Built once per upload. The default fnmatch patterns are sorted into literal,
+    suffix and substring lookups, literal patterns being names (such as
+    `.DS_Store` or `Pipfile`) matched against a file or directory's own name, with whatever is left merged into a single
+    regular expression, so each path costs a handful of checks rather than a
+    fnmatch call per pattern. Rules from any `.gitignore` files found while
+    walking the tree are applied on top, with negation, anchoring and
+    directory-only rules honoured and the last matching rule winning.
+    """
+
+    def __init__(self, root_dir: str, patterns: list[str] = DEFAULT_IGNORE_PATTERNS):
+        self.root_dir = root_dir
+        self.exact = set()
+        self.exact_directories = set()  # from names written with a trailing slash, e.g. 'htmlcov/'
+        suffixes = []
+        self.substrings = []
+        remaining = []
+        for pattern in patterns:
+            if not any(char in pattern for char in "*?["):
+                if pattern.endswith("/"):
+                    self.exact_directories.add(pattern.rstrip("/"))
+                else:
+                    self.exact.add(pattern)
+            elif pattern.startswith("*") and not any(char in pattern[1:] for char in "*?["):
+                suffixes.append(pattern[1:])
+            elif (len(pattern) > 2 and pattern.startswith("*") and pattern.endswith("*")
+                  and not any(char in pattern[1:-1] for char in "*?[")):
+                self.substrings.append(pattern[1:-1])
+            else:
+                remaining.append(pattern)
+        self.suffixes = tuple(suffixes)
+        self.pattern_regex = re.compile("|".join(fnmatch.translate(p) for p in remaining)) if remaining else None
+        # (base directory relative to root_dir, compiled regex, anchored, negated, directory only)
+        self.gitignore_rules = []
+
+    def load_gitignore(self, dir_path: str):
+        """Adds the rules from dir_path/.gitignore, if there is one, scoped to dir_path."""
+        gitignore_path = os.path.join(dir_path, ".gitignore")
+        try:
+            with open(gitignore_path, 'r', encoding='utf-8', errors='ignore') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return
+
+        base = os.path.relpath(dir_path, self.root_dir).replace(os.sep, "/")
+        base = "" if base == "." else base
+        for line in lines:
+            line = line.rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negated = line.startswith("!")
+            if negated:
+                line = line[1:]
+            elif line.startswith("\\"):
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            # A slash anywhere but the end anchors the pattern to the .gitignore's directory.
+            anchored = "/" in line
+            line = line.lstrip("/")
+            regex = re.compile(gitignore_pattern_to_regex(line) + r"\Z")
+            self.gitignore_rules.append((base, regex, anchored, negated, dir_only))
+
+    def matches_default_patterns(self, path: str) -> bool:
+        return bool(path.endswith(self.suffixes)
+                    or any(substring in path for substring in self.substrings)
+                    or (self.pattern_regex and self.pattern_regex.match(path)))
+
+    def should_ignore(self, path: str, is_dir: bool = False) -> bool:
+        """Returns True if the path should be left out of the upload."""
+        name = os.path.basename(path)
+        if name in self.exact or (is_dir and name in self.exact_directories):
+            return True
+        if self.matches_default_patterns(path):
+            return True
+        # Patterns such as '*/.terraform/*' ignore everything beneath a directory, so the
+        # directory itself is pruned rather than walked file by file.
+        if is_dir and self.matches_default_patterns(path + "/"):
+            return True
+        if not self.gitignore_rules:
+            return False
+
+        relative_path = os.path.relpath(path, self.root_dir).replace(os.sep, "/")
+        ignored = False
+        for base, regex, anchored, negated, dir_only in self.gitignore_rules:
+            if dir_only and not is_dir:
+                continue
+            if base:
+                if not relative_path.startswith(base + "/"):
+                    continue
+                candidate = relative_path[len(base) + 1:]
+            else:
+                candidate = relative_path
+            if not anchored:
+                candidate = candidate.rsplit("/", 1)[-1]
+            if regex.match(candidate):
+                ignored = not negated
+        return ignored
+
+class DirectoryTree:
+    """Records the directories visited by walk_directory and renders them like `tree -d`."""
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        self.children = {"": []}
+
+    def add_directory(self, relative_dir: str):
+        parent, _, name = relative_dir.rpartition("/")
+        self.children.setdefault(parent, []).append(name)
+        self.children.setdefault(relative_dir, [])
+
+    def render(self, max_depth: int | None = TREE_MAX_DEPTH, max_entries: int | None = TREE_MAX_ENTRIES) -> str:
+        """Returns the tree as text, listing at most max_entries directories down to max_depth levels."""
+        lines = [self.root_dir]
+
+        def render_children(relative_dir, prefix, depth):
+            names = self.children[relative_dir]
+            for index, name in enumerate(names):
+                if max_entries is not None and len(lines) > max_entries:
+                    return
+                is_last = index == len(names) - 1
+                lines.append(f"{prefix}{'└── ' if is_last else '├── '}{name}")
+                if max_depth is None or depth < max_depth:
+                    child = f"{relative_dir}/{name}" if relative_dir else name
+                    render_children(child, prefix + ("    " if is_last else "│   "), depth + 1)
+
+        render_children("", "", 1)
+        total = len(self.children) - 1
+        shown = len(lines) - 1
+        if shown < total:
+            lines.append(f"... {total - shown} more directories not shown")
+        lines.append(f"\n{total} director{'y' if total == 1 else 'ies'}")
+        return "\n".join(lines)
+
+class UploadCache:
+    """Persistent cache of rendered directory-upload sections and their token counts.
+
+    Entries are keyed by absolute path and only reused while the file's inode,
+    mtime, size and tokenizer all match, so re-uploading an unchanged tree costs a
+    stat per file instead of a read and an encode. Binary and unreadable files are
+    cached too, with no section. Least recently used entries are evicted once the
+    stored sections exceed max_bytes.
+
+    New entries are held in memory and written in close(), in one short
+    transaction, so that uploads sharing the cache (from concurrent batch jobs
+    or several clients) never wait on each other for long. A cache error never
+    fails an upload: it carries on as if the cache had missed.
+    """
+
+    def __init__(self, path: str, tokenizer: Tokenizer, max_bytes: int = UPLOAD_CACHE_MAX_BYTES):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.max_bytes = max_bytes
+        self.encoding_name = tokenizer.id
+        self.now = time.time()
+        self.used_paths = []
+        self.new_rows = []
+        self.db = sqlite3.connect(path, timeout=5)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS sections ("
+                        "path TEXT PRIMARY KEY, relative_path TEXT, inode INTEGER, mtime_ns INTEGER, "
+                        "size INTEGER, encoding TEXT, section TEXT, tokens INTEGER, bytes INTEGER, "
+                        "last_used REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS sections_last_used ON sections (last_used)")
+
+    @staticmethod
+    def identity(entry: os.DirEntry) -> tuple[str, int, int, int]:
+        stat = entry.stat()
+        return os.path.abspath(entry.path), stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def lookup(self, entry: os.DirEntry, relative_path: str) -> tuple[str | None, int] | None:
+        """Returns the cached (section, tokens) for an unchanged file, or None on a miss."""
+        try:
+            path, inode, mtime_ns, size = self.identity(entry)
+        except OSError:
+            return None
+        try:
+            row = self.db.execute("SELECT relative_path, inode, mtime_ns, size, encoding, section, tokens "
+                                  "FROM sections WHERE path = ?", (path,)).fetchone()
+        except sqlite3.Error:
+            return None
+        if row is None or row[:5] != (relative_path, inode, mtime_ns, size, self.encoding_name):
+            return None
+        self.used_paths.append((self.now, path))
+        return row[5], row[6]
+
+    def store(self, entry: os.DirEntry, relative_path: str, section: str | None, tokens: int):
+        try:
+            path, inode, mtime_ns, size = self.identity(entry)
+        except OSError:
+            return
+        self.new_rows.append((path, relative_path, inode, mtime_ns, size, self.encoding_name, section, tokens,
+                              len(section) if section else 0, self.now))
+
+    def close(self):
+        """Writes the new entries, records which were used and evicts down to max_bytes, in one transaction."""
+        try:
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO sections VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    self.new_rows)
+                self.db.executemany("UPDATE sections SET last_used = ? WHERE path = ?", self.used_paths)
+                total = self.db.execute("SELECT COALESCE(SUM(bytes), 0) FROM sections").fetchone()[0]
+                if total > self.max_bytes:
+                    evicted = []
+                    for path, size in self.db.execute("SELECT path, bytes FROM sections ORDER BY last_used"):
+                        if total <= self.max_bytes:
+                            break
+                        evicted.append((path,))
+                        total -= size
+                    self.db.executemany("DELETE FROM sections WHERE path = ?", evicted)
+        except sqlite3.Error:
+            pass  # The entries are lost, and the files are read again next time; the upload itself is unaffected.
+        finally:
+            self.db.close()
+
+def open_upload_cache(path: str, tokenizer: Tokenizer) -> UploadCache | None:
+    # Opens the upload cache, or returns None so that uploads carry on uncached if it can't be.
+    try:
+        return UploadCache(path, tokenizer)
+    except (OSError, sqlite3.Error):
+        return None
+
+def is_binary(data: bytes) -> bool:
+    # Looks for a NULL byte in the first 1024 bytes of a file's contents.
+    return b'\x00' in data[:1024]
+
+def read_text_file(file_path: str) -> str | None:
+    # Reads a file exactly once, returning None if it is binary or can't be read.
+    try:
+        with open(file_path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if is_binary(data):
+        return None
+    # Normalise newlines the same way reading in text mode would.
+    return data.decode('utf-8', errors='ignore').replace('\r\n', '\n').replace('\r', '\n')
+
+def walk_directory(root_dir: str, matcher: IgnoreMatcher, tree: DirectoryTree | None = None):
+    # Yields a DirEntry for every file to upload, in the same top-down order as os.walk.
+    # Directories that aren't ignored are also recorded in tree, if one is given.
+    stack = [root_dir]
+    while stack:
+        dir_path = stack.pop()
+        matcher.load_gitignore(dir_path)
+        try:
+            with os.scandir(dir_path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            continue
+
+        subdirs = []
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                # Like os.walk, symlinked directories are not followed.
+                if not entry.is_symlink() and not matcher.should_ignore(entry.path, is_dir=True):
+                    subdirs.append(entry.path)
+                    if tree is not None:
+                        tree.add_directory(os.path.relpath(entry.path, root_dir).replace(os.sep, "/"))
+            elif not matcher.should_ignore(entry.path):
+                yield entry
+        stack.extend(reversed(subdirs))
+
+def read_directory_files(root_dir: str, matcher: IgnoreMatcher, tree: DirectoryTree | None = None,
+                         cache: UploadCache | None = None, timings: StageTimes | None = None):
+    # Yields (entry, relative path, contents, cached) for each file in walk order. Files are
+    # read on a thread pool with at most INGEST_QUEUE_SIZE reads in flight, so memory stays
+    # flat on large trees and the caller can tokenise while the next files are read. Files
+    # found in the cache aren't read at all: contents is None and cached holds the cached
+    # (section, tokens). Otherwise cached is None and contents is None for binary files.
+    # timings, if given, gets the time spent walking (including cache lookups) and waiting for reads.
+    from concurrent.futures import ThreadPoolExecutor  # imports logging, so it's left until the first upload
+
+    timings = timings if timings is not None else StageTimes()
+    with ThreadPoolExecutor(max_workers=INGEST_WORKERS) as executor:
+        entries = walk_directory(root_dir, matcher, tree)
+        pending = deque()
+        walk_finished = False
+        try:
+            while pending or not walk_finished:
+                with timings.stage("walk"):
+                    while not walk_finished and len(pending) < INGEST_QUEUE_SIZE:
+                        entry = next(entries, None)
+                        if entry is None:
+                            walk_finished = True
+                            break
+                        relative_path = os.path.relpath(entry.path, start=root_dir)
+                        cached = cache.lookup(entry, relative_path) if cache is not None else None
+                        future = executor.submit(read_text_file, entry.path) if cached is None else None
+                        pending.append((entry, relative_path, future, cached))
+                if not pending:
+                    break
+                entry, relative_path, future, cached = pending.popleft()
+                with timings.stage("read"):
+                    contents = future.result() if future else None
+                yield entry, relative_path, contents, cached
+        finally:
+            # Reached if the caller stops early, e.g. once the token budget is exceeded.
+            for _, _, future, _ in pending:
+                if future:
+                    future.cancel()
+
+def file_section(relative_path: str, contents: str) -> str:
+    # Markdown files are fenced with quotes so that their own code fences don't end the section.
+    enclosure = '"""' if relative_path.endswith('.md') else "```"
+    return f"## {relative_path}\n\n{enclosure}\n{contents}\n{enclosure}\n\n"
+
+def count_sections(files: list, batch: list, tokenizer: Tokenizer, cache: UploadCache | None = None) -> int:
+    # Counts the uncounted sections of a batch in one call, caching the results, moves the batch
+    # into files as UploadFiles and returns the tokens it added.
+    uncounted = [item for item in batch if item[3] is None]
+    for item, section_tokens in zip(uncounted, tokenizer.count_batch([item[2] for item in uncounted])):
+        item[3] = section_tokens
+        if cache is not None:
+            cache.store(item[0], item[1], item[2], section_tokens)
+    added = 0
+    for entry, relative_path, section, section_tokens in batch:
+        try:
+            stat = entry.stat()
+            size, mtime = stat.st_size, stat.st_mtime
+        except OSError:
+            size, mtime = 0, 0.0
+        files.append(UploadFile(len(files), relative_path, section, section_tokens, size, mtime))
+        added += section_tokens
+    batch.clear()
+    return added
+
+class DirectoryUpload:
+    """A directory read for an upload: the tree of its directories and the section and token count of
+    each readable file, ready to be packed into the upload's token limit once the question is known."""
+
+    def __init__(self, root_dir: str, tree: str, files: list[UploadFile], complete: bool, token_limit: int,
+                 tokenizer: Tokenizer):
+        self.root_dir = root_dir
+        self.tree = tree
+        self.files = files
+        self.complete = complete  # False if reading stopped early, as the directory was far over the limit
+        self.token_limit = token_limit
+        self.tokenizer = tokenizer
+        self.total_tokens = sum(file.tokens for file in files)
+        self.left_out = 0  # files left out by the last pack
+
+    def pack(self, query: str = "") -> tuple[str, int]:
+        """Returns the directory as markdown within the token limit, and its token count.
+
+        If the directory is over the limit, the files most relevant to query are
+        chosen, and a manifest of what was left out is appended (see chatcore.packing).
+        """
+        if not self.files:
+            raise UploadError("Directory is empty or contains no readable files.")
+        header = (f"# Directory Analysis for {self.root_dir}\n\n"
+                  f"## Directory Structure\n\n"
+                  f"```\n{self.tree}\n```\n\n")
+        header_tokens = self.tokenizer.count(header)
+        if header_tokens >= self.token_limit:
+            raise UploadError(f"The directory is too large to upload because its structure alone is likely "
+                              f"larger than {self.token_limit:,} tokens.")
+        body, body_tokens, self.left_out = pack_files(self.files, self.token_limit - header_tokens, self.tokenizer,
+                                                      query, self.complete)
+        return header + body, header_tokens + body_tokens
+
+    def build_prompt(self, query: str = "") -> tuple[str, int]:
+        markdown_content, token_count = self.pack(query)
+        return directory_upload_prompt(markdown_content), token_count
+
+def read_directory(root_dir, token_limit: int, tokenizer: Tokenizer, cache: UploadCache | None = None,
+                   timings: StageTimes | None = None) -> DirectoryUpload:
+    # Each section is tokenised exactly once, in batches so that the tokenizer can encode them in
+    # parallel, and unchanged files reuse the section and token count cached from a previous upload.
+    # Reading stops once the files read are far over the limit, as only a fraction of them could be sent.
+    timings = timings if timings is not None else StageTimes()
+    files = []
+    token_count = 0
+    batch = []  # [entry, relative path, section, tokens or None until counted]
+    complete = True
+
+    tree = DirectoryTree(root_dir)
+    for entry, relative_file_path, content, cached in read_directory_files(root_dir, IgnoreMatcher(root_dir),
+                                                                           tree, cache, timings):
+        if cached is not None:
+            section, section_tokens = cached
+            if section is None:
+                continue
+            batch.append([entry, relative_file_path, section, section_tokens])
+        elif content is None:
+            if cache is not None:
+                cache.store(entry, relative_file_path, None, 0)
+            continue
+        else:
+            batch.append([entry, relative_file_path, file_section(relative_file_path, content), None])
+
+        if len(batch) >= TOKENIZER_BATCH_SIZE:
+            with timings.stage("tokenize"):
+                token_count += count_sections(files, batch, tokenizer, cache)
+            if token_count > token_limit * UPLOAD_READ_LIMIT_FACTOR:
+                complete = False
+                break
+    with timings.stage("tokenize"):
+        token_count += count_sections(files, batch, tokenizer, cache)
+    # The tree is built by the same walk, so it is only complete at the end.
+    return DirectoryUpload(root_dir, tree.render(), files, complete, token_limit, tokenizer)
+
+def generate_markdown_from_directory(root_dir, max_tokens: int, tokenizer: Tokenizer, cache_path: str | None = None,
+                                     timings: StageTimes | None = None, query: str = "") -> tuple[str, int]:
+    cache = open_upload_cache(cache_path, tokenizer) if cache_path else None
+    try:
+        upload = read_directory(root_dir, max_tokens, tokenizer, cache, timings)
+    finally:
+        if cache is not None:
+            cache.close()
+    return upload.pack(query)
+
+def read_file_contents(file_path: str, max_tokens: int, tokenizer: Tokenizer,
+                       timings: StageTimes | None = None) -> tuple[str, str, int]:
+    timings = timings if timings is not None else StageTimes()
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            file_name = os.path.basename(file_path)
+            with timings.stage("read"):
+                file_contents = file.read()
+            if not file_contents:
+                return file_name, False, 0
+            with timings.stage("tokenize"):
+                token_count = tokenizer.count(file_contents)
+            if token_count > max_tokens:
+                return file_name, f"FILE TOO BIG.", token_count
+            return file_name, file_contents, token_count
+    except Exception as e:
+        print(f"\nError reading file: {e}", file=sys.stderr)
+        return "", f'I attempted to upload a file but it failed. For your next response reply ONLY: "No file was uploaded."', 0
+
+def directory_upload_prompt(markdown_content: str) -> str:
+    """Returns the user message that uploads a directory rendered by DirectoryUpload.pack."""
+    return (f"The following describes a directory stucture along with all its contents in "
+            f"Markdown format. "
+            f"Please carefully analyse the directory structure and the files contained within. Pay "
+            f"attention to whether the directory stucture looks like a code repository. Then take a "
+            f"deep breath and provide a brief summary of your analysis. End your response with an "
+            f"assurance that you have memorised the contents of the repository and you are ready to "
+            f"answer the user's questions.\n\n{markdown_content}")
+
+def file_upload_prompt(file_name: str, file_contents: str) -> str:
+    """Returns the user message that uploads a single file."""
+    return (f"Please analyse the contents of the following file:\n"
+            f"\n{file_name}\n"
+            f"\n{file_contents}\n"
+            f"\nEnd your response by asking the user what questions they have about the file.")
+
+class UploadError(Exception):
+    """An upload that can't be sent, e.g. as it is over its token limit or has nothing in it."""
+
+class FileUpload:
+    """A file read for an upload."""
+
+    def __init__(self, prompt: str, token_count: int):
+        self.prompt = prompt
+        self.token_count = token_count
+
+    def build_prompt(self, query: str = "") -> tuple[str, int]:
+        return self.prompt, self.token_count
+
+def read_upload(path: str, is_directory: bool, directory_token_limit: int, file_token_limit: int,
+                tokenizer: Tokenizer, cache_path: str | None = None,
+                timings: StageTimes | None = None) -> DirectoryUpload | FileUpload:
+    """Reads and tokenises an "Upload:" file or directory. Its build_prompt(query) returns the user
+    message that sends it, with its estimated token count. Raises UploadError if there is nothing that
+    can be sent. timings, if given, gets the time spent walking the directory, reading and tokenising."""
+    if is_directory:
+        cache = open_upload_cache(cache_path, tokenizer) if cache_path else None
+        try:
+            return read_directory(path, directory_token_limit, tokenizer, cache, timings)
+        finally:
+            if cache is not None:
+                cache.close()
+
+    file_name, file_contents, token_count = read_file_contents(path, file_token_limit, tokenizer, timings)
+    if not file_name:
+        raise UploadError(f"The file: {path} couldn't be read.")
+    if file_contents == "FILE TOO BIG.":
+        raise UploadError(f"The file: {file_name} is too large to upload because it is likely larger than "
+                          f"{file_token_limit:,} tokens.\n"
+                          f"Estimated token count for this file: {token_count}")
+    if not file_contents:
+        raise UploadError(f"The file: {file_name} is empty.")
+    return FileUpload(file_upload_prompt(file_name, file_contents), token_count)
+
+def is_upload_prompt(content: str) -> bool:
+    """Returns True if a user message was built by directory_upload_prompt or file_upload_prompt."""
+    return content.startswith(UPLOAD_PROMPT_PREFIXES)
@@ -0,0 +1,201 @@
+import math
+import os
+import re
+
+from chatcore.tokens import Tokenizer
+
+# Files that say the most about a repository for their size, ranked first when not everything fits.
+ENTRY_POINT_NAMES = {
+    "main.py", "__main__.py", "app.py", "cli.py", "manage.py", "server.py", "wsgi.py", "asgi.py", "setup.py",
+    "pyproject.toml", "setup.cfg", "requirements.txt", "package.json", "tsconfig.json", "index.js", "index.ts",
+    "main.js", "main.ts", "app.js", "app.ts", "server.js", "server.ts", "main.go", "go.mod", "main.rs", "lib.rs",
+    "cargo.toml", "main.c", "main.cpp", "cmakelists.txt", "makefile", "dockerfile", "docker-compose.yml",
+    "pom.xml", "build.gradle", "gemfile", "program.cs",
+}
+DOCUMENT_STEMS = {"contributing", "architecture", "design", "overview", "getting_started", "usage"}
+SOURCE_EXTENSIONS = {
+    ".py", ".js", ".jsx", ".ts", ".tsx", ".go", ".rs", ".c", ".h", ".cc", ".cpp", ".hpp", ".java", ".kt", ".cs",
+    ".rb", ".php", ".swift", ".scala", ".sh", ".sql", ".vue", ".svelte", ".lua", ".ex", ".exs", ".hs", ".ml",
+}
+# Files that are large and rarely what a question is about: lock files, generated and data files.
+LOW_VALUE_NAMES = {"package-lock.json", "yarn.lock", "pnpm-lock.yaml", "poetry.lock", "cargo.lock", "go.sum",
+                   "composer.lock", "gemfile.lock", "uv.lock", "pipfile.lock"}
+LOW_VALUE_SUFFIXES = (".min.js", ".min.css", ".map", ".csv", ".tsv", ".svg", ".lock", ".snap", ".ipynb")
+# A file longer than this share of the budget is outlined or truncated rather than sent in full.
+MAX_FILE_SHARE = 0.25
+# Smallest useful outline or truncated file, in tokens.
+MIN_PARTIAL_TOKENS = 200
+OUTLINE_HEAD_LINES = 15
+# Lines that declare something, kept when a source file is outlined.
+OUTLINE_LINE = re.compile(r"\s*(?:(?:export\s+)?(?:default\s+)?(?:async\s+)?(?:def|class|function|interface|enum)\s"
+                          r"|(?:pub(?:\([^)]*\))?\s+)?(?:fn|struct|trait|impl|mod|type)\s|func\s|type\s+\w+\s+struct"
+                          r"|(?:public|private|protected|internal)\s|#{1,6}\s|@\w+)")
+MANIFEST_MAX_ENTRIES = 100
+# Tokens set aside for the manifest before the files are packed.
+MANIFEST_RESERVE_TOKENS = 2500
+QUERY_STOPWORDS = {
+    "the", "and", "for", "are", "but", "not", "you", "all", "any", "can", "had", "her", "was", "one", "our", "out",
+    "has", "have", "how", "what", "why", "when", "where", "which", "who", "this", "that", "with", "from", "they",
+    "them", "then", "than", "there", "their", "into", "does", "doing", "done", "about", "would", "could", "should",
+    "please", "explain", "tell", "show", "file", "files", "code", "repo", "repository", "directory", "upload",
+}
+
+class UploadFile:
+    """A file read for a directory upload: its rendered section, token count and what it is ranked on."""
+
+    __slots__ = ("index", "relative_path", "section", "tokens", "size", "mtime")
+
+    def __init__(self, index: int, relative_path: str, section: str, tokens: int, size: int, mtime: float):
+        self.index = index  # position in walk order, which the upload keeps
+        self.relative_path = relative_path
+        self.section = section
+        self.tokens = tokens
+        self.size = size
+        self.mtime = mtime
+
+def query_terms(query: str) -> set[str]:
+    """Returns the words of a question worth looking for in file paths and contents."""
+    return {word for word in re.findall(r"[a-z0-9_]{3,}", query.lower()) if word not in QUERY_STOPWORDS}
+
+def count_term(term: str, text: str) -> int:
+    """Returns how many times term appears in text as a whole word or identifier, or as a part of an
+    identifier between underscores, so that "foo17" isn't found in "foo171" but "parse" is in "parse_item"."""
+    return len(re.findall(rf"(?<![a-z0-9]){re.escape(term)}(?![a-z0-9])", text))
+
+def score_file(file: UploadFile, terms: set[str], oldest_mtime: float, mtime_span: float) -> float:
+    """Returns how much a file is worth including in an upload that can't fit everything; higher is better."""
+    path = file.relative_path.replace(os.sep, "/").lower()
+    name = path.rsplit("/", 1)[-1]
+    stem, extension = os.path.splitext(name)
+    depth = path.count("/")
+    score = 0.0
+    if stem.startswith("readme"):
+        score += 12 if depth == 0 else 6
+    elif stem in DOCUMENT_STEMS:
+        score += 3
+    if name in ENTRY_POINT_NAMES:
+        score += 6 if depth <= 1 else 3
+    if extension in SOURCE_EXTENSIONS:
+        score += 2
+    if name in LOW_VALUE_NAMES or name.endswith(LOW_VALUE_SUFFIXES):
+        score -= 8
+    if name.startswith("test_") or "/test" in f"/{path}" or stem.endswith(("_test", ".test", ".spec")):
+        score -= 1
+    score -= min(depth, 6) * 0.5
+    # Recently changed files are more likely to be what the user is working on.
+    if mtime_span > 0:
+        score += 3 * (file.mtime - oldest_mtime) / mtime_span
+    # Smaller files cost less of the budget for what they show.
+    score -= max(math.log2(max(file.tokens, 1) / 500), 0) * 0.75
+    if terms:
+        contents = file.section.lower()
+        for term in terms:
+            if count_term(term, path):
+                score += 6
+            occurrences = count_term(term, contents)
+            if occurrences:
+                score += min(1 + math.log2(occurrences), 5)
+    return score
+
+def split_section(section: str) -> tuple[str, str, str]:
+    """Returns the heading, fence and contents of a section rendered by chatcore.ingest.file_section."""
+    heading, _, rest = section.partition("\n\n")
+    fence, _, rest = rest.partition("\n")
+    return heading, fence, rest[:-(len(fence) + 3)]
+
+def outline(contents: str) -> str | None:
+    """Returns the opening lines and declarations of a source or markdown file, or None if it has too few."""
+    lines = contents.split("\n")
+    declarations = [line for line in lines[OUTLINE_HEAD_LINES:] if OUTLINE_LINE.match(line)]
+    if len(declarations) < 3:
+        return None
+    return "\n".join(lines[:OUTLINE_HEAD_LINES] + ["..."] + declarations)
+
+def partial_section(file: UploadFile, max_tokens: int, tokenizer: Tokenizer) -> tuple[str, int] | None:
+    """Returns an outline of a file, or its start, in a section of at most max_tokens, and its token count."""
+    heading, fence, contents = split_section(file.section)
+    line_count = contents.count("\n") + 1
+    shortened = outline(contents)
+    if shortened is not None:
+        label = f"outline: {line_count:,} lines, {file.tokens:,} tokens in full"
+    else:
+        label = f"truncated: {line_count:,} lines, {file.tokens:,} tokens in full"
+        shortened = contents
+    # Cut to the budget by the file's own characters per token, leaving room for the heading.
+    max_chars = int(len(contents) * (max_tokens - 50) / max(file.tokens, 1))
+    if len(shortened) > max_chars:
+        shortened = shortened[:max(shortened.rfind("\n", 0, max_chars), 0)] + "\n..."
+        if shortened.startswith("\n"):
+            return None
+    section = f"{heading} ({label})\n\n{fence}\n{shortened}\n{fence}\n\n"
+    tokens = tokenizer.count(section)
+    return (section, tokens) if tokens <= max_tokens else None
+
+def manifest(query: bool, complete: bool, included: list, partial: list, skipped: list) -> str:
+    """Returns the section listing what an over-budget upload includes and leaves out, most relevant first."""
+    def files(count: int) -> str:
+        return f"{count:,} file{'s' if count != 1 else ''}"
+
+    ranked_by = "the question asked about it and by " if query else ""
+    lines = ["## Upload Manifest\n",
+             "This directory is too large to upload in full, so its files were ranked by "
+             f"{ranked_by}how central, recent and small they are, and only the highest ranked were included.",
+             f"\nIncluded in full: {files(len(included))} ({sum(file.tokens for file in included):,} tokens)."]
+    if partial:
+        lines.append(f"\nOutlined or truncated to fit ({files(len(partial))}):")
+        lines += [f"- {file.relative_path} ({file.tokens:,} tokens in full)" for file in partial[:MANIFEST_MAX_ENTRIES]]
+    if skipped:
+        lines.append(f"\nLeft out ({files(len(skipped))}, {sum(file.tokens for file in skipped):,} tokens):")
+        lines += [f"- {file.relative_path} ({file.tokens:,} tokens)" for file in skipped[:MANIFEST_MAX_ENTRIES]]
+        if len(skipped) > MANIFEST_MAX_ENTRIES:
+            lines.append(f"- ... and {len(skipped) - MANIFEST_MAX_ENTRIES:,} more")
+    if not complete:
+        lines.append("\nThe directory was too large to read all of, so files after those listed were not considered.")
+    return "\n".join(lines) + "\n"
+
+def pack_files(files: list[UploadFile], budget: int, tokenizer: Tokenizer, query: str = "",
+               complete: bool = True) -> tuple[str, int, int]:
+    """Returns the sections of the files to upload within budget tokens, in walk order, with their token count
+    and how many files were left out.
+
+    If everything fits, every file is included as it is. Otherwise files are
+    ranked by score_file and added greedily, highest first; a file too large for
+    what is left (or for MAX_FILE_SHARE of the budget) is outlined or truncated
+    instead, and a manifest of what was included and left out is appended.
+    """
+    total = sum(file.tokens for file in files)
+    if total <= budget and complete:
+        return "".join(file.section for file in files), total, 0
+
+    terms = query_terms(query)
+    mtimes = [file.mtime for file in files]
+    oldest_mtime = min(mtimes, default=0)
+    mtime_span = max(mtimes, default=0) - oldest_mtime
+    ranked = sorted(files, key=lambda file: score_file(file, terms, oldest_mtime, mtime_span), reverse=True)
+    rank = {file.index: position for position, file in enumerate(ranked)}
+    max_file_tokens = int(budget * MAX_FILE_SHARE)
+    remaining = budget - min(MANIFEST_RESERVE_TOKENS, budget // 10)
+    chosen = {}  # file index: (file, section, tokens, whether it is partial)
+    for file in ranked:
+        if file.tokens <= min(remaining, max_file_tokens):
+            chosen[file.index] = (file, file.section, file.tokens, False)
+            remaining -= file.tokens
+        elif remaining >= MIN_PARTIAL_TOKENS:
+            partial = partial_section(file, min(remaining, max_file_tokens), tokenizer)
+            if partial is not None:
+                chosen[file.index] = (file, *partial, True)
+                remaining -= partial[1]
+
+    # The manifest is counted once the files are chosen; on the rare occasion it doesn't fit in the
+    # tokens reserved for it, the lowest ranked files are dropped until it does.
+    while True:
+        included = [file for file in ranked if file.index in chosen and not chosen[file.index][3]]
+        partial = [file for file in ranked if file.index in chosen and chosen[file.index][3]]
+        skipped = [file for file in ranked if file.index not in chosen]
+        listing = manifest(bool(terms), complete, included, partial, skipped)
+        tokens = sum(item[2] for item in chosen.values()) + tokenizer.count(listing)
+        if tokens <= budget or not chosen:
+            break
+        del chosen[max(chosen, key=rank.get)]
+    sections = [chosen[index][1] for index in sorted(chosen)]
+    return "".join(sections) + listing, tokens, len(skipped)
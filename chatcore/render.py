@@ -0,0 +1,133 @@
+import re
+import time
+
+from rich.console import Console
+from rich.live import Live
+from rich.segment import Segment, Segments
+
+RENDER_REFRESH_PER_SECOND = 10
+
+# Starts a list item, e.g. "- ", "* ", "1. " or "2) ".
+LIST_ITEM = re.compile(r"(?:[-*+]|\d{1,9}[.)])(?:[ \t]|$)")
+# Opens a code fence: three or more backticks or tildes, indented by at most three spaces. A fence is
+# only closed by a line of the same character, at least as long, and nothing else.
+FENCE = re.compile(r" {0,3}(`{3,}|~{3,})")
+# The start of a line that may yet turn out to be a list item, once more of it has arrived.
+LIST_ITEM_PREFIX = re.compile(r"[-*+]|\d{1,9}[.)]?")
+
+console = Console(highlight=False)
+
+class StreamingMarkdown:
+    """Renders a streamed reply into a Live display without re-parsing all of it per token.
+
+    Deltas are buffered and only applied at the Live refresh rate. Once a markdown
+    block is complete it is rendered once, printed above the Live display and
+    frozen, so each refresh only re-parses the open tail of the reply rather than
+    everything received so far. A block is only known to be complete when the
+    next one starts, with a line that isn't indented, outside a code fence, after
+    a blank line or a closing fence. Indented lines and list items after a blank
+    line may continue an indented code block or a loose list, so they don't start
+    a new block, and the output is the same as rendering the reply in one go.
+    """
+
+    def __init__(self, live: Live, refresh_per_second: float = RENDER_REFRESH_PER_SECOND):
+        self.live = live
+        self.interval = 1 / refresh_per_second
+        self.chunks = []   # every delta, joined once at the end for the complete message
+        self.pending = []  # deltas received since the last refresh
+        self.tail = ""     # text that hasn't been frozen yet
+        self.scanned = 0   # how far into tail block boundaries have been looked for
+        self.boundary = 0  # end of the last complete block in tail
+        self.printed = False  # whether any blocks have been frozen and printed
+        self.fence = None  # the backticks or tildes that opened the code fence the tail is in, if any
+        self.after_break = False  # whether a blank line or closing fence has been seen since the last text
+        self.last_refresh = 0.0
+        self.render_seconds = 0.0  # spent parsing and rendering markdown, for the turn's telemetry
+
+    def feed(self, delta: str):
+        self.chunks.append(delta)
+        self.pending.append(delta)
+        if time.monotonic() - self.last_refresh >= self.interval:
+            self.refresh()
+
+    def refresh(self):
+        self.last_refresh = time.monotonic()
+        if not self.pending:
+            return
+        started = time.perf_counter()
+        self.tail += "".join(self.pending)
+        self.pending.clear()
+        self.find_block_boundary()
+        if self.boundary:
+            block, self.tail = self.tail[:self.boundary], self.tail[self.boundary:]
+            self.live.console.print(self.render_block(block, frozen=True), end="")
+            self.printed = self.printed or bool(block.strip())
+            self.scanned -= self.boundary
+            self.boundary = 0
+        self.live.update(self.render_block(self.tail))
+        self.render_seconds += time.perf_counter() - started
+
+    def render_block(self, text: str, frozen: bool = False) -> Segments:
+        # Renders markdown as it would be rendered as part of the whole reply. A single Markdown puts
+        # an empty line after each top-level block, even one that renders nothing, like an HTML block.
+        # Rendered on their own, lists and tables start with it, and it is added to any other block
+        # that follows one already printed. The open tail drops its final newline, which the Live
+        # display adds itself.
+        from rich.markdown import Markdown  # slow to import, so it isn't loaded until the first reply
+
+        console = self.live.console
+        segments = list(console.render(Markdown(text), console.options))
+        if self.printed and text.strip() and (not segments or segments[0].text != "\n"):
+            segments.insert(0, Segment.line())
+        if not frozen and segments and segments[-1].text == "\n":
+            segments.pop()
+        return Segments(segments)
+
+    def find_block_boundary(self):
+        # Scans each complete line of the tail once, tracking whether it is inside a code fence, and
+        # moves the boundary to the start of any line that begins a new top-level block.
+        while True:
+            end = self.tail.find("\n", self.scanned)
+            if end == -1:
+                # The first few characters of a line are usually enough to know it starts a new block,
+                # without waiting for the rest of a long paragraph's line.
+                start = self.tail[self.scanned:self.scanned + 12]
+                if (self.after_break and self.fence is None and start and start[0] not in " \t\r"
+                        and not LIST_ITEM.match(start) and not LIST_ITEM_PREFIX.fullmatch(start)):
+                    self.boundary = self.scanned
+                return
+            line = self.tail[self.scanned:end]
+            fence = FENCE.match(line)
+            if self.fence is None:
+                if not line.strip():
+                    self.after_break = True
+                else:
+                    if self.after_break and line[0] not in " \t" and not LIST_ITEM.match(line):
+                        self.boundary = self.scanned
+                    self.after_break = False
+                # A backtick fence's info string can't itself contain a backtick.
+                if fence and not (fence.group(1)[0] == "`" and "`" in line[fence.end():]):
+                    self.fence = fence.group(1)
+            elif (fence and fence.group(1)[0] == self.fence[0] and len(fence.group(1)) >= len(self.fence)
+                  and not line[fence.end():].strip()):
+                self.fence = None
+                self.after_break = True
+            self.scanned = end + 1
+
+    def finish(self) -> str:
+        """Renders whatever is left and returns the complete message."""
+        self.refresh()
+        return "".join(self.chunks)
+
+def side_by_side(headings: list, bodies: list):
+    """Returns the bodies laid out in equal columns under their headings, for replies shown next
+    to each other. Bodies that are strings are rendered as markdown."""
+    from rich.markdown import Markdown
+    from rich.table import Table
+
+    grid = Table.grid(expand=True, padding=(0, 2))
+    for _ in headings:
+        grid.add_column(ratio=1, vertical="top")
+    grid.add_row(*headings)
+    grid.add_row(*(Markdown(body) if isinstance(body, str) else body for body in bodies))
+    return grid
@@ -0,0 +1,194 @@
+"""Retrieval mode: answers questions about a directory from its most relevant excerpts.
+
+"Retrieve: <directory>" indexes the directory, with the same ignore rules as a
+directory upload, and from then on each question is sent with the excerpts of
+its files that best match the question, rather than with the whole directory.
+Files are split into chunks of a few dozen lines at blank lines, and the chunks
+are ranked with SQLite's FTS5 BM25, weighting matches in a file's path above
+matches in its text.
+
+The index is kept in the client's directory, next to chat-history/, and is
+brought up to date before each question. Only files whose inode, mtime or size
+have changed are read and chunked again, and files that have gone are dropped,
+so after the first time a directory costs a walk and a stat per file.
+"""
+
+import os
+import sqlite3
+
+from contextlib import closing
+
+from chatcore.ingest import INGEST_WORKERS, IgnoreMatcher, read_text_file, walk_directory
+from chatcore.packing import query_terms
+from chatcore.telemetry import StageTimes
+from chatcore.tokens import Tokenizer
+
+RETRIEVAL_INDEX_FILE = "retrieval-index.sqlite3"
+# Chunks end at the first blank line after this many characters, or regardless at half as many again.
+CHUNK_CHARS = 1500
+RETRIEVAL_RESULTS = 12
+RETRIEVAL_MAX_TOKENS = 8000
+# Changed files are read and indexed this many at a time, so a large first index isn't all held in memory.
+INDEX_BATCH_FILES = 256
+# Bumped whenever the tables change, which rebuilds the index from scratch.
+INDEX_SCHEMA_VERSION = 2
+# BM25 weights of a chunk's file path and its text.
+PATH_WEIGHT = 4.0
+TEXT_WEIGHT = 1.0
+
+def detect_retrieval_request(content: str) -> str | None:
+    """Returns the directory of a "Retrieve: <directory>" command ("off" to stop), or None for any other input."""
+    if content.startswith("Retrieve:"):
+        value = content[len("Retrieve:"):].strip()
+        return value if value.lower() == "off" else os.path.abspath(os.path.expanduser(value))
+    return None
+
+def chunk_text(text: str) -> list[tuple[int, int, str]]:
+    """Splits a file into (first line, last line, text) chunks, preferring to end them at blank lines."""
+    chunks = []
+    lines = text.split("\n")
+    start = 0
+    size = 0
+    for index, line in enumerate(lines):
+        size += len(line) + 1
+        if size >= CHUNK_CHARS and (not line.strip() or size >= CHUNK_CHARS * 1.5):
+            chunks.append((start + 1, index + 1, "\n".join(lines[start:index + 1])))
+            start = index + 1
+            size = 0
+    if start < len(lines) and any(line.strip() for line in lines[start:]):
+        chunks.append((start + 1, len(lines), "\n".join(lines[start:])))
+    # A chunk can only be oversized if it is a single long line, e.g. minified code; only its start is kept.
+    return [(first, last, chunk[:CHUNK_CHARS * 2]) for first, last, chunk in chunks if chunk.strip()]
+
+class RetrievalIndex:
+    """Persistent BM25 index of the chunks of the files in one or more directories.
+
+    Each directory indexed is kept separately, keyed by its root, so the same file in nested
+    directories (say /a and /a/b) is indexed once for each rather than claimed back and forth.
+    A connection is opened per call, as indexing and searching run on worker threads.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with closing(self.connect()) as db:
+            if db.execute("PRAGMA user_version").fetchone()[0] < INDEX_SCHEMA_VERSION:
+                # The index only holds what can be read again from the files, so it is simply rebuilt.
+                for table in ("files", "chunks", "chunks_fts"):
+                    db.execute(f"DROP TABLE IF EXISTS {table}")
+                db.execute(f"PRAGMA user_version = {INDEX_SCHEMA_VERSION}")
+            db.execute("CREATE TABLE IF NOT EXISTS files ("
+                       "root TEXT, path TEXT, relative_path TEXT, inode INTEGER, mtime_ns INTEGER, size INTEGER, "
+                       "PRIMARY KEY (root, path))")
+            db.execute("CREATE TABLE IF NOT EXISTS chunks ("
+                       "id INTEGER PRIMARY KEY, root TEXT, path TEXT, relative_path TEXT, first_line INTEGER, "
+                       "last_line INTEGER)")
+            db.execute("CREATE INDEX IF NOT EXISTS chunks_root_path ON chunks (root, path)")
+            # Raises sqlite3.OperationalError if this SQLite build doesn't have FTS5.
+            db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(relative_path, text)")
+            db.commit()
+
+    def connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=5)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def update(self, root_dir: str, timings: StageTimes | None = None) -> tuple[int, int]:
+        """Brings the index of root_dir up to date, and returns how many files it has and how many changed."""
+        from concurrent.futures import ThreadPoolExecutor  # imports logging, so it's left until first use
+
+        timings = timings if timings is not None else StageTimes()
+        root_dir = os.path.abspath(root_dir)
+        with closing(self.connect()) as db:
+            known = {path: (inode, mtime_ns, size) for path, inode, mtime_ns, size in db.execute(
+                "SELECT path, inode, mtime_ns, size FROM files WHERE root = ?", (root_dir,))}
+            seen = set()
+            changed = []  # (path, relative path, identity)
+            with timings.stage("walk"):
+                for entry in walk_directory(root_dir, IgnoreMatcher(root_dir)):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    path = os.path.abspath(entry.path)
+                    identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+                    seen.add(path)
+                    if known.get(path) != identity:
+                        changed.append((path, os.path.relpath(path, root_dir).replace(os.sep, "/"), identity))
+            removed = [path for path in known if path not in seen]
+            if not changed and not removed:
+                return len(seen), 0
+
+            with timings.stage("index"):
+                for path in removed:
+                    self.remove(db, root_dir, path)
+                db.executemany("DELETE FROM files WHERE root = ? AND path = ?", [(root_dir, path) for path in removed])
+            with ThreadPoolExecutor(max_workers=INGEST_WORKERS) as executor:
+                for start in range(0, len(changed), INDEX_BATCH_FILES):
+                    batch = changed[start:start + INDEX_BATCH_FILES]
+                    with timings.stage("read"):
+                        contents = list(executor.map(read_text_file, [path for path, _, _ in batch]))
+                    with timings.stage("index"):
+                        for (path, relative_path, identity), text in zip(batch, contents):
+                            self.remove(db, root_dir, path)
+                            # Binary and unreadable files are recorded too, with no chunks, so they aren't read again.
+                            db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                                       (root_dir, path, relative_path, *identity))
+                            for first_line, last_line, chunk in chunk_text(text) if text else []:
+                                chunk_id = db.execute(
+                                    "INSERT INTO chunks (root, path, relative_path, first_line, last_line) "
+                                    "VALUES (?, ?, ?, ?, ?)",
+                                    (root_dir, path, relative_path, first_line, last_line)).lastrowid
+                                db.execute("INSERT INTO chunks_fts (rowid, relative_path, text) VALUES (?, ?, ?)",
+                                           (chunk_id, relative_path, chunk))
+            db.commit()
+        return len(seen), len(changed) + len(removed)
+
+    @staticmethod
+    def remove(db: sqlite3.Connection, root_dir: str, path: str):
+        """Removes a file's chunks from the index of root_dir."""
+        ids = [(chunk_id,) for chunk_id, in db.execute("SELECT id FROM chunks WHERE root = ? AND path = ?",
+                                                       (root_dir, path))]
+        db.executemany("DELETE FROM chunks_fts WHERE rowid = ?", ids)
+        db.execute("DELETE FROM chunks WHERE root = ? AND path = ?", (root_dir, path))
+
+    def search(self, root_dir: str, query: str, limit: int = RETRIEVAL_RESULTS) -> list[tuple[str, int, int, str]]:
+        """Returns the (relative path, first line, last line, text) of the chunks in root_dir that best
+        match query, best first."""
+        # Quote every term so that user input is never parsed as FTS5 query syntax.
+        terms = " OR ".join('"' + term.replace('"', '""') + '"' for term in sorted(query_terms(query)))
+        if not terms:
+            return []
+        with closing(self.connect()) as db:
+            return db.execute("SELECT c.relative_path, c.first_line, c.last_line, f.text "
+                              "FROM chunks_fts AS f JOIN chunks AS c ON c.id = f.rowid "
+                              "WHERE chunks_fts MATCH ? AND c.root = ? "
+                              "ORDER BY bm25(chunks_fts, ?, ?) LIMIT ?",
+                              (terms, os.path.abspath(root_dir), PATH_WEIGHT, TEXT_WEIGHT, limit)).fetchall()
+
+def open_retrieval_index(app_dir: str) -> RetrievalIndex | None:
+    """Opens the retrieval index in the client's directory, or returns None if it can't be,
+    e.g. as this SQLite build doesn't support FTS5."""
+    try:
+        return RetrievalIndex(os.path.join(app_dir, RETRIEVAL_INDEX_FILE))
+    except (OSError, sqlite3.Error):
+        return None
+
+def retrieval_prompt(root_dir: str, chunks: list, tokenizer: Tokenizer,
+                     max_tokens: int = RETRIEVAL_MAX_TOKENS) -> tuple[str | None, int, int]:
+    """Returns the user message that sends the best chunks within max_tokens, its token count and how
+    many chunks it has, or None if there are none to send."""
+    sections = []
+    token_count = 0
+    for relative_path, first_line, last_line, text in chunks:
+        enclosure = '"""' if relative_path.endswith(".md") else "```"
+        section = f"## {relative_path} (lines {first_line}-{last_line})\n\n{enclosure}\n{text}\n{enclosure}\n\n"
+        section_tokens = tokenizer.count(section)
+        if token_count + section_tokens > max_tokens:
+            continue
+        sections.append(section)
+        token_count += section_tokens
+    if not sections:
+        return None, 0, 0
+    return (f"The following are the excerpts from the files in {root_dir} that are most relevant to the "
+            f"question that follows, found by searching the directory. Use them to answer it, and say so "
+            f"if they don't contain what is needed.\n\n{''.join(sections)}"), token_count, len(sections)
@@ -0,0 +1,677 @@
+import asyncio
+import os
+import re
+import time
+
+from datetime import datetime
+
+from rich import print
+from rich.live import Live
+from rich.markup import escape
+from rich.rule import Rule
+from rich.spinner import Spinner
+
+from chatcore.backends import BACKENDS, Backend, Usage
+from chatcore.context import ContextWindow
+from chatcore.history import ChatWriter
+from chatcore.ingest import DirectoryUpload, UploadError, detect_file_analysis_request, read_upload
+from chatcore.render import RENDER_REFRESH_PER_SECOND, StreamingMarkdown, console, side_by_side
+from chatcore.retrieval import (RETRIEVAL_MAX_TOKENS, detect_retrieval_request, open_retrieval_index,
+                                retrieval_prompt)
+from chatcore.telemetry import StageTimes, TelemetryLog
+
+# A connection used this recently is assumed to still be open, so isn't pre-opened again.
+PREWARM_INTERVAL_SECONDS = 30
+# How the replies to a prompt sent to several models are shown, chosen with "Layout: <layout>".
+# The first is the default.
+FANOUT_LAYOUTS = {"sequential": "one after another", "columns": "side by side"}
+
+def create_prompt_session(on_typing):
+    """Returns the prompt_toolkit session that user input is read with. on_typing is called
+    whenever the text being typed changes."""
+    from prompt_toolkit import PromptSession
+
+    prompt_session = PromptSession(multiline=True)
+    prompt_session.default_buffer.on_text_changed += lambda buffer: on_typing()
+    return prompt_session
+
+async def get_user_input(prompt_session) -> str:
+    # Display the prompt to the user for multiline input.
+    # The user can press Esc followed by Enter to submit their input.
+    # Anything printed by background work, such as an upload being read, appears above the prompt.
+    from prompt_toolkit import print_formatted_text
+    from prompt_toolkit.formatted_text import HTML
+    from prompt_toolkit.patch_stdout import patch_stdout
+
+    text = HTML('<u><b><style fg="ansiblue">User:</style></b></u>')
+    print_formatted_text(text)
+    with patch_stdout():
+        return await prompt_session.prompt_async()
+
+def detect_model_switch(content: str) -> str | None:
+    """Returns the value of a "Model: <name>" command, or None for any other input."""
+    if content.startswith("Model:"):
+        return content[len("Model:"):].strip().lower()
+    return None
+
+def detect_layout_switch(content: str) -> str | None:
+    """Returns the value of a "Layout: <layout>" command, or None for any other input."""
+    if content.startswith("Layout:"):
+        return content[len("Layout:"):].strip().lower()
+    return None
+
+def parse_model_names(value: str) -> list[str]:
+    """Returns the backend names in a "Model:" command, e.g. "claude, groq". "all" names every backend."""
+    if value == "all":
+        return list(BACKENDS)
+    return list(dict.fromkeys(name for name in re.split(r"[,\s]+", value) if name))
+
+def should_exit(content: str) -> bool:
+    return content.lower() == "exit"
+
+def append_message(messages: list, role: str, content: str):
+    messages.append({"role": role, "content": content})
+
+def welcome_text(backend: Backend) -> str:
+    models = ", ".join(f'"Model: {name}"' for name in BACKENDS)
+    return f"""
+You're now chatting with {backend.welcome_name}.
+The user prompt handles multiline input, so Enter gives a newline.
+To submit your prompt to {backend.short_name} hit Esc -> Enter.
+To exit gracefully simply submit the word: "exit", or hit Ctrl+C.
+
+You can pass individual utf-8 encoded files to {backend.short_name} by entering "Upload: ~/path/to/file_name"
+You can pass entire directories (recursively) to {backend.short_name} by entering "Upload: ~/path/to/directory"
+Uploads are read while you type; they are sent with your next prompt, or on their own if it is empty.
+For a directory too large to upload, enter "Retrieve: ~/path/to/directory" to send each question with only
+the most relevant excerpts of its files instead, and "Retrieve: off" to stop.
+You can switch model at any point in the chat by entering one of {models}
+To compare models, send each prompt to several at once with e.g. "Model: claude, gpt-4o, groq" or "Model: all".
+Their replies are shown one after another, or side by side after "Layout: columns".
+"""
+
+class ReplyStats:
+    """When a reply was asked for, began and finished, and the tokens it used."""
+
+    def __init__(self, backend: Backend, times: StageTimes | None = None):
+        self.backend = backend
+        self.times = times if times is not None else StageTimes()  # e.g. building the request, and rendering
+        self.usage = Usage()
+        self.request_started = time.monotonic()
+        self.first_token_at = None
+        self.finished_at = None
+        self.output_tokens = None
+        self.error = None
+
+    def token_arrived(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.monotonic()
+
+    def finish(self, reply: str, error: Exception | None = None):
+        self.finished_at = time.monotonic()
+        self.error = error
+        # Estimated if the provider didn't report it, e.g. as the stream was cut off.
+        self.output_tokens = (self.usage.output_tokens if self.usage.output_tokens is not None
+                              else self.backend.tokenizer.count(reply))
+
+    @property
+    def time_to_first_token(self) -> float | None:
+        return None if self.first_token_at is None else self.first_token_at - self.request_started
+
+    @property
+    def latency(self) -> float:
+        return self.finished_at - self.request_started
+
+    @property
+    def tokens_per_second(self) -> float | None:
+        if self.first_token_at is None or self.finished_at <= self.first_token_at:
+            return None
+        return self.output_tokens / (self.finished_at - self.first_token_at)
+
+    def summary(self) -> str | None:
+        """Returns a one line summary of the reply's latency and token usage, or None if nothing arrived."""
+        if self.first_token_at is None:
+            return None
+        usage = self.usage
+        tokens_per_second = f"{self.tokens_per_second:,.1f}" if self.tokens_per_second is not None else "n/a"
+        summary = (f"Time to first token: {self.time_to_first_token:.2f}s | "
+                   f"{self.output_tokens:,} tokens at {tokens_per_second} tokens/s")
+        if usage.input_tokens is not None:
+            summary += f" | Input tokens: {usage.input_tokens:,}"
+            if usage.cache_read_tokens is not None or usage.cache_write_tokens is not None:
+                summary += (f" ({usage.cache_read_tokens or 0:,} read from cache, "
+                            f"{usage.cache_write_tokens or 0:,} written to cache)")
+        return summary
+
+    def record(self) -> dict:
+        """Returns the reply's telemetry: its timings, in seconds, and its token usage."""
+        seconds = dict(self.times.seconds)
+        if self.first_token_at is not None:
+            seconds["first_token"] = self.time_to_first_token
+            seconds["stream"] = self.finished_at - self.first_token_at
+        usage = self.usage
+        return {"model": self.backend.name, "seconds": seconds,
+                "tokens_per_second": round(self.tokens_per_second, 1) if self.tokens_per_second is not None else None,
+                "input_tokens": usage.input_tokens, "output_tokens": self.output_tokens,
+                "cache_read_tokens": usage.cache_read_tokens, "cache_write_tokens": usage.cache_write_tokens,
+                "error": str(self.error) if self.error is not None else None}
+
+def comparison_table(stats: list[ReplyStats]):
+    """Returns a table of each model's latency and token usage for one prompt."""
+    from rich.table import Table
+
+    def optional(value, format_spec, suffix=""):
+        return format(value, format_spec) + suffix if value is not None else "-"
+
+    table = Table(header_style="bold", show_edge=False)
+    table.add_column("Model", no_wrap=True)
+    for heading in ("First token", "Total", "Output", "Tokens/s", "Input", "Cached"):
+        table.add_column(heading, justify="right")
+    for reply_stats in stats:
+        usage = reply_stats.usage
+        backend = reply_stats.backend
+        table.add_row(f"[{backend.colour}]{backend.label}[/]" + (" [red](failed)[/]" if reply_stats.error else ""),
+                      optional(reply_stats.time_to_first_token, ".2f", "s"),
+                      f"{reply_stats.latency:.2f}s",
+                      f"{reply_stats.output_tokens:,}",
+                      optional(reply_stats.tokens_per_second, ",.1f"),
+                      optional(usage.input_tokens, ","),
+                      optional(usage.cache_read_tokens, ","))
+    return table
+
+class ChatSession:
+    """One conversation, which can move between backends part way through.
+
+    The history is provider-neutral, so switching backend only changes where the
+    next request goes. Uploads already in the chat are sent on to the new model
+    as they are, rather than being read from disk and rendered again. Backends
+    are kept once used, each with its own ContextWindow as tokenizers and
+    budgets differ, so switching back reuses their clients and token counts.
+
+    A prompt can also be fanned out to several backends at once. Each of their
+    replies is kept, tagged with its model, and each backend goes on to see its
+    own reply to that prompt (or the first, if it wasn't asked) in later turns.
+
+    Work that doesn't need the user's next prompt is overlapped with it: the
+    connection is opened as they type, uploads and the last reply are
+    tokenised on threads, and the history is saved by the ChatWriter's thread.
+    """
+
+    def __init__(self, backend: Backend, app_dir: str, messages: list | None = None,
+                 writer: ChatWriter | None = None):
+        self.app_dir = app_dir
+        self.upload_cache_path = os.path.join(app_dir, 'upload-cache.sqlite3')
+        self.messages = messages if messages is not None else []
+        self.writer = writer
+        self.backends = {}
+        self.context_windows = {}
+        self.fanout = []  # the backends each prompt is sent to, when there is more than one
+        self.layout = "sequential"
+        self.pending_uploads = []  # (task reading an upload, its StageTimes)
+        self.upload_times = StageTimes()  # of the uploads added to the next prompt
+        self.retrieval_index = None
+        self.retrieval_root = None  # the directory questions are sent with excerpts of, after "Retrieve:"
+        self.indexing = None  # task indexing it for the first time
+        self.excerpts = None  # the message of excerpts sent with the next prompt, but not kept in the chat
+        self.telemetry = TelemetryLog(app_dir)
+        self.turn = 0
+        self.background_tasks = set()
+        self.counting = None
+        self.connection_used_at = {}  # backend name: when its connection was last opened or used
+        now = datetime.now()
+        self.local_date = now.strftime("%a %d %b %Y")  # e.g., "Fri 16 Feb 2024"
+        self.local_time = now.strftime("%H:%M:%S %Z")  # e.g., "22:41:47 GMT+0000"
+        self.session_id = now.strftime("%Y%m%d-%H%M%S")
+        self.backends[backend.name] = backend
+        self.backend = self.get_backend(backend.name)
+
+    def get_backend(self, name: str) -> Backend:
+        if name not in self.backends:
+            self.backends[name] = BACKENDS[name]()
+        if name not in self.context_windows:
+            self.context_windows[name] = ContextWindow(self.backends[name].context_budget,
+                                                       self.backends[name].tokenizer)
+        return self.backends[name]
+
+    def active_backends(self) -> list[Backend]:
+        """Returns the backends the next prompt will be sent to."""
+        return self.fanout or [self.backend]
+
+    def switch_backend(self, value: str) -> bool:
+        """Sends the rest of the chat to the backend, or backends, named by a "Model:" command.
+        Returns False if any of them can't be used."""
+        names = parse_model_names(value)
+        unknown = [name for name in names if name not in BACKENDS]
+        if not names or unknown:
+            print(f"Unknown model '{unknown[0] if unknown else value}'. "
+                  f"Choose one or more of: {', '.join(BACKENDS)}, or all")
+            return False
+        backends = [self.get_backend(name) for name in names]
+        for backend in backends:
+            try:
+                # Fails here, rather than after the next prompt, if its SDK or API key is missing.
+                backend.client
+            except Exception as e:
+                console.print(f"[red]Can't switch to {backend.label}: {escape(str(e))}[/]")
+                return False
+        self.backend = backends[0]
+        self.fanout = backends if len(backends) > 1 else []
+        for backend in backends:
+            backend.tokenizer.warm()
+        return True
+
+    def switch_layout(self, layout: str) -> bool:
+        """Changes how the replies to a fanned out prompt are shown. Returns False for an unknown layout."""
+        if layout not in FANOUT_LAYOUTS:
+            print(f"Unknown layout '{layout}'. Choose one of: {', '.join(FANOUT_LAYOUTS)}")
+            return False
+        self.layout = layout
+        return True
+
+    def messages_for(self, name: str) -> list:
+        """Returns the chat as the named backend sees it. Of the replies to a fanned out prompt, it sees
+        only its own, or the first if it wasn't one of the backends asked."""
+        view = []
+        index = 0
+        while index < len(self.messages):
+            end = index + 1
+            if self.messages[index]["role"] == "assistant":
+                while end < len(self.messages) and self.messages[end]["role"] == "assistant":
+                    end += 1
+            replies = self.messages[index:end]
+            view.append(next((message for message in replies if message.get("model") == name), replies[0]))
+            index = end
+        return view
+
+    def run_in_background(self, awaitable) -> asyncio.Task:
+        # Keeps a reference to the task, so that it isn't garbage collected before it finishes. Its
+        # exception is retrieved once it is done, so that asyncio doesn't log one that nothing awaits
+        # in the middle of the chat; anything that does await the task still has it raised.
+        task = asyncio.ensure_future(awaitable)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return task
+
+    def prewarm(self):
+        """Opens a connection to each backend the next prompt goes to in the background, so the request
+        doesn't wait for the TCP and TLS handshakes. Skips those whose connection was used recently."""
+        now = time.monotonic()
+        for backend in self.active_backends():
+            if now - self.connection_used_at.get(backend.name, float("-inf")) < PREWARM_INTERVAL_SECONDS:
+                continue
+            self.connection_used_at[backend.name] = now
+            self.run_in_background(backend.prewarm())
+
+    def count_in_background(self):
+        """Tokenises the messages the next prompt's backends haven't counted yet, such as the last reply
+        or a resumed history, on threads while the user types."""
+        if self.counting is not None and not self.counting.done():
+            return
+        self.counting = self.run_in_background(self.count_new_messages(self.active_backends()))
+
+    async def count_new_messages(self, backends: list[Backend]):
+        await asyncio.gather(*(asyncio.to_thread(self.context_windows[backend.name].count_new_messages,
+                                                 self.messages_for(backend.name))
+                               for backend in backends))
+
+    def start_upload(self, path: str, is_directory: bool):
+        """Reads and tokenises an upload on a thread, so the user can type a question about it meanwhile."""
+        timings = StageTimes()
+        self.pending_uploads.append((self.run_in_background(asyncio.to_thread(self.read_upload, path, is_directory,
+                                                                              timings)), timings))
+
+    async def add_pending_uploads(self, query: str = "") -> int:
+        """Waits for any uploads still being read, adds them to the chat and returns how many were added.
+        A directory over its token limit is packed with the files most relevant to query."""
+        added = 0
+        for task, timings in self.pending_uploads:
+            try:
+                upload = await task
+                # Ranking the files of a large directory reads through all of them, so it is left off the loop.
+                prompt, token_count = await asyncio.to_thread(upload.build_prompt, query) if upload else (None, 0)
+            except Exception as e:
+                console.print(f"[red]The upload failed: {escape(str(e))}[/]")
+                continue
+            self.upload_times.merge(timings, prefix="ingest_")
+            if prompt:
+                if isinstance(upload, DirectoryUpload) and upload.left_out:
+                    console.print(f"\n[dim]Sending the {len(upload.files) - upload.left_out:,} most relevant of "
+                                  f"{len(upload.files):,} files ({token_count:,} tokens), with a list of those "
+                                  f"left out.[/]")
+                append_message(self.messages, "user", prompt)
+                added += 1
+        self.pending_uploads.clear()
+        return added
+
+    def read_upload(self, path: str, is_directory: bool, timings: StageTimes | None = None):
+        """Reads an "Upload:" request, returning a DirectoryUpload or FileUpload, or None if there is nothing to send.
+
+        An upload is read once however many backends it goes to, within the smallest of their limits.
+        """
+        backends = self.active_backends()
+        directory_backend = min(backends, key=lambda backend: backend.directory_token_limit)
+        file_backend = min(backends, key=lambda backend: backend.file_token_limit)
+        tokenizer = (directory_backend if is_directory else file_backend).tokenizer
+        try:
+            upload = read_upload(path, is_directory, directory_backend.directory_token_limit,
+                                 file_backend.file_token_limit, tokenizer, self.upload_cache_path, timings)
+        except UploadError as e:
+            console.print(f"\n[red]{escape(str(e))}[/]\n")
+            return None
+        if not is_directory:
+            print(f"\nEstimated token count for this file: {upload.token_count}\n")
+        elif upload.total_tokens > upload.token_limit or not upload.complete:
+            print(f"\nEstimated token count for this recursive directory analysis: {upload.total_tokens}"
+                  f"{'+' if not upload.complete else ''}\n"
+                  f"That is over the {upload.token_limit:,} token limit, so the files most relevant to your "
+                  f"question will be sent.\n")
+        else:
+            print(f"\nEstimated token count for this recursive directory analysis: {upload.total_tokens}\n")
+        return upload
+
+    def start_retrieval(self, root_dir: str) -> bool:
+        """Indexes a directory in the background, after which each question is sent with its most relevant
+        excerpts. Returns False if the index can't be used."""
+        if self.retrieval_index is None:
+            self.retrieval_index = open_retrieval_index(self.app_dir)
+            if self.retrieval_index is None:
+                print("Retrieval is unavailable because its index couldn't be opened, or this SQLite build "
+                      "doesn't support FTS5.")
+                return False
+        self.retrieval_root = root_dir
+        self.indexing = self.run_in_background(asyncio.to_thread(self.index_directory, root_dir))
+        return True
+
+    def stop_retrieval(self):
+        self.retrieval_root = None
+        self.indexing = None
+
+    def index_directory(self, root_dir: str):
+        started = time.monotonic()
+        files, changed = self.retrieval_index.update(root_dir)
+        if changed:
+            print(f"\nIndexed {files:,} files in {root_dir} ({changed:,} new, changed or removed) "
+                  f"in {time.monotonic() - started:.1f}s\n")
+
+    async def add_retrieved_excerpts(self, query: str) -> int:
+        """Finds the excerpts of the retrieval directory most relevant to query, after bringing its index
+        up to date, to send with the next prompt, and returns how many there are.
+
+        The excerpts are only sent with this turn's request. They aren't added to the chat, so that later
+        turns aren't weighed down with the excerpts for every earlier question.
+        """
+        if self.retrieval_root is None or not query.strip():
+            return 0
+        root_dir = self.retrieval_root
+        backends = self.active_backends()
+        backend = min(backends, key=lambda backend: backend.directory_token_limit)
+        started = time.monotonic()
+        try:
+            if self.indexing is not None:
+                # Indexed since the "Retrieve:" command, so already up to date.
+                indexing, self.indexing = self.indexing, None
+                await indexing
+            else:
+                await asyncio.to_thread(self.index_directory, root_dir)
+            chunks = await asyncio.to_thread(self.retrieval_index.search, root_dir, query)
+            prompt, token_count, excerpts = await asyncio.to_thread(
+                retrieval_prompt, root_dir, chunks, backend.tokenizer,
+                min(RETRIEVAL_MAX_TOKENS, backend.directory_token_limit))
+        except Exception as e:
+            console.print(f"[red]Searching {escape(root_dir)} failed: {escape(str(e))}[/]")
+            return 0
+        self.upload_times.add("retrieve", time.monotonic() - started)
+        if prompt is None:
+            console.print(f"\n[dim]Nothing in {escape(root_dir)} matches the question, so it is sent on its own.[/]")
+            return 0
+        console.print(f"\n[dim]Sending {excerpts} excerpts ({token_count:,} tokens) from {escape(root_dir)}.[/]")
+        self.excerpts = {"role": "user", "content": prompt}
+        return excerpts
+
+    def rollback(self, length: int):
+        """Removes the messages from index length on, e.g. a prompt whose request failed."""
+        del self.messages[length:]
+        for name, context_window in self.context_windows.items():
+            context_window.truncate(len(self.messages_for(name)))
+
+    def select_context(self, backend: Backend) -> list:
+        """Returns the messages to send to the backend, within its context budget."""
+        context_window = self.context_windows[backend.name]
+        request_messages, context_tokens, trimmed = context_window.select(self.messages_for(backend.name))
+        if trimmed:
+            console.print(f"\n[dim]Left {trimmed} older messages out of the request to {backend.short_name} to "
+                          f"keep it within {context_window.budget:,} tokens ({context_tokens:,} tokens sent).[/]")
+        return request_messages
+
+    async def stream_into(self, queue: asyncio.Queue, backend: Backend, request: dict, stats: ReplyStats) -> str:
+        """Streams the backend's reply into the queue, followed by None, and returns it. An error is
+        kept in stats rather than raised, so that it doesn't stop the other backends' replies."""
+        chunks = []
+        error = None
+        try:
+            async for delta in backend.stream_reply(request, stats.usage):
+                stats.token_arrived()
+                chunks.append(delta)
+                queue.put_nowait(delta)
+        except Exception as e:
+            error = e
+        finally:
+            reply = "".join(chunks)
+            stats.finish(reply, error)
+            self.connection_used_at[backend.name] = stats.finished_at
+            queue.put_nowait(None)
+        return reply
+
+    async def show_in_turn(self, queues: list, stats: list[ReplyStats]):
+        """Shows the replies one after another. Those after the first keep streaming meanwhile, and
+        whatever they've sent by their turn is shown at once."""
+        for queue, reply_stats in zip(queues, stats):
+            backend = reply_stats.backend
+            console.print(f"\n[{backend.colour} underline]{backend.label}:[/]")
+            # The spinner is animated by Live's own refresh until the first token replaces it.
+            with Live(Spinner("dots", text=f"Waiting for {backend.short_name}..."),
+                refresh_per_second=RENDER_REFRESH_PER_SECOND,
+                console=console,
+                transient=False,
+            ) as live:
+                renderer = StreamingMarkdown(live)
+                while (delta := await queue.get()) is not None:
+                    renderer.feed(delta)
+                if not renderer.finish():
+                    live.update("")
+            reply_stats.times.add("render", renderer.render_seconds)
+            if reply_stats.error is not None and len(stats) > 1:
+                console.print(f"[red]The request to {backend.label} failed: {escape(str(reply_stats.error))}[/]")
+
+    async def show_side_by_side(self, queues: list, stats: list[ReplyStats]):
+        """Shows the replies next to each other, each in its own column, as they stream."""
+        from rich.text import Text
+
+        replies = [[] for _ in queues]
+        streaming = set(range(len(queues)))
+        headings = [Text.from_markup(f"[{reply_stats.backend.colour} underline]{reply_stats.backend.label}:[/]")
+                    for reply_stats in stats]
+
+        def columns():
+            bodies = []
+            for index, reply_stats in enumerate(stats):
+                if reply_stats.error is not None:
+                    bodies.append(Text(f"The request failed: {reply_stats.error}", style="red"))
+                elif replies[index] or index not in streaming:
+                    bodies.append("".join(replies[index]))
+                else:
+                    bodies.append(Spinner("dots", text=f"Waiting for {reply_stats.backend.short_name}..."))
+            return side_by_side(headings, bodies)
+
+        # Each column is re-rendered whole, so the display is only updated at the refresh rate. It is
+        # cropped to the terminal while streaming, then printed in full once every reply has finished.
+        render_times = StageTimes()
+        console.print()
+        with Live(columns(), refresh_per_second=RENDER_REFRESH_PER_SECOND, console=console, transient=True,
+                  vertical_overflow="crop") as live:
+            while streaming:
+                await asyncio.sleep(1 / RENDER_REFRESH_PER_SECOND)
+                for index in list(streaming):
+                    while not queues[index].empty():
+                        delta = queues[index].get_nowait()
+                        if delta is None:
+                            streaming.discard(index)
+                            break
+                        replies[index].append(delta)
+                with render_times.stage("render"):
+                    live.update(columns(), refresh=True)
+        with render_times.stage("render"):
+            console.print(columns())
+        # The columns are rendered together, so each reply is charged the time of the whole display.
+        for reply_stats in stats:
+            reply_stats.times.merge(render_times)
+
+    async def send(self) -> list[str]:
+        """Streams the replies of each backend the prompt goes to, concurrently, adds them to the chat
+        and saves it in the background. Returns the replies, or raises if none of them succeeded."""
+        send_started = time.monotonic()
+        backends = self.active_backends()
+        upload_times, self.upload_times = self.upload_times, StageTimes()
+        excerpts, self.excerpts = self.excerpts, None
+        if self.counting is not None:
+            # Any error is raised again by select, which counts whatever this didn't.
+            await asyncio.gather(self.counting, return_exceptions=True)
+        requests = []
+        stats = []
+        for backend in backends:
+            times = StageTimes()
+            with times.stage("context"):
+                request_messages = self.select_context(backend)
+                if excerpts is not None:
+                    # Just before the question they were retrieved for, which is always the last message.
+                    request_messages.insert(len(request_messages) - 1, excerpts)
+            with times.stage("build"):
+                requests.append(backend.build_request(request_messages,
+                                                      backend.system_prompt(self.local_date, self.local_time)))
+            stats.append(ReplyStats(backend, times))
+
+        queues = [asyncio.Queue() for _ in backends]
+        streams = [asyncio.ensure_future(self.stream_into(queue, backend, request, reply_stats))
+                   for queue, backend, request, reply_stats in zip(queues, backends, requests, stats)]
+        try:
+            if len(backends) > 1 and self.layout == "columns":
+                await self.show_side_by_side(queues, stats)
+            else:
+                await self.show_in_turn(queues, stats)
+            replies = await asyncio.gather(*streams)
+        finally:
+            for stream in streams:
+                stream.cancel()
+
+        self.turn += 1
+        records = []
+        for reply_stats in stats:
+            reply_stats.times.merge(upload_times)
+            reply_stats.times.add("total", reply_stats.finished_at - send_started)
+            records.append({"session": self.session_id, "turn": self.turn, "mode": "chat",
+                            "models": len(stats), **reply_stats.record()})
+
+        failed = [reply_stats.error for reply_stats in stats if reply_stats.error is not None]
+        if len(failed) == len(stats):
+            self.record_turn(records)
+            raise failed[0] if len(stats) == 1 else RuntimeError("none of the models replied")
+        for reply, reply_stats in zip(replies, stats):
+            if reply_stats.error is None:
+                self.messages.append({"role": "assistant", "content": reply, "model": reply_stats.backend.name})
+
+        if len(stats) > 1:
+            console.print()
+            console.print(comparison_table(stats))
+        elif summary := stats[0].summary():
+            console.print(f"\n[dim]{summary}[/]")
+        print(f"\n")
+        print(Rule(), "")
+
+        if self.writer is not None:
+            save_submitted = time.perf_counter()
+            save = self.writer.save_in_background(self.messages)
+            save.add_done_callback(report_save_error)
+            save.add_done_callback(lambda save: self.record_turn(records, time.perf_counter() - save_submitted))
+        else:
+            self.record_turn(records)
+        return [reply for reply, reply_stats in zip(replies, stats) if reply_stats.error is None]
+
+    def record_turn(self, records: list, save_seconds: float | None = None):
+        # Called on the ChatWriter's thread once the turn has been saved, so that the save can be timed.
+        for record in records:
+            if save_seconds is not None:
+                record["seconds"]["save"] = save_seconds
+            self.telemetry.record(record)
+
+def report_save_error(save):
+    if save.exception() is not None:
+        console.print(f"[red]The chat couldn't be saved: {escape(str(save.exception()))}[/]")
+
+async def run_chat(session: ChatSession):
+    """Reads the user's prompts and sends them until they exit."""
+    prompt_session = create_prompt_session(on_typing=session.prewarm)
+    try:
+        while True:
+            session.prewarm()
+            session.count_in_background()
+            content = await get_user_input(prompt_session)
+
+            if should_exit(content):
+                break
+
+            model_value = detect_model_switch(content)
+            if model_value is not None:
+                if session.switch_backend(model_value):
+                    if session.fanout:
+                        labels = ", ".join(backend.label for backend in session.fanout)
+                        console.print(f"\n[bold blue]Each prompt now goes to {labels}.[/]\n")
+                    else:
+                        console.print(f"\n[bold blue]You're now chatting with {session.backend.welcome_name}.[/]\n")
+                continue
+
+            layout = detect_layout_switch(content)
+            if layout is not None:
+                if session.switch_layout(layout):
+                    console.print(f"\n[bold blue]Replies from several models are now shown "
+                                  f"{FANOUT_LAYOUTS[layout]}.[/]\n")
+                continue
+
+            retrieval_root = detect_retrieval_request(content)
+            if retrieval_root is not None:
+                if retrieval_root == "off":
+                    session.stop_retrieval()
+                    console.print("\n[bold blue]Questions are now sent without excerpts.[/]\n")
+                elif not os.path.isdir(retrieval_root):
+                    console.print(f"\n[red]{escape(retrieval_root)} is not a directory.[/]\n")
+                elif session.start_retrieval(retrieval_root):
+                    console.print(f"\n[bold blue]Each question is now sent with the most relevant excerpts "
+                                  f"from {escape(retrieval_root)}.[/] [dim]It is being indexed in the background; "
+                                  f"\"Retrieve: off\" stops.[/]\n")
+                continue
+
+            is_file_request, path, is_directory = detect_file_analysis_request(content)
+            if is_file_request:
+                session.start_upload(path, is_directory)
+                console.print("\n[dim]Reading the upload in the background. Type a question to send with it, "
+                              "or submit an empty prompt to send it on its own.[/]\n")
+                continue
+
+            turn_start = len(session.messages)
+            uploads = await session.add_pending_uploads(content)
+            await session.add_retrieved_excerpts(content)
+            if content.strip():
+                append_message(session.messages, "user", content)
+            elif not uploads:
+                continue
+
+            try:
+                await session.send()
+            except Exception as e:
+                # Leave the failed prompt out of the chat, so every prompt in the history has a reply.
+                session.rollback(turn_start)
+                labels = ", ".join(backend.label for backend in session.active_backends())
+                console.print(f"\n[red]The request to {labels} failed: {escape(str(e))}[/]\n")
+    finally:
+        if session.writer is not None:
+            session.writer.flush()
@@ -0,0 +1,151 @@
+import json
+import math
+import os
+import time
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# Timings and token usage of every reply are appended to this file in the client's directory,
+# next to chat-history/, one JSON object per line.
+TELEMETRY_FILE = "telemetry.jsonl"
+TELEMETRY_ENABLED = True
+PERCENTILES = (50, 90, 99)
+# The stages of a turn, in the order they happen, as keys of a record's "seconds".
+STAGES = {
+    "ingest_walk": "Upload: walk",
+    "ingest_read": "Upload: read",
+    "ingest_tokenize": "Upload: tokenise",
+    "retrieve": "Retrieval",
+    "context": "Context selection",
+    "build": "Request build",
+    "first_token": "Time to first token",
+    "stream": "Stream",
+    "render": "Render",
+    "save": "Save",
+    "total": "Total",
+}
+
+class StageTimes:
+    """Seconds spent in each named stage of a piece of work, added up over each time it is entered."""
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name: str, seconds: float):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def merge(self, other: "StageTimes", prefix: str = ""):
+        for name, seconds in other.seconds.items():
+            self.add(prefix + name, seconds)
+
+class TelemetryLog:
+    """Appends a record of each reply's timings and token usage to the telemetry file.
+
+    Each record is written with a single append, so that clients running at the
+    same time don't interleave their lines, and a failure to write one is ignored
+    rather than interrupting the chat.
+    """
+
+    def __init__(self, app_dir: str):
+        self.path = os.path.join(app_dir, TELEMETRY_FILE)
+
+    def record(self, entry: dict):
+        if not TELEMETRY_ENABLED:
+            return
+        entry = {"time": datetime.now().isoformat(timespec="seconds"), **entry}
+        entry["seconds"] = {name: round(seconds, 6) for name, seconds in entry.get("seconds", {}).items()}
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except OSError:
+            pass
+
+def load_records(path: str, model: str | None = None, days: float | None = None) -> list[dict]:
+    """Returns the records in a telemetry file, optionally only those for a model or from the last few days."""
+    since = (datetime.now() - timedelta(days=days)).isoformat(timespec="seconds") if days is not None else ""
+    records = []
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # e.g. a line torn by a crash part way through writing it
+                if (model is None or record.get("model") == model) and record.get("time", "") >= since:
+                    records.append(record)
+    except FileNotFoundError:
+        pass
+    return records
+
+def percentile(sorted_values: list, percent: float):
+    """Returns the nearest-rank percentile of a sorted, non-empty list."""
+    return sorted_values[max(math.ceil(percent / 100 * len(sorted_values)) - 1, 0)]
+
+def summarise(records: list[dict]) -> dict:
+    """Returns {model: [(label, unit, sorted values)]} for each stage, rate and token count recorded."""
+    by_model = {}
+    for record in records:
+        by_model.setdefault(record.get("model", "?"), []).append(record)
+    summary = {}
+    for model, model_records in sorted(by_model.items()):
+        rows = []
+        for name, label in STAGES.items():
+            values = sorted(record["seconds"][name] for record in model_records
+                            if record.get("seconds", {}).get(name) is not None)
+            if values:
+                rows.append((label, "ms", [value * 1000 for value in values]))
+        for name, label, unit in (("tokens_per_second", "Output rate", "tokens/s"),
+                                  ("input_tokens", "Input tokens", "tokens"),
+                                  ("cache_read_tokens", "Input tokens read from cache", "tokens"),
+                                  ("output_tokens", "Output tokens", "tokens")):
+            values = sorted(record[name] for record in model_records if record.get(name) is not None)
+            if values:
+                rows.append((label, unit, values))
+        summary[model] = rows
+    return summary
+
+def main(app_dir_name: str, argv: list[str]) -> int:
+    """Prints percentiles of the recorded timings and token usage, across every session, per model."""
+    import argparse
+    import sys
+
+    from rich.table import Table
+
+    from chatcore.render import console
+
+    parser = argparse.ArgumentParser(prog=f"{os.path.basename(sys.argv[0])} --metrics",
+                                     description="Summarise the timings and token usage recorded for each reply.")
+    parser.add_argument("--model", help="only summarise this model's replies")
+    parser.add_argument("--days", type=float, help="only summarise the replies of the last DAYS days")
+    args = parser.parse_args(argv)
+
+    path = os.path.join(os.path.expanduser("~"), app_dir_name, TELEMETRY_FILE)
+    records = load_records(path, args.model, args.days)
+    if not records:
+        print(f"No replies recorded in {path}")
+        return 1
+    sessions = len({record.get("session") for record in records})
+    failed = sum(1 for record in records if record.get("error"))
+    print(f"{len(records):,} replies over {sessions:,} sessions ({failed:,} failed), from {path}")
+    for model, rows in summarise(records).items():
+        table = Table(title=model, title_justify="left", header_style="bold", show_edge=False)
+        table.add_column("", no_wrap=True)
+        for heading in ("Count", *(f"p{percent}" for percent in PERCENTILES), "Max", "Unit"):
+            table.add_column(heading, justify="right" if heading != "Unit" else "left")
+        for label, unit, values in rows:
+            number_format = ",.1f" if unit != "tokens" else ",.0f"
+            table.add_row(label, f"{len(values):,}",
+                          *(format(percentile(values, percent), number_format) for percent in PERCENTILES),
+                          format(values[-1], number_format), unit)
+        console.print()
+        console.print(table)
+    return 0
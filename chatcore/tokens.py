@@ -0,0 +1,73 @@
+import math
+import threading
+
+TOKENIZER_THREADS = 8
+TOKENIZER_BATCH_SIZE = 64
+
+# Encodings are expensive to load, so each one is loaded once per process and shared.
+_encodings = {}
+_encodings_lock = threading.Lock()
+
+class Tokenizer:
+    """Estimates token counts for one family of models.
+
+    If model is given the encoding tiktoken maps it to is used, falling back to
+    encoding_name for models tiktoken doesn't know. Counts are multiplied by
+    ratio, for models whose own tokenizer isn't available through tiktoken.
+    """
+
+    def __init__(self, encoding_name: str, ratio: float = 1.0, model: str | None = None):
+        self.encoding_name = encoding_name
+        self.ratio = ratio
+        self.model = model
+
+    def get_encoding(self):
+        """Returns the tokenizer encoding, loading it only once per process."""
+        key = (self.model, self.encoding_name)
+        encoding = _encodings.get(key)
+        if encoding is None:
+            with _encodings_lock:
+                encoding = _encodings.get(key)
+                if encoding is None:
+                    # Imported here, as tiktoken takes longer to import than the rest of startup.
+                    import tiktoken
+                    try:
+                        encoding = tiktoken.encoding_for_model(self.model) if self.model else None
+                    except KeyError:
+                        encoding = None
+                    if encoding is None:
+                        encoding = tiktoken.get_encoding(self.encoding_name)
+                    _encodings[key] = encoding
+        return encoding
+
+    @property
+    def id(self) -> str:
+        """Identifies the counts this tokenizer produces, e.g. for caching them."""
+        name = self.get_encoding().name
+        return name if self.ratio == 1.0 else f"{name}*{self.ratio}"
+
+    def warm(self) -> threading.Thread:
+        """Loads the encoding on a background thread so the first upload doesn't wait for it."""
+        def load():
+            try:
+                self.get_encoding()
+            except Exception:
+                pass  # Any failure is raised again, in the foreground, on first use.
+
+        thread = threading.Thread(target=load, daemon=True)
+        thread.start()
+        return thread
+
+    def scale(self, num_tokens: int) -> int:
+        return num_tokens if self.ratio == 1.0 else math.ceil(num_tokens * self.ratio)
+
+    def count(self, content: str) -> int:
+        """Returns the number of tokens as an int."""
+        return self.scale(len(self.get_encoding().encode_ordinary(content)))
+
+    def count_batch(self, contents: list[str]) -> list[int]:
+        """Returns the token count of each string, encoding them in parallel in one call."""
+        if not contents:
+            return []
+        encoded = self.get_encoding().encode_ordinary_batch(contents, num_threads=TOKENIZER_THREADS)
+        return [self.scale(len(tokens)) for tokens in encoded]
@@ -1,37 +1,39 @@
 #!/usr/bin/env python3
 
+import argparse
 import os
-import shutil
+import sys
+import time
+
 from halo import Halo
 
+from readme_index import open_index
+
+parser = argparse.ArgumentParser(description="Find the READMEs under a directory and add them to the local index.")
+parser.add_argument("root_dir", nargs="?", help="directory to search (asked for if not given)")
+parser.add_argument("--index", help="index file to use (default: ~/.docshunter/readme-index.sqlite3)")
+args = parser.parse_args()
+
 # Get the root directory from user input
-root_dir = input("Enter the root directory path: ")
+root_dir = args.root_dir or input("Enter the root directory path: ")
+root_dir = os.path.abspath(os.path.expanduser(root_dir.strip()))
+if not os.path.isdir(root_dir):
+    sys.exit(f"{root_dir} is not a directory.")
 
-# Create the "found-documents" directory if it doesn't exist
-output_dir = "found-documents"
-os.makedirs(output_dir, exist_ok=True)
+index = open_index(args.index)
 
 # Create and start the spinner
-spinner = Halo(text='Searching for README.md files...', spinner='dots')
+spinner = Halo(text='Searching for README files...', spinner='dots')
 spinner.start()
 
-# Walk through the directory tree and find README.md files
-for dirpath, dirnames, filenames in os.walk(root_dir):
-    for filename in filenames:
-        if filename == "README.md":
-            # Construct the source file path
-            src_path = os.path.join(dirpath, filename)
-            
-            # Construct the destination file path
-            relative_path = os.path.relpath(dirpath, root_dir)
-            dest_name = relative_path.replace("/", "_") + "_" + filename
-            dest_path = os.path.join(output_dir, dest_name)
-            
-            # Copy the file to the destination
-            shutil.copy2(src_path, dest_path)
-            spinner.text = f"Copied {src_path} to {dest_path}"
+def on_readme(path):
+    spinner.text = f"Indexing {os.path.relpath(path, root_dir)}"
+
+# Only READMEs that are new or have changed since the last run are read and indexed again
+start_time = time.monotonic()
+readme_count, changed = index.update(root_dir, on_readme)
 
 # Stop the spinner and print completion message
 spinner.stop()
-print("Done copying README.md files.")
-
+print(f"Found {readme_count:,} README file{'s' if readme_count != 1 else ''} in {root_dir}, "
+      f"{changed:,} new, changed or removed, in {time.monotonic() - start_time:.2f}s.")
@@ -0,0 +1,198 @@
+"""A local, searchable index of the READMEs found under one or more directories.
+
+get-docs.py harvests READMEs into the index and search-docs.py answers questions
+from it. Each README is split into its markdown sections, and oversized sections
+further at blank lines, and the sections are ranked with SQLite's FTS5 BM25,
+weighting matches in a section's headings and the README's path above matches
+in its text. Searching needs no network and takes milliseconds, and only the
+best passages are sent to a model.
+
+Harvesting a directory again only reads the READMEs whose inode, mtime or size
+have changed since, and drops those that have gone.
+"""
+
+import os
+import re
+import sqlite3
+import sys
+
+from contextlib import closing
+
+# docshunter shares the chat engine's chunking and query parsing, from chatcore/ at the root of the repository.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from chatcore.packing import query_terms
+from chatcore.retrieval import CHUNK_CHARS, chunk_text
+
+DOCSHUNTER_DIR = os.path.expanduser("~/.docshunter")
+INDEX_FILE = "readme-index.sqlite3"
+README_NAMES = {"readme.md", "readme.markdown", "readme.txt", "readme"}
+# Directories that hold copies of other repositories or nothing worth documenting, never walked into.
+SKIPPED_DIRECTORIES = {".git", ".hg", ".svn", ".terraform", ".venv", "venv", "node_modules", "__pycache__"}
+SEARCH_RESULTS = 8
+# Bumped whenever the tables change, which rebuilds the index from scratch.
+INDEX_SCHEMA_VERSION = 2
+HEADING = re.compile(r"(#{1,6})\s+(.*?)\s*#*\s*$")
+FENCE = re.compile(r"\s*(```|~~~)")
+# BM25 weights of a section's README path, headings and text.
+PATH_WEIGHT = 2.0
+HEADING_WEIGHT = 4.0
+TEXT_WEIGHT = 1.0
+
+def find_readmes(root_dir: str):
+    """Yields the path of every README under root_dir, top-down."""
+    for dir_path, dir_names, file_names in os.walk(root_dir):
+        dir_names[:] = sorted(name for name in dir_names if name not in SKIPPED_DIRECTORIES)
+        for file_name in sorted(file_names):
+            if file_name.lower() in README_NAMES:
+                yield os.path.join(dir_path, file_name)
+
+def read_readme(path: str) -> str | None:
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return f.read()
+    except OSError:
+        return None
+
+def split_sections(text: str) -> list[tuple[str, int, int, str]]:
+    """Splits a README into (headings, first line, last line, text) sections at its markdown headings.
+
+    headings is the trail of headings the section is under, e.g. "my-module > Inputs", so that a
+    section can be found by what it is about as well as by what it says. Headings inside code
+    blocks are ignored, and sections longer than CHUNK_CHARS are split further at blank lines.
+    """
+    lines = text.split("\n")
+    trail = []  # (level, title) of the headings the current section is under
+    starts = [(0, "")]  # (line index, headings) where each section starts
+    in_fence = False
+    for index, line in enumerate(lines):
+        if FENCE.match(line):
+            in_fence = not in_fence
+            continue
+        match = None if in_fence else HEADING.match(line)
+        if match:
+            level = len(match.group(1))
+            trail = [(depth, title) for depth, title in trail if depth < level] + [(level, match.group(2))]
+            starts.append((index, " > ".join(title for _, title in trail)))
+
+    sections = []
+    ends = [start for start, _ in starts[1:]] + [len(lines)]
+    for (start, headings), end in zip(starts, ends):
+        body = "\n".join(lines[start:end])
+        if not body.strip():
+            continue
+        if len(body) <= CHUNK_CHARS * 1.5:
+            sections.append((headings, start + 1, end, body.strip("\n")))
+            continue
+        for first_line, last_line, chunk in chunk_text(body):
+            sections.append((headings, start + first_line, start + last_line, chunk.strip("\n")))
+    return sections
+
+class ReadmeIndex:
+    """Persistent BM25 index of the sections of the READMEs found under one or more directories.
+
+    Each directory harvested is kept separately, keyed by its root, so a README under nested
+    directories (say /a and /a/b) is indexed once for each rather than claimed back and forth.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with closing(self.connect()) as db:
+            if db.execute("PRAGMA user_version").fetchone()[0] < INDEX_SCHEMA_VERSION:
+                # The index only holds what can be read again from the READMEs, so it is simply rebuilt.
+                for table in ("readmes", "sections", "sections_fts"):
+                    db.execute(f"DROP TABLE IF EXISTS {table}")
+                db.execute(f"PRAGMA user_version = {INDEX_SCHEMA_VERSION}")
+            db.execute("CREATE TABLE IF NOT EXISTS readmes ("
+                       "root TEXT, path TEXT, relative_path TEXT, inode INTEGER, mtime_ns INTEGER, size INTEGER, "
+                       "PRIMARY KEY (root, path))")
+            db.execute("CREATE TABLE IF NOT EXISTS sections ("
+                       "id INTEGER PRIMARY KEY, root TEXT, path TEXT, first_line INTEGER, last_line INTEGER)")
+            db.execute("CREATE INDEX IF NOT EXISTS sections_root_path ON sections (root, path)")
+            # Raises sqlite3.OperationalError if this SQLite build doesn't have FTS5.
+            db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS sections_fts USING fts5(relative_path, headings, text)")
+            db.commit()
+
+    def connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=5)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def update(self, root_dir: str, on_readme=None) -> tuple[int, int]:
+        """Brings the index of the READMEs under root_dir up to date, and returns how many there are and how
+        many changed. on_readme, if given, is called with the path of each README that is read."""
+        root_dir = os.path.abspath(root_dir)
+        with closing(self.connect()) as db:
+            known = {path: (inode, mtime_ns, size) for path, inode, mtime_ns, size in db.execute(
+                "SELECT path, inode, mtime_ns, size FROM readmes WHERE root = ?", (root_dir,))}
+            seen = set()
+            changed = 0
+            for path in find_readmes(root_dir):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+                seen.add(path)
+                if known.get(path) == identity:
+                    continue
+                text = read_readme(path)
+                if text is None:
+                    seen.discard(path)
+                    continue
+                if on_readme is not None:
+                    on_readme(path)
+                self.remove(db, root_dir, path)
+                relative_path = os.path.relpath(path, root_dir).replace(os.sep, "/")
+                db.execute("INSERT INTO readmes VALUES (?, ?, ?, ?, ?, ?)", (root_dir, path, relative_path, *identity))
+                for headings, first_line, last_line, section in split_sections(text):
+                    section_id = db.execute("INSERT INTO sections (root, path, first_line, last_line) "
+                                            "VALUES (?, ?, ?, ?)", (root_dir, path, first_line, last_line)).lastrowid
+                    db.execute("INSERT INTO sections_fts (rowid, relative_path, headings, text) VALUES (?, ?, ?, ?)",
+                               (section_id, relative_path, headings, section))
+                changed += 1
+            removed = [path for path in known if path not in seen]
+            for path in removed:
+                self.remove(db, root_dir, path)
+            db.commit()
+        return len(seen), changed + len(removed)
+
+    @staticmethod
+    def remove(db: sqlite3.Connection, root_dir: str, path: str):
+        ids = [(section_id,) for section_id, in db.execute("SELECT id FROM sections WHERE root = ? AND path = ?",
+                                                           (root_dir, path))]
+        db.executemany("DELETE FROM sections_fts WHERE rowid = ?", ids)
+        db.execute("DELETE FROM sections WHERE root = ? AND path = ?", (root_dir, path))
+        db.execute("DELETE FROM readmes WHERE root = ? AND path = ?", (root_dir, path))
+
+    def search(self, query: str, limit: int = SEARCH_RESULTS) -> list[tuple[str, str, int, int, str]]:
+        """Returns the (README path, headings, first line, last line, text) of the sections that best match
+        query, best first."""
+        # Quote every term so that user input is never parsed as FTS5 query syntax.
+        terms = " OR ".join('"' + term.replace('"', '""') + '"' for term in sorted(query_terms(query)))
+        if not terms:
+            return []
+        with closing(self.connect()) as db:
+            rows = db.execute("SELECT s.path, f.headings, s.first_line, s.last_line, f.text "
+                              "FROM sections_fts AS f JOIN sections AS s ON s.id = f.rowid "
+                              "WHERE sections_fts MATCH ? "
+                              "ORDER BY bm25(sections_fts, ?, ?, ?) LIMIT ?",
+                              (terms, PATH_WEIGHT, HEADING_WEIGHT, TEXT_WEIGHT, limit * 4)).fetchall()
+        # A README under nested roots is indexed once for each, so only its best match is kept.
+        results = {}
+        for row in rows:
+            results.setdefault((row[0], row[2]), row)
+        return list(results.values())[:limit]
+
+    def counts(self) -> tuple[int, int]:
+        """Returns how many READMEs and sections are indexed."""
+        with closing(self.connect()) as db:
+            return (db.execute("SELECT COUNT(DISTINCT path) FROM readmes").fetchone()[0],
+                    db.execute("SELECT COUNT(*) FROM (SELECT DISTINCT path, first_line FROM sections)").fetchone()[0])
+
+def open_index(path: str | None = None) -> ReadmeIndex:
+    """Opens the index at path, or the default one in ~/.docshunter/."""
+    if path is None:
+        os.makedirs(DOCSHUNTER_DIR, exist_ok=True)
+        path = os.path.join(DOCSHUNTER_DIR, INDEX_FILE)
+    return ReadmeIndex(path)
@@ -1,26 +1,71 @@
-from openai import OpenAI
-client = OpenAI()
- 
-assistant = client.beta.assistants.create(
-  name="Code Documentation Assistant",
-  instructions="You are an expert Developer specialised in deploying Infrastucture as Code (IaC) with Terraform and Python. You work for a team that uses various Terraform product repositories to deploy and manage assets in AWS across multiple AWS accounts. Your knowledge base includes the README file of every Terraform product and module that the team uses to manage the AWS infra. Use your knowledge base to answer questions about the documentation and the Terraform products that they pertain to.",
-  model="gpt-4-turbo",
-  tools=[{"type": "file_search"}],
-)
-
-# Create a vector store caled "Financial Statements"
-vector_store = client.beta.vector_stores.create(name="Public Cloud READMEs")
-
-# Ready the files for upload to OpenAI
-file_paths = ["found-documents/goog-10k.pdf", "found-documents/brka-10k.txt"]
-file_streams = [open(path, "rb") for path in file_paths]
-
-# Use the upload and poll SDK helper to upload the files, add them to the vector store,
-# and poll the status of the file batch for completion.
-file_batch = client.beta.vector_stores.file_batches.upload_and_poll(
-  vector_store_id=vector_store.id, files=file_streams
-)
-
-# You can print the status and the file counts of the batch to see the result of this operation.
-print(file_batch.status)
-print(file_batch.file_counts)
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import sys
+import time
+
+from readme_index import SEARCH_RESULTS, open_index
+
+INSTRUCTIONS = "You are an expert Developer specialised in deploying Infrastucture as Code (IaC) with Terraform and Python. You work for a team that uses various Terraform product repositories to deploy and manage assets in AWS across multiple AWS accounts. You are given the sections of the team's Terraform product and module READMEs that are most relevant to each question. Use them to answer questions about the documentation and the Terraform products that they pertain to, and say so if they don't contain what is needed."
+PASSAGE_MAX_TOKENS = 8000
+
+def passages_prompt(question, results, tokenizer, max_tokens=PASSAGE_MAX_TOKENS):
+    # Returns the question with as many of the best passages as fit in max_tokens, and how many that is.
+    sections = []
+    token_count = 0
+    for path, headings, first_line, last_line, text in results:
+        title = f"{path} - {headings}" if headings else path
+        section = f"## {title} (lines {first_line}-{last_line})\n\n\"\"\"\n{text}\n\"\"\"\n\n"
+        section_tokens = tokenizer.count(section)
+        if token_count + section_tokens > max_tokens:
+            continue
+        sections.append(section)
+        token_count += section_tokens
+    return (f"The following are the README sections most relevant to my question.\n\n{''.join(sections)}"
+            f"Question: {question}"), len(sections)
+
+async def ask(backend, prompt):
+    from chatcore.backends import Usage
+
+    request = backend.build_request([{"role": "user", "content": prompt}], INSTRUCTIONS)
+    async for delta in backend.stream_reply(request, Usage()):
+        sys.stdout.write(delta)
+        sys.stdout.flush()
+    print()
+
+parser = argparse.ArgumentParser(description="Search the local README index, and optionally ask a model about "
+                                             "the best matching sections.")
+parser.add_argument("question", nargs="+")
+parser.add_argument("--limit", type=int, default=SEARCH_RESULTS,
+                    help=f"how many sections to show or send (default: {SEARCH_RESULTS})")
+parser.add_argument("--ask", action="store_true", help="send the best sections and the question to a model")
+parser.add_argument("--model", default="gpt-4o", help="model to ask: claude, gpt-4o or groq (default: gpt-4o)")
+parser.add_argument("--index", help="index file to use (default: ~/.docshunter/readme-index.sqlite3)")
+args = parser.parse_args()
+question = " ".join(args.question)
+
+index = open_index(args.index)
+start_time = time.monotonic()
+results = index.search(question, args.limit)
+elapsed = time.monotonic() - start_time
+if not results:
+    readme_count, _ = index.counts()
+    sys.exit("No README sections match the question." if readme_count
+             else "The index is empty. Run get-docs.py to add a directory's READMEs to it.")
+
+if not args.ask:
+    for path, headings, first_line, last_line, text in results:
+        print(f"{path}:{first_line}-{last_line}" + (f"  [{headings}]" if headings else ""))
+        print("    " + text.replace("\n", "\n    ") + "\n")
+    print(f"{len(results)} section{'s' if len(results) != 1 else ''} in {elapsed * 1000:.1f}ms")
+    sys.exit()
+
+from chatcore.backends import BACKENDS
+
+if args.model not in BACKENDS:
+    sys.exit(f"Unknown model {args.model}; choose from {', '.join(sorted(BACKENDS))}.")
+backend = BACKENDS[args.model]()
+prompt, sent = passages_prompt(question, results, backend.tokenizer)
+print(f"Sending {sent} README section{'s' if sent != 1 else ''} to {backend.label}...\n", file=sys.stderr)
+asyncio.run(ask(backend, prompt))
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# The tests import chatcore from the root of the repository, as the chat clients do.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+class FakeTokenizer:
+    """Counts words as tokens, so that tests needn't load a tiktoken encoding."""
+
+    id = "test"
+
+    def count(self, text: str) -> int:
+        return len(text.split())
+
+    def count_batch(self, texts: list[str]) -> list[int]:
+        return [self.count(text) for text in texts]
+
+@pytest.fixture
+def tokenizer():
+    return FakeTokenizer()
@@ -0,0 +1,39 @@
+from chatcore import backends
+from chatcore.backends import AnthropicBackend
+from chatcore.history import LazyContent
+from chatcore.ingest import directory_upload_prompt, file_upload_prompt
+
+def cached(request_messages: list) -> list[int]:
+    """Returns the indices of the messages with a prompt-cache breakpoint."""
+    return [index for index, message in enumerate(request_messages)
+            if isinstance(message["content"], list) and message["content"][0].get("cache_control")]
+
+def test_breakpoints_go_on_the_most_recent_uploads_and_the_newest_message(monkeypatch):
+    monkeypatch.setattr(backends, "CACHED_UPLOADS", 2)
+    uploads = [directory_upload_prompt("# repo"), file_upload_prompt("a.py", "print()"),
+               file_upload_prompt("b.py", "pass")]
+    messages = []
+    for upload in uploads:
+        messages += [{"role": "user", "content": upload}, {"role": "assistant", "content": "Read it.", "model": "claude"}]
+    messages.append({"role": "user", "content": "What do they do?"})
+
+    request = AnthropicBackend.build_request_messages(messages)
+    assert cached(request) == [2, 4, 6]
+    assert request[6] == {"role": "user", "content": [{"type": "text", "text": "What do they do?",
+                                                       "cache_control": {"type": "ephemeral"}}]}
+    # Everything else is sent as plain text, without the keys only the history keeps.
+    assert request[0] == {"role": "user", "content": uploads[0]}
+    assert request[1] == {"role": "assistant", "content": "Read it."}
+
+def test_uploads_left_on_disk_are_read_into_the_request(tmp_path):
+    path = tmp_path / "chat.jsonl"
+    line = '{"role": "user", "content": "' + file_upload_prompt("a.py", "pass").replace("\n", "\\n") + '"}\n'
+    path.write_text(line, encoding="utf-8")
+    messages = [{"role": "user", "content": LazyContent(str(path), 0, len(line.encode()))}]
+
+    request = AnthropicBackend.build_request_messages(messages)
+    assert request[0]["content"][0]["text"] == file_upload_prompt("a.py", "pass")
+    assert cached(request) == [0]
+
+def test_an_empty_history_has_no_breakpoints():
+    assert AnthropicBackend.build_request_messages([]) == []
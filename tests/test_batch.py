@@ -0,0 +1,26 @@
+import asyncio
+import json
+
+import pytest
+
+from chatcore.batch import BatchRunner, load_jobs
+
+def write_jobs(tmp_path, *entries):
+    path = tmp_path / "jobs.jsonl"
+    path.write_text("".join(json.dumps(entry) + "\n" for entry in entries), encoding="utf-8")
+    return str(path)
+
+def test_string_uploads_fail_the_job_without_being_read(tmp_path, monkeypatch):
+    jobs = load_jobs([], write_jobs(tmp_path, {"id": "bad", "prompt": "Review it.", "uploads": "~/src/app"},
+                                    {"id": "good", "prompt": "Hello.", "uploads": ["a.py"]}))
+    assert jobs[0].uploads == [] and jobs[0].error == '"uploads" must be a list of paths'
+    assert jobs[1].uploads == ["a.py"] and jobs[1].error is None
+
+    runner = BatchRunner("claude", str(tmp_path), 1, 1)
+    monkeypatch.setattr(runner, "read_upload", lambda *args: pytest.fail("the upload was read"))
+    result = asyncio.run(runner.run_job(jobs[0], asyncio.Semaphore(1)))
+    assert result["error"] == '"uploads" must be a list of paths'
+
+def test_non_string_model_fails_the_job(tmp_path):
+    jobs = load_jobs([], write_jobs(tmp_path, {"prompt": "Hello.", "model": 4}))
+    assert jobs[0].model is None and jobs[0].error == '"model" must be a string'
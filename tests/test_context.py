@@ -0,0 +1,49 @@
+from chatcore.context import ContextWindow
+from chatcore.ingest import file_upload_prompt
+
+def turn(prompt: str, reply: str) -> list[dict]:
+    return [{"role": "user", "content": prompt}, {"role": "assistant", "content": reply}]
+
+def test_everything_is_sent_while_under_budget(tokenizer):
+    messages = turn("one two", "three") + turn("four", "five six")
+    assert ContextWindow(100, tokenizer).select(messages) == (messages, 6, 0)
+
+def test_the_oldest_turns_are_left_out_over_budget(tokenizer):
+    messages = turn("a " * 10, "b " * 10) + turn("c " * 10, "d " * 10) + turn("e " * 10, "f " * 10)
+    selected, total, left_out = ContextWindow(45, tokenizer).select(messages)
+    assert selected == messages[2:] and total == 40 and left_out == 2
+
+def test_the_newest_turn_is_sent_even_when_it_is_over_budget(tokenizer):
+    messages = turn("old", "reply") + [{"role": "user", "content": "word " * 50}]
+    assert ContextWindow(10, tokenizer).select(messages) == (messages[2:], 50, 2)
+
+def test_system_messages_and_the_latest_upload_are_always_sent(tokenizer):
+    upload = file_upload_prompt("notes.txt", "word " * 20)
+    messages = ([{"role": "system", "content": "Be brief."}] + turn(file_upload_prompt("old.txt", "x"), "Read it.")
+                + turn(upload, "Read it.") + turn("a " * 10, "b " * 10) + turn("What's in it?", "Words."))
+    window = ContextWindow(40, tokenizer)
+    selected, total, left_out = window.select(messages)
+    assert selected == messages[:1] + messages[3:5] + messages[7:]
+    assert left_out == 4
+    assert total == sum(window.token_counts[index] for index in (0, 3, 4, 7, 8))
+
+def test_messages_are_only_counted_once_until_removed(tokenizer):
+    counted = []
+
+    class CountingTokenizer(type(tokenizer)):
+        def count(self, text):
+            counted.append(text)
+            return super().count(text)
+
+    window = ContextWindow(100, CountingTokenizer())
+    messages = turn("one", "two")
+    window.select(messages)
+    messages += turn("three", "four")
+    window.select(messages)
+    assert counted == ["one", "two", "three", "four"]
+
+    del messages[2:]
+    window.truncate(2)
+    messages += turn("five", "six")
+    window.select(messages)
+    assert counted[4:] == ["five", "six"]
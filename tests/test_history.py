@@ -0,0 +1,61 @@
+import json
+import os
+
+from chatcore import history
+from chatcore.history import ChatCatalogue, ChatWriter, LazyContent, load_chat, message_content
+
+def save_chat(chat_dir, catalogue, prompt):
+    chat_dir.mkdir()
+    writer = ChatWriter(str(chat_dir), catalogue)
+    writer.save([{"role": "user", "content": prompt}, {"role": "assistant", "content": "A reply."}])
+    return writer.path
+
+def test_chats_whose_files_have_gone_are_dropped_from_the_catalogue(tmp_path, tokenizer):
+    catalogue = ChatCatalogue(str(tmp_path), tokenizer)
+    kept = save_chat(tmp_path / "a", catalogue, "How do sockets work?")
+    deleted = save_chat(tmp_path / "b", catalogue, "How do sockets close?")
+    assert {row["path"] for row in catalogue.recent(10)} == {kept, deleted}
+
+    os.remove(deleted)
+    assert [row["path"] for row in catalogue.recent(10)] == [kept]
+    assert [row["path"] for row in catalogue.search("sockets")] == [kept]
+
+def test_chats_are_saved_a_message_per_line_and_only_new_messages_are_appended(tmp_path):
+    writer = ChatWriter(str(tmp_path))
+    messages = [{"role": "user", "content": "Hello."}, {"role": "assistant", "content": "Hi.", "model": "claude"}]
+    writer.save(messages)
+    messages.append({"role": "user", "content": "Bye."})
+    writer.save(messages)
+    with open(writer.path, encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == messages
+
+    # A history that was rewritten, e.g. by undoing a turn, replaces the file.
+    writer.save(messages[:1])
+    assert load_chat(writer.path) == messages[:1]
+
+def test_a_line_torn_by_a_crash_is_dropped(tmp_path):
+    path = tmp_path / "chat.jsonl"
+    path.write_text('{"role": "user", "content": "Hello."}\n{"role": "assistant", "con', encoding="utf-8")
+    assert load_chat(str(path)) == [{"role": "user", "content": "Hello."}]
+
+def test_long_messages_are_left_on_disk_until_needed(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, "LAZY_CONTENT_BYTES", 100)
+    upload = "Please analyse the contents of the following file:\n" + "line \"quoted\" ünïcode\n" * 20
+    writer = ChatWriter(str(tmp_path))
+    writer.save([{"role": "user", "content": upload}, {"role": "assistant", "content": "Done.", "model": "groq"},
+                 {"role": "assistant", "content": "x" * 200, "model": "gpt-4o"}])
+
+    messages = load_chat(writer.path)
+    assert isinstance(messages[0]["content"], LazyContent)
+    assert messages[1] == {"role": "assistant", "content": "Done.", "model": "groq"}
+    assert messages[2]["model"] == "gpt-4o"
+    assert message_content(messages[0]) == upload
+    assert message_content(messages[2]) == "x" * 200
+
+    # Saving a resumed chat writes the content itself, not the reference to it.
+    messages.append({"role": "user", "content": "Thanks."})
+    resumed = ChatWriter(str(tmp_path))
+    resumed.path = str(tmp_path / "resumed.jsonl")
+    resumed.save(messages)
+    with open(resumed.path, encoding="utf-8") as f:
+        assert json.loads(f.readline())["content"] == upload
@@ -0,0 +1,66 @@
+import os
+import sqlite3
+
+from chatcore.ingest import DirectoryTree, IgnoreMatcher, UploadCache, walk_directory
+
+def entries(directory):
+    return {entry.name: entry for entry in os.scandir(directory)}
+
+def test_upload_caches_sharing_a_file_do_not_lock_each_other_out(tmp_path, tokenizer):
+    for name in ("a.py", "b.py"):
+        (tmp_path / name).write_text(f"print('{name}')\n")
+    files = entries(tmp_path)
+    cache_path = str(tmp_path / "cache" / "uploads.sqlite3")
+    first = UploadCache(cache_path, tokenizer)
+    second = UploadCache(cache_path, tokenizer)
+    first.store(files["a.py"], "a.py", "section a", 3)
+    # The first upload hasn't finished, and must not be holding the cache's write lock.
+    second.store(files["b.py"], "b.py", "section b", 3)
+    second.close()
+    first.close()
+
+    third = UploadCache(cache_path, tokenizer)
+    assert third.lookup(files["a.py"], "a.py") == ("section a", 3)
+    assert third.lookup(files["b.py"], "b.py") == ("section b", 3)
+    third.close()
+
+def test_a_locked_cache_does_not_fail_the_upload(tmp_path, tokenizer):
+    (tmp_path / "a.py").write_text("print('a')\n")
+    files = entries(tmp_path)
+    cache = UploadCache(str(tmp_path / "cache" / "uploads.sqlite3"), tokenizer)
+    cache.db.execute("PRAGMA busy_timeout = 0")
+    cache.store(files["a.py"], "a.py", "section a", 3)
+    holder = sqlite3.connect(str(tmp_path / "cache" / "uploads.sqlite3"))
+    holder.execute("BEGIN EXCLUSIVE")
+    try:
+        assert cache.lookup(files["a.py"], "a.py") is None
+        cache.close()
+    finally:
+        holder.rollback()
+        holder.close()
+
+def test_default_patterns_naming_a_file_or_directory_are_ignored(tmp_path):
+    for path in ("Pipfile", ".DS_Store", "src/.DS_Store", ".idea/workspace.xml", "htmlcov/index.html",
+                 "src/app.py", "src/Pipfile.txt"):
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text("x\n")
+    matcher = IgnoreMatcher(str(tmp_path))
+    uploaded = {os.path.relpath(entry.path, tmp_path) for entry in walk_directory(str(tmp_path), matcher)}
+    assert uploaded == {os.path.join("src", "app.py"), os.path.join("src", "Pipfile.txt")}
+
+def directory_tree(*directories):
+    tree = DirectoryTree("/repo")
+    for directory in directories:
+        tree.add_directory(directory)
+    return tree
+
+def test_directory_trees_are_drawn_like_tree():
+    tree = directory_tree("a", "a/b", "a/b/c", "e")
+    assert tree.render() == "/repo\n├── a\n│   └── b\n│       └── c\n└── e\n\n4 directories"
+
+def test_directory_trees_stop_at_their_depth_and_entry_limits():
+    tree = directory_tree("a", "a/b", "a/b/c", "a/b/c/d", "e", "f")
+    assert tree.render(max_depth=2) == ("/repo\n├── a\n│   └── b\n├── e\n└── f\n"
+                                        "... 2 more directories not shown\n\n6 directories")
+    assert tree.render(max_entries=3) == ("/repo\n├── a\n│   └── b\n│       └── c\n"
+                                          "... 3 more directories not shown\n\n6 directories")
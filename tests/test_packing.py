@@ -0,0 +1,18 @@
+from chatcore.packing import UploadFile, count_term, pack_files
+
+def upload_file(index: int, relative_path: str, contents: str) -> UploadFile:
+    section = f"## {relative_path}\n\n```\n{contents}\n```\n\n"
+    return UploadFile(index, relative_path, section, len(section.split()), len(section), 0.0)
+
+def test_terms_match_whole_identifiers():
+    assert count_term("foo17", "import foo17\nfoo17.run()") == 2
+    assert count_term("foo17", "import foo171, foo172") == 0
+    assert count_term("parse", "def parse_item(): parse()") == 2
+
+def test_a_file_named_in_the_question_is_not_outranked_by_similar_names(tokenizer):
+    files = [upload_file(0, "foo17.py", "def run():\n" + "    step()\n" * 190)]
+    files += [upload_file(index, f"foo17{index}.py", f"value = foo17{index}0 + foo17{index}1\n" + "x = 1\n" * 30)
+              for index in range(1, 10)]
+    body, tokens, left_out = pack_files(files, 1000, tokenizer, query="What does foo17 do?")
+    assert left_out > 0
+    assert "## foo17.py\n" in body
@@ -0,0 +1,72 @@
+import os
+import sys
+
+# docshunter's scripts import readme_index from their own directory.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "docshunter"))
+
+from readme_index import ReadmeIndex, split_sections
+
+README = """# vpc
+
+Creates a VPC.
+
+## Inputs
+
+```hcl
+# not a heading
+cidr_block = "10.0.0.0/16"
+```
+
+### Flow logs
+
+Set enable_flow_logs to send traffic logs to CloudWatch.
+
+## Outputs
+
+vpc_id
+"""
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+def test_readmes_are_split_at_headings_outside_code_blocks():
+    sections = split_sections(README)
+    assert [headings for headings, *_ in sections] == ["vpc", "vpc > Inputs", "vpc > Inputs > Flow logs",
+                                                      "vpc > Outputs"]
+    assert sections[1][1:3] == (5, 11)
+    assert "cidr_block" in sections[1][3]
+
+def test_heading_matches_rank_first(tmp_path):
+    write(tmp_path / "modules" / "vpc" / "README.md", README)
+    write(tmp_path / "README.md", "# Products\n\nThe network product mentions flow logs in passing.\n")
+    write(tmp_path / ".terraform" / "modules" / "vpc" / "README.md", README)
+    index = ReadmeIndex(str(tmp_path / "index.sqlite3"))
+    assert index.update(str(tmp_path)) == (2, 2)
+    results = index.search("How do I enable flow logs?")
+    assert results[0][:2] == (str(tmp_path / "modules" / "vpc" / "README.md"), "vpc > Inputs > Flow logs")
+
+def test_only_changed_readmes_are_indexed_again(tmp_path):
+    write(tmp_path / "a" / "README.md", README)
+    write(tmp_path / "b" / "README.md", "# b\n\nS3 buckets.\n")
+    index = ReadmeIndex(str(tmp_path / "index.sqlite3"))
+    read = []
+    assert index.update(str(tmp_path), read.append) == (2, 2)
+    assert index.update(str(tmp_path), read.append) == (2, 0)
+    write(tmp_path / "b" / "README.md", "# b\n\nS3 buckets and lifecycle rules.\n")
+    (tmp_path / "a" / "README.md").unlink()
+    assert index.update(str(tmp_path), read.append) == (1, 2)
+    assert read[2:] == [str(tmp_path / "b" / "README.md")]
+    assert index.search("vpc") == []
+    assert index.counts() == (1, 1)
+
+def test_nested_roots_are_indexed_separately(tmp_path):
+    write(tmp_path / "inner" / "README.md", README)
+    index = ReadmeIndex(str(tmp_path / "index.sqlite3"))
+    assert index.update(str(tmp_path)) == (1, 1)
+    assert index.update(str(tmp_path / "inner")) == (1, 1)
+    assert index.update(str(tmp_path)) == (1, 0)
+    assert index.update(str(tmp_path / "inner")) == (1, 0)
+    # The README is indexed under both roots, but each of its sections is only found once.
+    assert len(index.search("vpc_id")) == 1
+    assert index.counts() == (1, 4)
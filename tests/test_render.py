@@ -0,0 +1,135 @@
+import io
+
+import pytest
+
+from rich.console import Console
+from rich.markdown import Markdown
+
+from chatcore.render import StreamingMarkdown
+
+SAMPLE = """# Title
+
+Intro paragraph with `code`.
+
+```python
+def f():
+
+    return 1
+```
+
+After the fence.
+```
+fence straight after a paragraph
+```
+- item one
+- item two
+
+  continued item two
+
+- item three
+
+1. first
+2. second
+
+10) tenth
+
+**Bold** start of a paragraph, and a line long enough to arrive over several deltas.
+
+-1 is not a list item.
+
+Indented code:
+
+    x = 1
+
+    y = 2
+
+> quote
+
+Last line.
+"""
+
+# Fences that contain other fences: only a line of the same character, at least as long, closes one.
+NESTED_FENCES = """Nested fences:
+
+````markdown
+```bash
+echo hi
+```
+````
+
+After the nested fence.
+
+```
+~~~
+still code
+```
+
+~~~~
+```
+~~~
+still code
+~~~~
+
+Done.
+"""
+
+# Tables keep their padding rows, and HTML blocks render nothing but are spaced as a block.
+TABLES_AND_HTML = """<p>html first</p>
+
+| a | b |
+|---|---|
+| 1 | 2 |
+
+Between.
+
+<div>
+html block
+</div>
+
+End.
+"""
+
+class RecordingLive:
+    """Stands in for rich's Live, keeping only the last update, as the display is left showing it."""
+
+    def __init__(self, console: Console):
+        self.console = console
+        self.renderable = None
+
+    def update(self, renderable):
+        self.renderable = renderable
+
+def make_console() -> Console:
+    return Console(file=io.StringIO(), width=60, force_terminal=True, color_system="truecolor")
+
+def one_shot(text: str) -> str:
+    console = make_console()
+    console.print(Markdown(text))
+    return console.file.getvalue().strip("\n")
+
+def streamed(text: str, delta_size: int) -> tuple[str, str]:
+    console = make_console()
+    live = RecordingLive(console)
+    stream = StreamingMarkdown(live, refresh_per_second=1e9)  # refreshed on every delta
+    for start in range(0, len(text), delta_size):
+        stream.feed(text[start:start + delta_size])
+    message = stream.finish()
+    console.print(live.renderable)
+    return console.file.getvalue().strip("\n"), message
+
+@pytest.mark.parametrize("text", [SAMPLE, NESTED_FENCES, TABLES_AND_HTML])
+@pytest.mark.parametrize("delta_size", [1, 3, 16, 100, 10000])
+def test_streamed_output_matches_a_single_render(text, delta_size):
+    output, message = streamed(text, delta_size)
+    assert message == text
+    assert output == one_shot(text)
+
+def test_complete_blocks_are_frozen():
+    console = make_console()
+    live = RecordingLive(console)
+    stream = StreamingMarkdown(live, refresh_per_second=1e9)
+    stream.feed("First paragraph.\n\nSecond paragraph.\n\n- a list")
+    # The list has started but its first line isn't complete yet, so only the first paragraph is known to be.
+    assert stream.tail == "Second paragraph.\n\n- a list"
+    stream.feed("\n\nAfter the list.\n")
+    assert stream.tail == "After the list.\n"
@@ -0,0 +1,66 @@
+from chatcore.retrieval import RetrievalIndex, chunk_text, detect_retrieval_request
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+def test_detect_retrieval_request(tmp_path):
+    assert detect_retrieval_request(f"Retrieve: {tmp_path}") == str(tmp_path)
+    assert detect_retrieval_request("Retrieve: OFF") == "OFF"
+    assert detect_retrieval_request("What is retrieval?") is None
+
+def test_chunks_end_at_blank_lines_and_cover_every_line():
+    text = "\n\n".join(f"paragraph {index}\n" + "word " * 100 for index in range(20))
+    chunks = chunk_text(text)
+    assert len(chunks) > 1
+    assert chunks[0][0] == 1 and chunks[-1][1] == text.count("\n") + 1
+    for (_, last, chunk), (first, _, _) in zip(chunks, chunks[1:]):
+        assert first == last + 1
+        assert chunk.endswith("\n") or not chunk.split("\n")[-1].strip()
+
+def test_only_changed_files_are_indexed_again(tmp_path):
+    root = tmp_path / "repo"
+    write(root / "server.py", "def start_server():\n    listen()\n")
+    write(root / "client.py", "def connect():\n    send()\n")
+    index = RetrievalIndex(str(tmp_path / "index.sqlite3"))
+    assert index.update(str(root)) == (2, 2)
+    assert index.update(str(root)) == (2, 0)
+
+    write(root / "client.py", "def connect():\n    reconnect()\n")
+    (root / "server.py").unlink()
+    assert index.update(str(root)) == (1, 2)
+    assert index.search(str(root), "start_server") == []
+    assert [path for path, *_ in index.search(str(root), "reconnect")] == ["client.py"]
+
+def test_path_matches_rank_above_text_matches(tmp_path):
+    write(tmp_path / "retry.py", "def backoff():\n    pass\n")
+    write(tmp_path / "notes.md", "We talk about retry once here.\n")
+    index = RetrievalIndex(str(tmp_path / "index.sqlite3"))
+    index.update(str(tmp_path))
+    assert [path for path, *_ in index.search(str(tmp_path), "retry")] == ["retry.py", "notes.md"]
+
+def test_query_syntax_is_not_interpreted(tmp_path):
+    write(tmp_path / "a.py", "value = 1\n")
+    index = RetrievalIndex(str(tmp_path / "index.sqlite3"))
+    index.update(str(tmp_path))
+    assert index.search(str(tmp_path), 'value" OR NEAR(x* AND') != []
+
+def test_nested_roots_are_indexed_separately(tmp_path):
+    outer = tmp_path / "outer"
+    write(outer / "inner" / "module.py", "def handler():\n    pass\n")
+    index = RetrievalIndex(str(tmp_path / "index.sqlite3"))
+    assert index.update(str(outer)) == (1, 1)
+    assert index.update(str(outer / "inner")) == (1, 1)
+    # Neither takes the file over from the other, so both stay up to date.
+    assert index.update(str(outer)) == (1, 0)
+    assert index.update(str(outer / "inner")) == (1, 0)
+    assert [path for path, *_ in index.search(str(outer), "handler")] == ["inner/module.py"]
+    assert [path for path, *_ in index.search(str(outer / "inner"), "handler")] == ["module.py"]
+
+def test_files_are_indexed_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr("chatcore.retrieval.INDEX_BATCH_FILES", 2)
+    for index in range(5):
+        write(tmp_path / "repo" / f"module{index}.py", f"def handler{index}():\n    pass\n")
+    index = RetrievalIndex(str(tmp_path / "index.sqlite3"))
+    assert index.update(str(tmp_path / "repo")) == (5, 5)
+    assert [path for path, *_ in index.search(str(tmp_path / "repo"), "handler4")] == ["module4.py"]
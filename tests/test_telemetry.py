@@ -0,0 +1,44 @@
+import json
+
+from datetime import datetime, timedelta
+
+from chatcore.telemetry import StageTimes, TelemetryLog, load_records, percentile, summarise
+
+def test_percentiles_are_nearest_rank():
+    values = list(range(1, 11))
+    assert [percentile(values, percent) for percent in (0, 50, 90, 99, 100)] == [1, 5, 9, 10, 10]
+    assert percentile([7], 99) == 7
+
+def test_stage_times_add_up_each_time_a_stage_is_entered():
+    times = StageTimes()
+    times.add("read", 0.5)
+    times.add("read", 0.25)
+    upload = StageTimes()
+    upload.add("walk", 1.0)
+    times.merge(upload, prefix="ingest_")
+    assert times.seconds == {"read": 0.75, "ingest_walk": 1.0}
+
+def test_records_are_filtered_by_model_and_age(tmp_path):
+    log = TelemetryLog(str(tmp_path))
+    log.record({"model": "claude", "seconds": {"total": 1.23456789}})
+    log.record({"model": "groq", "seconds": {"total": 0.5}})
+    old = (datetime.now() - timedelta(days=3)).isoformat(timespec="seconds")
+    with open(log.path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"time": old, "model": "claude", "seconds": {"total": 9.0}}) + "\n")
+        f.write('{"time": "torn')
+
+    assert [record["seconds"]["total"] for record in load_records(log.path)] == [1.234568, 0.5, 9.0]
+    assert [record["seconds"]["total"] for record in load_records(log.path, "claude")] == [1.234568, 9.0]
+    assert [record["seconds"]["total"] for record in load_records(log.path, days=1)] == [1.234568, 0.5]
+    assert load_records(str(tmp_path / "missing.jsonl")) == []
+
+def test_summaries_sort_each_models_values_and_skip_what_was_not_recorded():
+    records = [{"model": "claude", "seconds": {"first_token": 0.4, "total": 2.0}, "output_tokens": 300},
+               {"model": "claude", "seconds": {"first_token": 0.2, "total": 1.0}, "output_tokens": 100,
+                "cache_read_tokens": None},
+               {"model": "groq", "seconds": {"total": 0.5}, "tokens_per_second": 500.0}]
+    assert summarise(records) == {
+        "claude": [("Time to first token", "ms", [200.0, 400.0]), ("Total", "ms", [1000.0, 2000.0]),
+                   ("Output tokens", "tokens", [100, 300])],
+        "groq": [("Total", "ms", [500.0]), ("Output rate", "tokens/s", [500.0])],
+    }
@@ -0,0 +1,66 @@
+import threading
+import time
+
+import pytest
+import tiktoken
+
+from chatcore import tokens
+from chatcore.tokens import Tokenizer
+
+class FakeEncoding:
+    def __init__(self, name):
+        self.name = name
+
+    def encode_ordinary(self, text):
+        return text.split()
+
+    def encode_ordinary_batch(self, texts, num_threads):
+        return [text.split() for text in texts]
+
+@pytest.fixture
+def loads(monkeypatch):
+    """Replaces tiktoken's loading with a fake, and returns the names of the encodings it was asked for."""
+    loaded = []
+
+    def get_encoding(name):
+        loaded.append(name)
+        time.sleep(0.01)  # long enough for threads to race each other to the load
+        return FakeEncoding(name)
+
+    def encoding_for_model(model):
+        if model != "known-model":
+            raise KeyError(model)
+        return get_encoding("model-encoding")
+
+    monkeypatch.setattr(tokens, "_encodings", {})
+    monkeypatch.setattr(tiktoken, "get_encoding", get_encoding)
+    monkeypatch.setattr(tiktoken, "encoding_for_model", encoding_for_model)
+    return loaded
+
+def test_each_encoding_is_loaded_once_per_process(loads):
+    first = Tokenizer("cl100k_base")
+    second = Tokenizer("cl100k_base", ratio=1.15)
+    assert first.get_encoding() is second.get_encoding()
+    assert first.count("one two three") == 3
+    assert loads == ["cl100k_base"]
+
+def test_concurrent_first_uses_share_one_load(loads):
+    tokenizer = Tokenizer("cl100k_base")
+    threads = [threading.Thread(target=tokenizer.count, args=("a b",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loads == ["cl100k_base"]
+
+def test_unknown_models_fall_back_to_the_named_encoding(loads):
+    assert Tokenizer("o200k_base", model="known-model").id == "model-encoding"
+    assert Tokenizer("o200k_base", model="unknown-model").id == "o200k_base"
+    assert loads == ["model-encoding", "o200k_base"]
+
+def test_counts_are_scaled_by_the_ratio(loads):
+    tokenizer = Tokenizer("cl100k_base", ratio=1.15)
+    assert tokenizer.id == "cl100k_base*1.15"
+    assert tokenizer.count("one two three four five six seven eight nine ten") == 12
+    assert tokenizer.count_batch(["one", "one two", ""]) == [2, 3, 0]
+    assert tokenizer.count_batch([]) == []